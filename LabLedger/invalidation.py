@@ -0,0 +1,219 @@
+"""
+Invalidation bus: tells every worker process what to drop from its caches.
+
+A write publishes a "topic:argument" message once its transaction commits.
+The writing process handles it right away, and every process runs a
+listener thread that hands the messages of the others to the handlers
+subscribed to their topic. INVALIDATION_BUS picks how messages travel:
+
+- ``postgres``: NOTIFY on the default database, LISTEN on a connection of
+  the listener's own. Delivery takes milliseconds.
+- ``sqlite``: rows appended to the INVALIDATION_SQLITE_PATH file, polled
+  every INVALIDATION_POLL_INTERVAL seconds, for single hosts on databases
+  without notifications.
+- ``off``: messages stay in the process that published them.
+
+Messages sent while a listener wasn't listening (it was starting or had
+lost its connection) can't be recovered, so handlers are then called with
+None and must drop everything under their topic.
+"""
+import logging
+import os
+import select
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'labledger_invalidation'
+# Seconds a Postgres listener waits for a notification before checking
+# whether it should stop.
+LISTEN_TIMEOUT = 5.0
+# Seconds before a listener that failed tries again.
+RECONNECT_DELAY = 5.0
+# Seconds SQLite rows are kept for pollers, and how often they are pruned.
+SQLITE_RETENTION = 300
+SQLITE_PRUNE_EVERY = 100
+
+_subscribers = defaultdict(list)
+
+
+def subscribe(topic, handler):
+    """Call `handler(argument)` for every message of `topic`, None after a gap."""
+    _subscribers[topic].append(handler)
+
+
+def dispatch(message):
+    topic, _, argument = message.partition(':')
+    for handler in _subscribers.get(topic, ()):
+        try:
+            handler(argument)
+        except Exception:
+            logger.exception('Invalidation handler failed for %r.', message)
+
+
+def dispatch_gap():
+    for topic, handlers in list(_subscribers.items()):
+        for handler in handlers:
+            try:
+                handler(None)
+            except Exception:
+                logger.exception('Invalidation handler failed to reset %r.', topic)
+
+
+def publish(topic, argument, using=DEFAULT_DB_ALIAS):
+    """Send `topic:argument` to every process once the transaction commits."""
+    message = f'{topic}:{argument}'
+
+    def send():
+        dispatch(message)
+        bus = get_bus()
+        if bus is None:
+            return
+        try:
+            bus.send(message)
+        except (DatabaseError, sqlite3.Error, OSError):
+            logger.warning('Invalidation bus unavailable; %r not sent.', message, exc_info=True)
+
+    transaction.on_commit(send, using=using)
+
+
+class PostgresBus:
+    def __init__(self, alias=DEFAULT_DB_ALIAS):
+        self.alias = alias
+
+    def send(self, message):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, message])
+
+    def listen(self, stopped):
+        """Dispatch notifications until `stopped` is set."""
+        wrapper = connections[self.alias]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            dispatch_gap()
+            while not stopped.is_set():
+                if select.select([connection], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    dispatch(connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+
+class SQLiteBus:
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.local = threading.local()
+        self.sent = 0
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS invalidation '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, sent REAL NOT NULL)'
+        )
+        return connection
+
+    def send(self, message):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self._connect()
+        now = time.time()
+        connection.execute('INSERT INTO invalidation (message, sent) VALUES (?, ?)', (message, now))
+        self.sent += 1
+        if self.sent % SQLITE_PRUNE_EVERY == 0:
+            connection.execute('DELETE FROM invalidation WHERE sent < ?', (now - SQLITE_RETENTION,))
+
+    def listen(self, stopped):
+        """Dispatch the rows sent since listening started until `stopped` is set."""
+        connection = self._connect()
+        try:
+            (last,) = connection.execute('SELECT COALESCE(MAX(id), 0) FROM invalidation').fetchone()
+            dispatch_gap()
+            while not stopped.wait(self.interval):
+                rows = connection.execute(
+                    'SELECT id, message FROM invalidation WHERE id > ? ORDER BY id', (last,),
+                ).fetchall()
+                for last, message in rows:
+                    dispatch(message)
+        finally:
+            connection.close()
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus():
+    """The bus INVALIDATION_BUS names, or None when it is off."""
+    kind = settings.INVALIDATION_BUS
+    if kind == 'off':
+        return None
+    with _buses_lock:
+        bus = _buses.get(kind)
+        if bus is None:
+            if kind == 'postgres':
+                bus = PostgresBus()
+            elif kind == 'sqlite':
+                bus = SQLiteBus(settings.INVALIDATION_SQLITE_PATH, settings.INVALIDATION_POLL_INTERVAL)
+            else:
+                raise ValueError(f'Unsupported INVALIDATION_BUS: {kind!r}')
+            _buses[kind] = bus
+    return bus
+
+
+class Listener:
+    """A daemon thread listening on `bus`, reconnecting when it fails."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='invalidation-listener', daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.bus.listen(self.stopped)
+            except Exception:
+                logger.warning('Invalidation listener failed; retrying.', exc_info=True)
+                self.stopped.wait(RECONNECT_DELAY)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def ensure_listener():
+    """Start this process's listener, once, and again in forked children."""
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        bus = get_bus()
+        _listener = Listener(bus) if bus is not None else None
+        if _listener is not None:
+            _listener.start()
+        _listener_pid = os.getpid()
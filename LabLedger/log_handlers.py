@@ -0,0 +1,26 @@
+import logging.handlers
+import os
+
+
+class PerProcessRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler that writes to `<filename>.<pid>`. Several gunicorn
+    workers can't share one rotating file: each rolls it over on its own and
+    loses the others' lines. This way every worker appends to and rotates a
+    file of its own; readers glob `<filename>.*`. The file is opened on the
+    first record, so after the fork.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        self.base_name = os.path.abspath(filename)
+        self.pid = os.getpid()
+        kwargs['delay'] = True
+        super().__init__(f'{self.base_name}.{self.pid}', *args, **kwargs)
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            # Forked: leave the parent's file to the parent.
+            self.stream = None
+            self.pid = os.getpid()
+            self.baseFilename = f'{self.base_name}.{self.pid}'
+        super().emit(record)
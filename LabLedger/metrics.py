@@ -0,0 +1,116 @@
+"""
+Prometheus metrics, served at /metrics/ when METRICS_ENABLED is on.
+
+prometheus_client is only imported once metrics are enabled. Under gunicorn,
+point PROMETHEUS_MULTIPROC_DIR at a directory shared by the workers (see
+gunicorn.conf.py): each worker then keeps its samples in memory-mapped files
+there, and the endpoint adds them up across workers.
+"""
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUOTA_CHECK_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class Metrics:
+    """The application's metric objects."""
+
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+
+        self.request_duration = Histogram(
+            'labledger_request_duration_seconds', 'Request latency by resolved URL name.',
+            ['url_name', 'method', 'status'], buckets=REQUEST_BUCKETS,
+        )
+        self.db_queries = Counter(
+            'labledger_db_queries_total', 'Database queries run by requests.', ['url_name'],
+        )
+        self.db_duration = Counter(
+            'labledger_db_query_duration_seconds_total', 'Time requests spent in database queries.', ['url_name'],
+        )
+        self.upload_bytes = Counter(
+            'labledger_upload_bytes_total', 'Bytes received in multipart uploads.', ['url_name'],
+        )
+        self.audit_log_failures = Counter(
+            'labledger_audit_log_failures_total', 'Audit log entries that could not be written.',
+            ['model_name', 'action'],
+        )
+        self.quota_check_duration = Histogram(
+            'labledger_quota_check_duration_seconds', 'Time spent checking report storage quotas.',
+            ['quota'], buckets=QUOTA_CHECK_BUCKETS,
+        )
+
+
+def get_metrics():
+    """The metric objects, created on first use, or None when metrics are off."""
+    global _metrics
+    if not settings.METRICS_ENABLED:
+        return None
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+def observe_request(url_name, method, status, seconds, queries, db_seconds, upload_bytes):
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.request_duration.labels(url_name, method, str(status)).observe(seconds)
+    metrics.db_queries.labels(url_name).inc(queries)
+    metrics.db_duration.labels(url_name).inc(db_seconds)
+    if upload_bytes:
+        metrics.upload_bytes.labels(url_name).inc(upload_bytes)
+
+
+def record_audit_log_failure(model_name, action):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.audit_log_failures.labels(model_name, action).inc()
+
+
+@contextmanager
+def time_quota_check(quota):
+    metrics = get_metrics()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.quota_check_duration.labels(quota).observe(time.perf_counter() - start)
+
+
+def metrics_view(request):
+    """
+    Prometheus exposition of all metrics. Answers 404 while metrics are off,
+    and only to "Authorization: Bearer <METRICS_TOKEN>" otherwise.
+    """
+    if get_metrics() is None:
+        raise Http404
+
+    token = settings.METRICS_TOKEN
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
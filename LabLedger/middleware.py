@@ -0,0 +1,396 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.utils import timezone
+
+from LabLedger import metrics
+
+profiling_logger = logging.getLogger('LabLedger.profiling')
+slow_query_logger = logging.getLogger('LabLedger.slow_queries')
+
+SLOWEST_SQL_MAX_LENGTH = 500
+SLOW_QUERY_SQL_MAX_LENGTH = 4000
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_PLACEHOLDER_LISTS = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_SQL_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+
+
+def query_fingerprint(sql):
+    """
+    Identify a statement regardless of its literals and of how many values
+    its IN lists hold, so the runs of one query can be added up.
+    """
+    normalized = _SQL_LITERALS.sub('?', sql)
+    normalized = _SQL_PLACEHOLDER_LISTS.sub('(?+)', normalized)
+    normalized = _SQL_WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def client_ip(request, trusted_proxies):
+    """
+    The address a request came from: REMOTE_ADDR, unless that is one of
+    `trusted_proxies`. Then it is the last address of X-Forwarded-For that
+    no trusted proxy added, or else X-Real-IP; headers from anyone else are
+    ignored, as clients can set them to anything.
+    """
+    remote = request.META.get('REMOTE_ADDR', '')
+    if remote not in trusted_proxies:
+        return remote
+    forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+    for address in reversed(forwarded):
+        if address and address not in trusted_proxies:
+            return address
+    real_ip = request.META.get('HTTP_X_REAL_IP', '').strip()
+    if real_ip and real_ip not in trusted_proxies:
+        return real_ip
+    return remote
+
+
+class EarlyRejectMiddleware:
+    """
+    Turn away scanner traffic before the rest of the stack sees it.
+
+    Requests whose path matches EARLY_REJECT_PATTERNS get a bare 404, and
+    spend a token of their client IP's bucket (EARLY_REJECT_BURST tokens,
+    refilled at EARLY_REJECT_REFILL_PER_MINUTE). An IP that runs out is
+    banned: all of its requests get a bare 403 for EARLY_REJECT_BAN_SECONDS.
+    The client IP is the one TRUSTED_PROXIES forward (see client_ip); their
+    own addresses are never banned, since every client shares them. Buckets
+    and bans live in this process's memory, capped at
+    EARLY_REJECT_MAX_TRACKED_IPS each.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not settings.EARLY_REJECT_ENABLED or not settings.EARLY_REJECT_PATTERNS:
+            raise MiddlewareNotUsed
+        self.blocklist = re.compile(
+            '|'.join(f'(?:{pattern})' for pattern in settings.EARLY_REJECT_PATTERNS), re.IGNORECASE,
+        )
+        self.burst = settings.EARLY_REJECT_BURST
+        self.refill_per_second = settings.EARLY_REJECT_REFILL_PER_MINUTE / 60
+        self.ban_seconds = settings.EARLY_REJECT_BAN_SECONDS
+        self.max_tracked = settings.EARLY_REJECT_MAX_TRACKED_IPS
+        self.trusted_proxies = frozenset(settings.TRUSTED_PROXIES)
+        self.lock = threading.Lock()
+        # Both dicts are kept in order of last update, oldest first.
+        self.buckets = {}
+        self.banned = {}
+
+    def __call__(self, request):
+        ip = client_ip(request, self.trusted_proxies)
+        if self.banned and ip in self.banned:
+            if time.monotonic() < self.banned.get(ip, 0):
+                return self._reject(403)
+            with self.lock:
+                self.banned.pop(ip, None)
+        if self.blocklist.search(request.path_info):
+            if ip in self.trusted_proxies:
+                return self._reject(404)
+            return self._reject(403 if self._ban_spent(ip) else 404)
+        return self.get_response(request)
+
+    def _ban_spent(self, ip):
+        """Take a token from the IP's bucket; ban it if there was none left."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(ip, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.refill_per_second) - 1
+            if tokens < 0:
+                self.banned[ip] = now + self.ban_seconds
+                self._trim(self.banned)
+                return True
+            self.buckets[ip] = (tokens, now)
+            self._trim(self.buckets)
+            return False
+
+    def _trim(self, tracked):
+        while len(tracked) > self.max_tracked:
+            del tracked[next(iter(tracked))]
+
+    @staticmethod
+    def _reject(status):
+        response = HttpResponse(status=status, content_type='text/plain')
+        # Keep the handler from logging the rejection to django.request.
+        response._has_been_logged = True
+        return response
+
+
+class RequestProfile:
+    """
+    What one request spent its time on. Used as an `execute_wrapper` hook on
+    every database connection while the request runs.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_sql = ''
+        self.render_started = None
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if elapsed > self.slowest_seconds:
+                self.slowest_seconds = elapsed
+                self.slowest_sql = sql
+
+    def start_render(self):
+        self.render_started = time.perf_counter()
+
+    def finish_render(self, response):
+        self.render_seconds = time.perf_counter() - self.render_started
+
+
+class RequestProfilingMiddleware:
+    """
+    Profile requests: query count, DB time, the slowest statement, response
+    rendering (DRF serializes the payload there) and response size.
+
+    Profiled requests get a `Server-Timing` header when
+    REQUEST_PROFILING_SERVER_TIMING is on, and REQUEST_PROFILING_SAMPLE_RATE
+    of them are also logged as one JSON line on the LabLedger.profiling
+    logger. With both off the middleware takes itself out of the chain.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = settings.REQUEST_PROFILING_SERVER_TIMING
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        if not self.server_timing and self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (sampled or self.server_timing):
+            return self.get_response(request)
+
+        profile = request._profile = RequestProfile()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(profile))
+            response = self.get_response(request)
+        total_seconds = time.perf_counter() - profile.started
+
+        size = len(response.content) if not response.streaming else int(response.get('Content-Length', 0))
+        if self.server_timing:
+            response['Server-Timing'] = self._server_timing(profile, total_seconds, size)
+        if sampled:
+            profiling_logger.info(json.dumps(self._log_record(request, response, profile, total_seconds, size)))
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.start_render()
+            response.add_post_render_callback(profile.finish_render)
+        return response
+
+    @staticmethod
+    def _server_timing(profile, total_seconds, size):
+        app_seconds = max(total_seconds - profile.db_seconds - profile.render_seconds, 0)
+        return ', '.join([
+            f'db;dur={profile.db_seconds * 1000:.2f};desc="{profile.queries} queries"',
+            f'db-slowest;dur={profile.slowest_seconds * 1000:.2f}',
+            f'app;dur={app_seconds * 1000:.2f}',
+            f'render;dur={profile.render_seconds * 1000:.2f}',
+            f'total;dur={total_seconds * 1000:.2f}',
+            f'size;desc="{size} bytes"',
+        ])
+
+    @staticmethod
+    def _log_record(request, response, profile, total_seconds, size):
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        return {
+            'method': request.method,
+            'route': match.route if match else None,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'center_id': getattr(user, 'center_detail_id', None),
+            'queries': profile.queries,
+            'db_ms': round(profile.db_seconds * 1000, 2),
+            'slowest_sql_ms': round(profile.slowest_seconds * 1000, 2),
+            'slowest_sql': profile.slowest_sql[:SLOWEST_SQL_MAX_LENGTH],
+            'render_ms': round(profile.render_seconds * 1000, 2),
+            'total_ms': round(total_seconds * 1000, 2),
+            'response_bytes': size,
+        }
+
+
+class SlowQueryStats:
+    """Per-process totals of the slow statements seen, by fingerprint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+
+    def record(self, fingerprint, duration_ms, explain_interval):
+        """
+        Add one run to the totals. Returns the fingerprint's totals and
+        whether its plan is due to be captured again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            stats = self.fingerprints.setdefault(
+                fingerprint, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'explained_at': None},
+            )
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            explain = stats['explained_at'] is None or now - stats['explained_at'] >= explain_interval
+            if explain:
+                stats['explained_at'] = now
+            return dict(stats), explain
+
+
+slow_query_stats = SlowQueryStats()
+
+
+class SlowQueryLog:
+    """
+    `execute_wrapper` hook that logs the statements of one request running
+    longer than SLOW_QUERY_THRESHOLD_MS, with the plan of the read queries.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold_ms = settings.SLOW_QUERY_THRESHOLD_MS
+        self.analyze = settings.SLOW_QUERY_EXPLAIN_ANALYZE
+        self.explain_interval = settings.SLOW_QUERY_EXPLAIN_INTERVAL
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms >= self.threshold_ms:
+            self._log(context['connection'], sql, None if many else params, duration_ms)
+        return result
+
+    def _log(self, connection, sql, params, duration_ms):
+        fingerprint = query_fingerprint(sql)
+        stats, explain = slow_query_stats.record(fingerprint, duration_ms, self.explain_interval)
+        plan, explain_error = None, None
+        if explain and params is not None and _EXPLAINABLE.match(sql):
+            plan, explain_error = self._explain(connection, sql, params)
+
+        match = self.request.resolver_match
+        user = getattr(self.request, 'user', None)
+        slow_query_logger.info(json.dumps({
+            'time': timezone.now().isoformat(),
+            'pid': os.getpid(),
+            'fingerprint': fingerprint,
+            'duration_ms': round(duration_ms, 2),
+            'sql': sql[:SLOW_QUERY_SQL_MAX_LENGTH],
+            'method': self.request.method,
+            'route': match.route if match else None,
+            'view': match.view_name if match else None,
+            'center_id': getattr(user, 'center_detail_id', None),
+            'plan': plan,
+            'explain_error': explain_error,
+            'fingerprint_count': stats['count'],
+            'fingerprint_total_ms': round(stats['total_ms'], 2),
+            'fingerprint_max_ms': round(stats['max_ms'], 2),
+        }))
+
+    def _explain(self, connection, sql, params):
+        """
+        Run EXPLAIN on a cursor of its own, so the caller's results are left
+        alone, and inside a savepoint, so a failure can't break the caller's
+        transaction.
+        """
+        options = {'analyze': True} if self.analyze else {}
+        savepoint = 'slow_query_explain' if connection.in_atomic_block else None
+        cursor = connection.create_cursor()
+        try:
+            if savepoint:
+                cursor.execute(connection.ops.savepoint_create_sql(savepoint))
+            try:
+                cursor.execute(f'{connection.ops.explain_query_prefix(**options)} {sql}', params)
+                plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+            except Exception as exc:
+                if savepoint:
+                    cursor.execute(connection.ops.savepoint_rollback_sql(savepoint))
+                return None, str(exc)
+            if savepoint:
+                cursor.execute(connection.ops.savepoint_commit_sql(savepoint))
+            return plan, None
+        finally:
+            cursor.close()
+
+
+class SlowQueryLogMiddleware:
+    """
+    Log slow statements, with their EXPLAIN plan, the view and the center
+    they ran for, as JSON lines on the LabLedger.slow_queries logger. Takes
+    itself out of the chain unless SLOW_QUERY_THRESHOLD_MS is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if settings.SLOW_QUERY_THRESHOLD_MS <= 0:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        slow_query_log = SlowQueryLog(request)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(slow_query_log))
+            return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Feed the Prometheus request metrics: latency, query count and DB time by
+    resolved URL name, and the size of multipart uploads. Takes itself out
+    of the chain unless METRICS_ENABLED is on.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(profile))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        upload_bytes = 0
+        if request.content_type == 'multipart/form-data':
+            upload_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        metrics.observe_request(
+            (match.url_name or match.view_name) if match else 'unresolved',
+            request.method,
+            response.status_code,
+            time.perf_counter() - profile.started,
+            profile.queries,
+            profile.db_seconds,
+            upload_bytes,
+        )
+        return response
@@ -0,0 +1,105 @@
+"""
+Liveness and readiness probes.
+
+Liveness only says the process answers, so LivenessProbe serves it from the
+WSGI layer, before any middleware or URL resolution. Readiness checks what
+requests depend on: every database, a writable MEDIA_ROOT and an applied
+migration plan. Monitors poll it often, so each process reuses its last
+result for READINESS_CACHE_SECONDS.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.http import JsonResponse
+
+from all_urls import ROOT_LIVENESS
+
+LIVENESS_BODY = b'{"status": "alive"}'
+
+_readiness_lock = threading.Lock()
+_readiness_cache = {}
+
+
+class LivenessProbe:
+    """WSGI wrapper that answers GET and HEAD on the liveness path itself."""
+
+    def __init__(self, application):
+        self.application = application
+        self.paths = {f'/{ROOT_LIVENESS}', f'/{ROOT_LIVENESS}'.rstrip('/')}
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        if environ.get('PATH_INFO') not in self.paths or method not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(LIVENESS_BODY))),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [LIVENESS_BODY if method == 'GET' else b'']
+
+
+def liveness(request):
+    """The liveness answer for servers that don't go through LivenessProbe."""
+    return JsonResponse({'status': 'alive'})
+
+
+def _check_databases():
+    for alias in connections:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+
+def _check_media():
+    # Storage creates MEDIA_ROOT on the first upload, so a missing one is fine
+    # as long as it can be created.
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=settings.MEDIA_ROOT, prefix='.readiness-'):
+        pass
+
+
+def _check_migrations():
+    for alias in connections:
+        executor = MigrationExecutor(connections[alias])
+        pending = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if pending:
+            raise RuntimeError(f'{len(pending)} unapplied migrations on {alias}')
+
+
+READINESS_CHECKS = {
+    'database': _check_databases,
+    'media': _check_media,
+    'migrations': _check_migrations,
+}
+
+
+def _readiness():
+    checks = {}
+    for name, check in READINESS_CHECKS.items():
+        try:
+            check()
+        except Exception as exc:
+            checks[name] = f'failed: {exc}'
+        else:
+            checks[name] = 'ok'
+    return all(result == 'ok' for result in checks.values()), checks
+
+
+def readiness(request):
+    """
+    200 when every readiness check passes, 503 naming the failures otherwise.
+    """
+    with _readiness_lock:
+        cached = _readiness_cache.get('result')
+        if cached is None or time.monotonic() - cached[0] >= settings.READINESS_CACHE_SECONDS:
+            cached = _readiness_cache['result'] = (time.monotonic(), *_readiness())
+    _, ready, checks = cached
+    return JsonResponse(
+        {'status': 'ready' if ready else 'unavailable', 'checks': checks},
+        status=200 if ready else 503,
+    )
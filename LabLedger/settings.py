@@ -21,6 +21,17 @@ def _get_env_int(name, default):
         return default
 
 
+def _get_env_float(name, default):
+    """Read float env vars safely and fall back to default on bad input."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
 def _get_env_bool(name, default=False):
     """Read boolean env vars using common truthy values."""
     value = os.environ.get(name)
@@ -65,6 +76,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LabLedger.middleware.EarlyRejectMiddleware',
+    'LabLedger.middleware.RequestProfilingMiddleware',
+    'LabLedger.middleware.MetricsMiddleware',
+    'LabLedger.middleware.SlowQueryLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -95,6 +110,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'LabLedger.wsgi.application'
 
+TEST_RUNNER = 'LabLedger.test_runner.TestRunner'
+
 DATABASES = {
     'default': {
         'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.postgresql'),
@@ -144,8 +161,8 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'LabLedger.throttling.AnonRateThrottle',
+        'LabLedger.throttling.UserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
@@ -171,6 +188,120 @@ MAX_UPLOAD_SIZE_MB = _get_env_int('MAX_UPLOAD_SIZE_MB', 10)
 DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE_MB * 1024 * 1024
 FILE_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE_MB * 1024 * 1024
 
+# Smart cascade delete of diagnosis types/categories: bills are deleted in
+# batches, and deletes touching more bill lines than the threshold run in a
+# background job instead of holding the request open.
+SMART_DELETE_BATCH_SIZE = _get_env_int('SMART_DELETE_BATCH_SIZE', 1000)
+SMART_DELETE_BACKGROUND_THRESHOLD = _get_env_int('SMART_DELETE_BACKGROUND_THRESHOLD', 5000)
+
+# Upper bound on the number of doctors accepted by one bulk import request.
+DOCTOR_IMPORT_MAX_ROWS = _get_env_int('DOCTOR_IMPORT_MAX_ROWS', 2000)
+
+# Patient phone autocomplete: digits required before searching, and matches returned.
+PATIENT_AUTOCOMPLETE_MIN_DIGITS = _get_env_int('PATIENT_AUTOCOMPLETE_MIN_DIGITS', 3)
+PATIENT_AUTOCOMPLETE_LIMIT = _get_env_int('PATIENT_AUTOCOMPLETE_LIMIT', 10)
+
+# Early reject: scanner probes matching EARLY_REJECT_PATTERNS get a bare 404
+# before any other middleware runs. Each probe spends a token of its IP's
+# bucket of EARLY_REJECT_BURST, refilled at EARLY_REJECT_REFILL_PER_MINUTE; an
+# IP that runs out gets a bare 403 on every request for EARLY_REJECT_BAN_SECONDS.
+EARLY_REJECT_ENABLED = _get_env_bool('EARLY_REJECT_ENABLED', True)
+EARLY_REJECT_PATTERNS = [
+    r'(?:^|/)\.(?!well-known/)',  # dotfiles: /.env, /.git/config, /api/.env, /.aws/credentials
+    r'\.(?:php\d?|aspx?|jsp|cgi|rsp)(?:/|$)',  # scripts of other stacks: /index.php, /login.rsp
+    r'^/(?:cgi-bin|wp-admin|wp-content|wp-includes|owa|boaform|geoserver|webui|actuator|solr)(?:/|$)',
+    r'^/phpmyadmin',
+    r'/phpunit/',
+]
+EARLY_REJECT_BURST = _get_env_int('EARLY_REJECT_BURST', 10)
+EARLY_REJECT_REFILL_PER_MINUTE = _get_env_float('EARLY_REJECT_REFILL_PER_MINUTE', 1.0)
+EARLY_REJECT_BAN_SECONDS = _get_env_int('EARLY_REJECT_BAN_SECONDS', 3600)
+EARLY_REJECT_MAX_TRACKED_IPS = _get_env_int('EARLY_REJECT_MAX_TRACKED_IPS', 10000)
+
+# Reverse proxies in front of the app (comma-separated addresses). Requests
+# from them are attributed to the client named in X-Forwarded-For or
+# X-Real-IP, and a proxy's own address is never banned.
+TRUSTED_PROXIES = [
+    address.strip()
+    for address in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',')
+    if address.strip()
+]
+
+# Throttle store shared by all workers (see LabLedger/throttling.py): a SQLite
+# file for a single host, or redis://host:6379/0 for several. The timeout, in
+# seconds, bounds how long a check waits on the store before letting the
+# request through.
+THROTTLE_STORE_URL = os.environ.get('THROTTLE_STORE_URL', f"sqlite:///{BASE_DIR / 'throttle.sqlite3'}")
+THROTTLE_STORE_TIMEOUT = _get_env_float('THROTTLE_STORE_TIMEOUT', 0.5)
+
+# Per-center reference data (diagnosis types, doctors, franchises, categories)
+# is cached in two tiers: REFERENCE_DATA_LRU_SIZE snapshots in each process
+# in front of the shared 'reference_data' cache, which keeps them for
+# REFERENCE_DATA_TIMEOUT seconds. See diagnosis/reference_data.py.
+REFERENCE_DATA_LRU_SIZE = _get_env_int('REFERENCE_DATA_LRU_SIZE', 256)
+REFERENCE_DATA_TIMEOUT = _get_env_int('REFERENCE_DATA_TIMEOUT', 3600)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every worker: a directory on a single host by default.
+    'reference_data': {
+        'BACKEND': os.environ.get(
+            'REFERENCE_DATA_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.environ.get('REFERENCE_DATA_CACHE_LOCATION', str(BASE_DIR / 'cache' / 'reference_data')),
+        'OPTIONS': {'MAX_ENTRIES': _get_env_int('REFERENCE_DATA_CACHE_MAX_ENTRIES', 10000)},
+    },
+}
+
+# Invalidation bus (see LabLedger/invalidation.py): how a write in one worker
+# reaches the per-process caches of the others. 'postgres' uses LISTEN/NOTIFY
+# on the default database; 'sqlite' polls INVALIDATION_SQLITE_PATH every
+# INVALIDATION_POLL_INTERVAL seconds, for a single host on other databases;
+# 'off' keeps invalidations within the process.
+INVALIDATION_BUS = os.environ.get(
+    'INVALIDATION_BUS', 'postgres' if DATABASES['default']['ENGINE'].endswith('postgresql') else 'sqlite'
+)
+INVALIDATION_SQLITE_PATH = os.environ.get('INVALIDATION_SQLITE_PATH', str(BASE_DIR / 'invalidation.sqlite3'))
+INVALIDATION_POLL_INTERVAL = _get_env_float('INVALIDATION_POLL_INTERVAL', 0.5)
+
+# Dashboard (/diagnosis/dashboard/): threads, each with its own database
+# connection, computing the widgets of a request side by side. Below 2 the
+# widgets are computed in turn on the request's thread.
+DASHBOARD_WORKERS = _get_env_int('DASHBOARD_WORKERS', 4)
+
+# Pending-report queue (/diagnosis/pending-reports/): seconds a center's
+# maintained count of bills without a report is trusted before it is counted
+# again, which puts right any write the count missed.
+PENDING_REPORT_COUNT_MAX_AGE = _get_env_int('PENDING_REPORT_COUNT_MAX_AGE', 300)
+
+# Readiness probe (/readyz/): seconds each process reuses its last result.
+READINESS_CACHE_SECONDS = _get_env_float('READINESS_CACHE_SECONDS', 5.0)
+
+# Request profiling: a Server-Timing header (queries, DB time, slowest
+# query, render time, response size) on every response, and a JSON log line
+# for a sampled share of requests. With both off the middleware unloads.
+REQUEST_PROFILING_SERVER_TIMING = _get_env_bool('REQUEST_PROFILING_SERVER_TIMING', DEBUG)
+REQUEST_PROFILING_SAMPLE_RATE = _get_env_float('REQUEST_PROFILING_SAMPLE_RATE', 0.0)
+
+# Prometheus metrics at /metrics/, off by default. Scrapers must send
+# "Authorization: Bearer <METRICS_TOKEN>"; with no token set nobody can read
+# them. Under gunicorn also set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py).
+METRICS_ENABLED = _get_env_bool('METRICS_ENABLED', False)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Slow-query log: statements over SLOW_QUERY_THRESHOLD_MS (0 turns it off) go
+# to logs/slow-queries.jsonl.<pid> with the view and center they ran for, one
+# file per worker process, each rotated at SLOW_QUERY_LOG_MAX_BYTES. The plan
+# of a query is captured once per SLOW_QUERY_EXPLAIN_INTERVAL seconds; ANALYZE
+# runs the query a second time, so it is opt-in.
+SLOW_QUERY_THRESHOLD_MS = _get_env_float('SLOW_QUERY_THRESHOLD_MS', 0.0)
+SLOW_QUERY_EXPLAIN_ANALYZE = _get_env_bool('SLOW_QUERY_EXPLAIN_ANALYZE', False)
+SLOW_QUERY_EXPLAIN_INTERVAL = _get_env_int('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+SLOW_QUERY_LOG_MAX_BYTES = _get_env_int('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)
+SLOW_QUERY_LOG_BACKUP_COUNT = _get_env_int('SLOW_QUERY_LOG_BACKUP_COUNT', 5)
+
 # Application URLs
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 
@@ -210,6 +341,10 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'message': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'console': {
@@ -223,6 +358,14 @@ LOGGING = {
             'filename': os.path.join(BASE_DIR, 'logs', 'django.log'),
             'formatter': 'verbose',
         },
+        'slow_queries': {
+            'level': 'INFO',
+            'class': 'LabLedger.log_handlers.PerProcessRotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'logs', 'slow-queries.jsonl'),
+            'maxBytes': SLOW_QUERY_LOG_MAX_BYTES,
+            'backupCount': SLOW_QUERY_LOG_BACKUP_COUNT,
+            'formatter': 'message',
+        },
     },
     'loggers': {
         'django': {
@@ -235,5 +378,15 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': False,
         },
+        'LabLedger.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'LabLedger.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
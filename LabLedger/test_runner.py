@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Keeps the tests away from state shared with other runs and servers: the
+    throttle store is a fresh file, the shared reference-data cache keeps
+    nothing, since test transactions roll back writes that it would outlive,
+    and invalidations stay in the process. Tests of the cache itself override
+    CACHES.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.throttle_dir = tempfile.mkdtemp()
+        self.isolation = override_settings(
+            THROTTLE_STORE_URL=f"sqlite:///{self.throttle_dir}/throttle.sqlite3",
+            INVALIDATION_BUS="off",
+            CACHES={
+                **settings.CACHES,
+                "reference_data": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            },
+        )
+        self.isolation.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolation.disable()
+        shutil.rmtree(self.throttle_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,840 @@
+"""
+Project-wide tests: the endpoint benchmarks and the LabLedger middleware.
+
+The endpoint benchmarks call every route of authentication/urls.py, center_detail/urls.py and
+diagnosis/urls.py against a seeded dataset and records, per endpoint, the
+number of queries, the time spent in the database, the total latency and the
+size of the response body. The run fails when the queries or the payload go
+past the baseline committed in endpoint_benchmarks.json:
+
+- queries: any query above the baseline,
+- payload: more than PAYLOAD_TOLERANCE above the baseline.
+
+After an intended change, regenerate the baseline with
+
+    UPDATE_BENCHMARK_BASELINE=1 python manage.py test LabLedger.tests
+
+Timings depend on the machine, so they are kept out of the committed
+baseline. To check them too, point BENCHMARK_TIME_BASELINE at a local file,
+write it once with UPDATE_BENCHMARK_BASELINE=1 on that machine, and later
+runs also fail when the DB time or latency goes past TIME_TOLERANCE times
+that baseline plus TIME_SLACK_MS (BENCHMARK_TIME_TOLERANCE overrides the
+factor).
+"""
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import URLResolver, get_resolver, resolve
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import StaffAccount
+from center_detail.models import CenterDetail, SubscriptionPlan
+from diagnosis.models import (
+    AuditLog,
+    Bill,
+    BillDiagnosisType,
+    DiagnosisCategory,
+    DiagnosisType,
+    Doctor,
+    DoctorCategoryPercentage,
+    FranchiseName,
+    Patient,
+    PatientReport,
+    SampleTestReport,
+)
+from diagnosis.reference_data import get_reference_data, local_cache
+from LabLedger import invalidation, probes
+from LabLedger.log_handlers import PerProcessRotatingFileHandler
+from LabLedger.middleware import query_fingerprint, slow_query_stats
+from LabLedger.throttling import SQLiteThrottleStore, gcra, get_throttle_store
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "endpoint_benchmarks.json")
+TIME_BASELINE_PATH = os.environ.get("BENCHMARK_TIME_BASELINE")
+BENCHMARKED_PREFIXES = ("auth/", "center-details/", "diagnosis/")
+
+PAYLOAD_TOLERANCE = 0.10
+TIME_TOLERANCE = float(os.environ.get("BENCHMARK_TIME_TOLERANCE", 3))
+TIME_SLACK_MS = 50
+BASELINE_KEYS = ("queries", "payload_bytes")
+TIME_KEYS = ("db_ms", "latency_ms")
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    url: str
+    data: object = None
+    user: str = "admin"
+    status: int = 200
+    repeat: int = 3
+    settings: dict = {}
+
+
+class QueryTimer:
+    """`execute_wrapper` hook counting queries and the time spent on them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def benchmarked_routes():
+    """Route of every endpoint under the benchmarked apps, as `resolve()` reports it."""
+    def walk(patterns, prefix=""):
+        for pattern in patterns:
+            route = URLResolver._join_route(prefix, str(pattern.pattern))
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns, route)
+            elif pattern.name != "api-root" and "format" not in pattern.pattern.regex.groupindex:
+                yield route
+
+    return {route for route in walk(get_resolver().url_patterns) if route.startswith(BENCHMARKED_PREFIXES)}
+
+
+def read_baseline(path):
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def write_baseline(path, results, keys):
+    """Write the `keys` of every scenario's results to `path`."""
+    baseline = {name: {key: measured[key] for key in keys} for name, measured in results.items()}
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+# Reference data is measured as served in production: from a warm cache.
+@override_settings(SECURE_SSL_REDIRECT=False, CACHES={
+    **settings.CACHES,
+    "reference_data": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmarks"},
+})
+class BenchmarkTestCase(TestCase):
+    """A two-center dataset of bills, reports and audit logs, and a request to every endpoint."""
+
+    BILLS = 240
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.center = CenterDetail.objects.create(
+            center_name="Bench Center", address="1 Main Street", owner_name="Owner", owner_phone="9100000001",
+        )
+        cls.other_center = CenterDetail.objects.create(
+            center_name="Other Center", address="2 Main Street", owner_name="Other", owner_phone="9100000002",
+        )
+        cls.plan = SubscriptionPlan.objects.get(name="FREE")
+        cls.users = {
+            "admin": StaffAccount.objects.create_user(
+                username="admin", email="admin@example.com", password="pass12345", first_name="Center",
+                last_name="Admin", address="Desk", phone_number="9100000003", center_detail=cls.center,
+                is_admin=True,
+            ),
+            "superuser": StaffAccount.objects.create_user(
+                username="root", email="root@example.com", password="pass12345", first_name="Super",
+                last_name="User", address="HQ", phone_number="9100000004",
+            ),
+        }
+        cls.users["superuser"].is_superuser = True
+        cls.users["superuser"].save()
+        cls.staff = StaffAccount.objects.create_user(
+            username="reception", email="reception@example.com", password="pass12345", first_name="Front",
+            last_name="Desk", address="Desk", phone_number="9100000005", center_detail=cls.center,
+        )
+
+        cls.categories = [
+            DiagnosisCategory.objects.create(name="Ultrasound"),
+            DiagnosisCategory.objects.create(name="X-Ray"),
+            DiagnosisCategory.objects.create(name="Franchise Lab", is_franchise_lab=True),
+        ]
+        cls.types = [
+            DiagnosisType.objects.create(
+                center_detail=center, name=f"Test {i}", category=cls.categories[i % 3], price=300 + i * 50,
+            )
+            for center in (cls.center, cls.other_center)
+            for i in range(9)
+        ]
+        cls.doctors = []
+        for center in (cls.center, cls.other_center):
+            for i in range(4):
+                doctor = Doctor.objects.create(
+                    center_detail=center, first_name=f"Doctor{i}", last_name="Bench",
+                    phone_number=f"92{center.pk:04d}{i:04d}",
+                )
+                DoctorCategoryPercentage.objects.bulk_create(
+                    DoctorCategoryPercentage(doctor=doctor, category=category, percentage=10 + 5 * j)
+                    for j, category in enumerate(cls.categories)
+                )
+                cls.doctors.append(doctor)
+        cls.franchise = FranchiseName.objects.create(
+            franchise_name="City Lab", address="Road", phone_number="9100000006", center_detail=cls.center,
+        )
+
+        cls.patients = {
+            center: Patient.objects.bulk_create(
+                Patient(center_detail=center, phone_number=9876000000 + center_index * 1000 + i,
+                        name=f"Patient {i}", age=30, sex="Female")
+                for i in range(60)
+            )
+            for center_index, center in enumerate((cls.center, cls.other_center))
+        }
+        bills = cls.seed_bills()
+        cls.bill = bills[0]
+        cls.patient = cls.bill.patient
+        cls.pending_bill = bills[1]
+        cls.report = PatientReport.objects.get(bill=cls.bill)
+        cls.sample_reports = [
+            SampleTestReport.objects.create(
+                category=category.name, diagnosis_name=f"Sample {i}", center_detail=cls.center,
+                sample_report_file=ContentFile(b"%PDF-1.4 sample", name="s.pdf"),
+            )
+            for i, category in enumerate(cls.categories)
+        ]
+
+        cls.apk_root = os.path.join(cls.media_root, "apk")
+        os.makedirs(os.path.join(cls.apk_root, "private_assets"))
+        with open(os.path.join(cls.apk_root, "private_assets", "local_sms_gateway.apk"), "wb") as apk:
+            apk.write(b"PK" + b"\0" * 4094)
+
+    @classmethod
+    def seed_bills(cls, batch=0):
+        """
+        BILLS bills per center, one a day back from today, with two lines
+        each, a report for every third bill of the first center and an audit
+        log entry for the first hundred. Returns the first center's bills.
+        """
+        statuses = ["Fully Paid", "Fully Paid", "Partially Paid", "Unpaid"]
+        now = timezone.now()
+        bills, lines = [], []
+        for center_index, center in enumerate((cls.center, cls.other_center)):
+            center_types = cls.types[center_index * 9:(center_index + 1) * 9]
+            center_doctors = cls.doctors[center_index * 4:(center_index + 1) * 4]
+            patients = cls.patients[center]
+            for i in range(cls.BILLS):
+                bill_types = [center_types[i % 9], center_types[(i + 4) % 9]]
+                total = sum(dt.price for dt in bill_types)
+                bill = Bill(
+                    bill_number=f"LLBENCH{center.pk}-{batch}-{i}", patient_name=patients[i % 60].name,
+                    patient_age=30, patient_sex="Female", patient_phone_number=patients[i % 60].phone_number,
+                    patient=patients[i % 60], referred_by_doctor=center_doctors[i % 4],
+                    date_of_bill=now - timedelta(days=i), date_of_test=now - timedelta(days=i),
+                    bill_status=statuses[i % 4], total_amount=total, paid_amount=total,
+                    incentive_amount=total // 10, center_detail=center,
+                    franchise_name=cls.franchise if center == cls.center and i % 5 == 0 else None,
+                )
+                bills.append(bill)
+                lines.extend((bill, dt) for dt in bill_types)
+        Bill.objects.bulk_create(bills)
+        BillDiagnosisType.objects.bulk_create(
+            BillDiagnosisType(
+                bill=bill, diagnosis_type=dt, price_at_time=dt.price,
+                category=dt.category, is_franchise_lab=dt.category.is_franchise_lab,
+            )
+            for bill, dt in lines
+        )
+
+        for bill in bills[:cls.BILLS:3]:
+            PatientReport.objects.create(
+                bill=bill, center_detail=cls.center, report_file=ContentFile(b"%PDF-1.4 report", name="r.pdf"),
+            )
+        AuditLog.objects.bulk_create(
+            AuditLog(user=cls.users["admin"], action="UPDATE", model_name="Bill", object_id=str(bill.pk),
+                     details=f"Updated bill {bill.bill_number}")
+            for bill in bills[:100]
+        )
+        return bills[:cls.BILLS]
+
+    def setUp(self):
+        get_throttle_store().clear()
+        caches["reference_data"].clear()
+        local_cache.clear()
+        get_reference_data(self.center.pk)
+        self.bill.prepare_message_link()
+        self.bill.save(update_fields=["message_link_token", "message_link_created_at", "message_link_used_at"])
+
+    def _bill_payload(self, types):
+        total = sum(dt.price for dt in types)
+        return {
+            "patient_name": "Ravi",
+            "patient_age": 40,
+            "patient_sex": "Male",
+            "patient_phone_number": 9876543210,
+            "diagnosis_types": [dt.id for dt in types],
+            "referred_by_doctor": self.doctors[0].id,
+            "franchise_name": self.franchise.id,
+            "bill_status": "Fully Paid",
+            "paid_amount": total - 100,
+            "disc_by_center": 0,
+            "disc_by_doctor": 100,
+        }
+
+    def scenarios(self):
+        today = timezone.localdate()
+        doctor = self.doctors[0]
+        span = {"start_date": str(today - timedelta(days=self.BILLS)), "end_date": str(today)}
+        return [
+            # authentication
+            Scenario("staff-list", "get", "/auth/staffs/staff/"),
+            Scenario("staff-detail", "get", f"/auth/staffs/staff/{self.staff.pk}/"),
+            Scenario("staff-reset-password", "post", f"/auth/staffs/staff/{self.staff.pk}/reset_password/",
+                     {"password": "N3w-pass-phrase!"}, repeat=1),
+            Scenario("logout", "post", "/auth/logout/", {}, repeat=1),
+            Scenario("license", "get", "/auth/license/"),
+            Scenario("sms-gateway-apk", "get", "/auth/local-sms-gateway-apk/", settings={"BASE_DIR": self.apk_root}),
+            # center_detail
+            Scenario("center-detail-list", "get", "/center-details/center-detail/"),
+            Scenario("center-detail-detail", "get", f"/center-details/center-detail/{self.center.pk}/"),
+            Scenario("subscription-plan-list", "get", "/center-details/subscription-plan/"),
+            Scenario("subscription-plan-detail", "get", f"/center-details/subscription-plan/{self.plan.pk}/"),
+            Scenario("active-subscription-list", "get", "/center-details/active-subscription/", user="superuser"),
+            Scenario("active-subscription-detail", "get",
+                     f"/center-details/active-subscription/{self.center.active_subscription.pk}/", user="superuser"),
+            Scenario("subscription-plan-context", "post", "/center-details/subscription-plan-context/",
+                     {"username": "reception"}, user=None),
+            # diagnosis
+            Scenario("bill-list", "get", "/diagnosis/bill/"),
+            Scenario("bill-detail", "get", f"/diagnosis/bill/{self.bill.pk}/"),
+            Scenario("bill-franchise-names", "get", "/diagnosis/bill/franchise-names/"),
+            Scenario("bill-create", "post", "/diagnosis/bill/", self._bill_payload(self.types[:4]),
+                     status=201, repeat=1),
+            Scenario("bill-update", "put", f"/diagnosis/bill/{self.pending_bill.pk}/",
+                     self._bill_payload(self.types[2:5]), repeat=1),
+            Scenario("bill-message-report", "get", f"/diagnosis/bill-message/{self.bill.message_link_token}/",
+                     user=None, repeat=1),
+            Scenario("bill-send-message", "post", f"/diagnosis/bill/{self.bill.pk}/send-message/", {}, repeat=1),
+            Scenario("patient-report-list", "get", "/diagnosis/patient-report/"),
+            Scenario("patient-report-detail", "get", f"/diagnosis/patient-report/{self.report.pk}/"),
+            Scenario("patient-report-download", "get", f"/diagnosis/patient-report/{self.report.pk}/download/"),
+            Scenario("doctor-list", "get", "/diagnosis/doctor/"),
+            Scenario("doctor-detail", "get", f"/diagnosis/doctor/{doctor.pk}/"),
+            Scenario("doctor-bulk-import", "post", "/diagnosis/doctor/bulk-import/", [
+                {"first_name": f"Imported{i}", "last_name": "Doctor", "phone_number": f"930000{i:04d}",
+                 "category_percentages": [{"category": category.id, "percentage": 20} for category in self.categories]}
+                for i in range(20)
+            ], repeat=1),
+            Scenario("diagnosis-type-list", "get", "/diagnosis/diagnosis-type/"),
+            Scenario("diagnosis-type-detail", "get", f"/diagnosis/diagnosis-type/{self.types[0].pk}/"),
+            Scenario("diagnosis-type-revise-prices", "post", "/diagnosis/diagnosis-type/revise-prices/",
+                     {"mode": "percentage", "value": 5}, repeat=1),
+            Scenario("sample-test-report-list", "get", "/diagnosis/sample-test-report/"),
+            Scenario("sample-test-report-detail", "get", f"/diagnosis/sample-test-report/{self.sample_reports[0].pk}/"),
+            Scenario("franchise-name-list", "get", "/diagnosis/franchise-name/"),
+            Scenario("franchise-name-detail", "get", f"/diagnosis/franchise-name/{self.franchise.pk}/"),
+            Scenario("referral-stat", "get", "/diagnosis/referral-stat/"),
+            Scenario("bill-chart-stat", "get", "/diagnosis/bill-chart-stat/"),
+            Scenario("bill-chart-stat-by-month", "get", "/diagnosis/bill-chart-stat/?granularity=month"),
+            Scenario("pending-reports-list", "get", "/diagnosis/pending-reports/"),
+            Scenario("pending-reports-by-category", "get",
+                     f"/diagnosis/pending-reports/?category={self.categories[0].pk}"),
+            Scenario("pending-reports-detail", "get", f"/diagnosis/pending-reports/{self.pending_bill.pk}/"),
+            Scenario("category-list", "get", "/diagnosis/categories/"),
+            Scenario("category-detail", "get", f"/diagnosis/categories/{self.categories[0].pk}/"),
+            Scenario("patient-list", "get", "/diagnosis/patient/"),
+            Scenario("patient-detail", "get", f"/diagnosis/patient/{self.patient.pk}/"),
+            Scenario("patient-autocomplete", "get", "/diagnosis/patient/autocomplete/?phone=98760"),
+            Scenario("patient-visits", "get", f"/diagnosis/patient/{self.patient.pk}/visits/"),
+            Scenario("audit-logs", "get", "/diagnosis/audit-logs/"),
+            Scenario("report-quota-summary", "get", "/diagnosis/report-quota-summary/"),
+            Scenario("doctor-incentives", "get", f"/diagnosis/doctors/{doctor.pk}/incentives/"),
+            Scenario("doctor-growth-stats", "get", f"/diagnosis/doctors/{doctor.pk}/growth-stats/"),
+            Scenario("bills-growth-stats", "get", "/diagnosis/bills/growth-stats/"),
+            Scenario("dashboard", "get", "/diagnosis/dashboard/"),
+            Scenario("incentives", "get", f"/diagnosis/incentives/?start_date={span['start_date']}"
+                                          f"&end_date={span['end_date']}"),
+        ]
+
+    def _client(self, user):
+        client = APIClient()
+        if user is not None:
+            token = RefreshToken.for_user(self.users[user]).access_token
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        return client
+
+    def _measure(self, scenario):
+        client = self._client(scenario.user)
+        runs = []
+        with override_settings(**scenario.settings):
+            for _ in range(scenario.repeat):
+                timer = QueryTimer()
+                start = time.perf_counter()
+                with connection.execute_wrapper(timer):
+                    response = getattr(client, scenario.method)(scenario.url, scenario.data, format="json")
+                    if response.streaming:
+                        # Draining the stream also closes the response.
+                        body = b"".join(response.streaming_content)
+                    else:
+                        body = response.content
+                elapsed = time.perf_counter() - start
+                self.assertEqual(response.status_code, scenario.status, f"{scenario.name}: {body[:500]!r}")
+                runs.append((timer.count, timer.seconds, elapsed, len(body)))
+
+        queries, _, _, payload = runs[-1]
+        return {
+            "queries": queries,
+            "db_ms": round(statistics.median(run[1] for run in runs) * 1000, 2),
+            "latency_ms": round(statistics.median(run[2] for run in runs) * 1000, 2),
+            "payload_bytes": payload,
+        }
+
+
+class EndpointBenchmarkTests(BenchmarkTestCase):
+    """Eight months of bills a center."""
+
+    def _regressions(self, name, measured, baseline, timings=None):
+        if baseline is None:
+            return [f"{name}: no baseline, regenerate it with UPDATE_BENCHMARK_BASELINE=1"]
+
+        problems = []
+        if measured["queries"] > baseline["queries"]:
+            problems.append(f"{name}: {measured['queries']} queries, baseline {baseline['queries']}")
+        if measured["payload_bytes"] > baseline["payload_bytes"] * (1 + PAYLOAD_TOLERANCE):
+            problems.append(f"{name}: {measured['payload_bytes']} bytes, baseline {baseline['payload_bytes']}")
+        for key in TIME_KEYS if timings else ():
+            if measured[key] > timings[key] * TIME_TOLERANCE + TIME_SLACK_MS:
+                problems.append(f"{name}: {key} {measured[key]}, baseline {timings[key]}")
+        return problems
+
+    def test_every_endpoint_is_benchmarked(self):
+        covered = {resolve(scenario.url.split("?")[0]).route for scenario in self.scenarios()}
+        self.assertEqual(benchmarked_routes() - covered, set())
+
+    def test_endpoints_stay_within_baseline(self):
+        results = {scenario.name: self._measure(scenario) for scenario in self.scenarios()}
+
+        if os.environ.get("UPDATE_BENCHMARK_BASELINE"):
+            write_baseline(BASELINE_PATH, results, BASELINE_KEYS)
+            if TIME_BASELINE_PATH:
+                write_baseline(TIME_BASELINE_PATH, results, TIME_KEYS)
+            return
+
+        baseline = read_baseline(BASELINE_PATH)
+        timings = read_baseline(TIME_BASELINE_PATH) if TIME_BASELINE_PATH else {}
+        problems = []
+        for name, measured in results.items():
+            problems.extend(self._regressions(name, measured, baseline.get(name), timings.get(name)))
+        self.assertEqual(problems, [])
+
+
+class QueryScalingTests(BenchmarkTestCase):
+    """
+    Fewer bills than a page holds, so that paginated lists grow with them
+    too: a query count that goes up when the bills double is an N+1.
+    """
+
+    BILLS = 12
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        def reads():
+            return [scenario for scenario in self.scenarios() if scenario.method == "get"]
+
+        before = {scenario.name: self._measure(scenario)["queries"] for scenario in reads()}
+
+        self.seed_bills(batch=1)
+        self.setUp()
+        grown = {}
+        for scenario in reads():
+            queries = self._measure(scenario)["queries"]
+            if queries > before[scenario.name]:
+                grown[scenario.name] = f"{before[scenario.name]} queries, {queries} over twice the bills"
+        self.assertEqual(grown, {})
+
+
+@override_settings(
+    EARLY_REJECT_BURST=2, EARLY_REJECT_REFILL_PER_MINUTE=0, EARLY_REJECT_BAN_SECONDS=60, SECURE_SSL_REDIRECT=False,
+)
+class EarlyRejectMiddlewareTests(TestCase):
+    def test_scanner_probes_get_a_bare_404_without_touching_the_database(self):
+        for path in ("/.env", "/api/.env", "/.git/config", "/index.php", "/app_dev.php/_profiler/phpinfo",
+                     "/cgi-bin/luci/;stok=/locale", "/phpmyadmin2018/", "/lib/phpunit/phpunit/Util/PHP/eval-stdin.php"):
+            with self.subTest(path=path), self.assertNumQueries(0), self.assertNoLogs("django.request"):
+                response = self.client.get(path, REMOTE_ADDR=f"203.0.113.{len(path)}")
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.content, b"")
+
+    def test_api_routes_and_well_known_paths_pass_through(self):
+        self.assertEqual(self.client.get("/").status_code, 200)
+        response = self.client.get("/.well-known/security.txt")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotEqual(response.content, b"")
+
+    def test_ip_is_banned_once_its_bucket_runs_out(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get("/.env", REMOTE_ADDR="198.51.100.7").status_code, 404)
+        self.assertEqual(self.client.get("/.env", REMOTE_ADDR="198.51.100.7").status_code, 403)
+
+        self.assertEqual(self.client.get("/", REMOTE_ADDR="198.51.100.7").status_code, 403)
+        self.assertEqual(self.client.get("/", REMOTE_ADDR="198.51.100.8").status_code, 200)
+
+    @override_settings(TRUSTED_PROXIES=["127.0.0.1"])
+    def test_clients_behind_the_proxy_are_banned_one_by_one(self):
+        def get(path, **headers):
+            return self.client.get(path, REMOTE_ADDR="127.0.0.1", **headers).status_code
+
+        scanner = {"HTTP_X_FORWARDED_FOR": "198.51.100.7"}
+        for _ in range(2):
+            self.assertEqual(get("/.env", **scanner), 404)
+        self.assertEqual(get("/.env", **scanner), 403)
+        self.assertEqual(get("/", **scanner), 403)
+
+        self.assertEqual(get("/", HTTP_X_FORWARDED_FOR="203.0.113.9"), 200)
+        self.assertEqual(get("/", HTTP_X_REAL_IP="203.0.113.10"), 200)
+        # A client can't hide behind an address of its own choosing.
+        self.assertEqual(get("/", HTTP_X_FORWARDED_FOR="203.0.113.9, 198.51.100.7"), 403)
+
+    @override_settings(TRUSTED_PROXIES=["127.0.0.1"])
+    def test_the_proxy_itself_is_never_banned(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get("/.env", REMOTE_ADDR="127.0.0.1").status_code, 404)
+        self.assertEqual(self.client.get("/", REMOTE_ADDR="127.0.0.1").status_code, 200)
+
+    @override_settings(EARLY_REJECT_ENABLED=False)
+    def test_middleware_unloads_when_disabled(self):
+        response = self.client.get("/.env")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotEqual(response.content, b"")
+
+
+@override_settings(READINESS_CACHE_SECONDS=60, SECURE_SSL_REDIRECT=False)
+class ProbeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        probes._readiness_cache.clear()
+        self.addCleanup(probes._readiness_cache.clear)
+
+    def test_liveness_is_answered_before_django(self):
+        def django_application(environ, start_response):
+            raise AssertionError("Django should not see liveness probes.")
+
+        application = probes.LivenessProbe(django_application)
+        started = []
+        body = application({"PATH_INFO": "/livez/", "REQUEST_METHOD": "GET"}, lambda *args: started.append(args))
+
+        self.assertEqual(started[0][0], "200 OK")
+        self.assertEqual(json.loads(b"".join(body)), {"status": "alive"})
+        with self.assertRaises(AssertionError):
+            application({"PATH_INFO": "/", "REQUEST_METHOD": "GET"}, lambda *args: None)
+
+    def test_readiness_checks_dependencies_and_caches_the_result(self):
+        response = self.client.get("/readyz/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "status": "ready", "checks": {"database": "ok", "media": "ok", "migrations": "ok"},
+        })
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/readyz/").status_code, 200)
+
+    def test_readiness_fails_when_media_is_not_writable(self):
+        media_file = os.path.join(settings.MEDIA_ROOT, "not-a-directory")
+        open(media_file, "w").close()
+        with override_settings(MEDIA_ROOT=media_file):
+            response = self.client.get("/readyz/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "unavailable")
+        self.assertTrue(response.json()["checks"]["media"].startswith("failed: "))
+        self.assertEqual(response.json()["checks"]["database"], "ok")
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RequestProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        center = CenterDetail.objects.create(
+            center_name="Profiled Center", address="1 Main Street", owner_name="Owner", owner_phone="9100000001",
+        )
+        self.user = StaffAccount.objects.create_user(
+            username="profiled", email="profiled@example.com", password="pass12345", first_name="Pro",
+            last_name="Filed", address="Desk", phone_number="9100000003", center_detail=center,
+        )
+        Doctor.objects.create(center_detail=center, first_name="Asha", last_name="Rao")
+
+    def _get(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        response = client.get("/diagnosis/doctor/")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    @override_settings(REQUEST_PROFILING_SERVER_TIMING=True, REQUEST_PROFILING_SAMPLE_RATE=0)
+    def test_server_timing_header_breaks_down_the_request(self):
+        with self.assertNoLogs("LabLedger.profiling"):
+            response = self._get()
+
+        metrics = dict(part.split(";", 1) for part in response["Server-Timing"].split(", "))
+        self.assertEqual(set(metrics), {"db", "db-slowest", "app", "render", "total", "size"})
+        self.assertRegex(metrics["db"], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+        self.assertEqual(metrics["size"], f'desc="{len(response.content)} bytes"')
+
+    @override_settings(REQUEST_PROFILING_SERVER_TIMING=False, REQUEST_PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_logged_as_json(self):
+        with self.assertLogs("LabLedger.profiling", "INFO") as logs:
+            response = self._get()
+
+        self.assertNotIn("Server-Timing", response)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["route"], "diagnosis/doctor/$")
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["user_id"], self.user.pk)
+        self.assertEqual(record["center_id"], self.user.center_detail_id)
+        self.assertGreater(record["queries"], 0)
+        self.assertIn("SELECT", record["slowest_sql"])
+        self.assertEqual(record["response_bytes"], len(response.content))
+
+    @override_settings(REQUEST_PROFILING_SERVER_TIMING=False, REQUEST_PROFILING_SAMPLE_RATE=0)
+    def test_middleware_unloads_when_profiling_is_off(self):
+        with self.assertNoLogs("LabLedger.profiling"):
+            response = self._get()
+
+        self.assertNotIn("Server-Timing", response)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0.001, SLOW_QUERY_EXPLAIN_INTERVAL=300, SECURE_SSL_REDIRECT=False)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        center = CenterDetail.objects.create(
+            center_name="Slow Center", address="1 Main Street", owner_name="Owner", owner_phone="9100000021",
+        )
+        self.user = StaffAccount.objects.create_user(
+            username="slow", email="slow@example.com", password="pass12345", first_name="Slo",
+            last_name="Wly", address="Desk", phone_number="9100000023", center_detail=center,
+        )
+        Doctor.objects.create(center_detail=center, first_name="Asha", last_name="Rao")
+        slow_query_stats.fingerprints.clear()
+
+    def test_fingerprint_ignores_literals_and_in_list_lengths(self):
+        self.assertEqual(
+            query_fingerprint('SELECT * FROM "bill" WHERE "id" IN (%s, %s) AND "code" = \'A1\' LIMIT 21'),
+            query_fingerprint('SELECT  * FROM "bill"\nWHERE "id" IN (%s) AND "code" = \'B2\' LIMIT 5'),
+        )
+        self.assertNotEqual(
+            query_fingerprint('SELECT * FROM "bill" WHERE "id" = %s'),
+            query_fingerprint('SELECT * FROM "doctor" WHERE "id" = %s'),
+        )
+
+    def test_slow_statements_are_logged_with_plan_view_and_center(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        with self.assertLogs("LabLedger.slow_queries", "INFO") as logs:
+            response = client.get("/diagnosis/doctor/")
+        self.assertEqual(response.status_code, 200)
+
+        records = [json.loads(record.getMessage()) for record in logs.records]
+        doctor_query = next(record for record in records if '"diagnosis_doctor"' in record["sql"])
+        self.assertEqual(doctor_query["route"], "diagnosis/doctor/$")
+        self.assertEqual(doctor_query["view"], "doctor-list")
+        self.assertEqual(doctor_query["center_id"], self.user.center_detail_id)
+        self.assertTrue(doctor_query["plan"])
+        self.assertIsNone(doctor_query["explain_error"])
+        self.assertEqual(doctor_query["fingerprint"], query_fingerprint(doctor_query["sql"]))
+
+    def test_each_process_writes_a_log_file_of_its_own(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        path = os.path.join(workdir, "slow-queries.jsonl")
+        handler = PerProcessRotatingFileHandler(path, maxBytes=1024, backupCount=1)
+        self.addCleanup(handler.close)
+
+        handler.emit(logging.makeLogRecord({"msg": "parent"}))
+        child = os.fork()
+        if child == 0:
+            handler.emit(logging.makeLogRecord({"msg": "child"}))
+            os._exit(0)
+        os.waitpid(child, 0)
+        handler.emit(logging.makeLogRecord({"msg": "parent again"}))
+        handler.flush()
+
+        def read(pid):
+            with open(f"{path}.{pid}") as log:
+                return log.read().splitlines()
+
+        self.assertEqual(read(os.getpid()), ["parent", "parent again"])
+        self.assertEqual(read(child), ["child"])
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_middleware_unloads_when_the_threshold_is_unset(self):
+        with self.assertNoLogs("LabLedger.slow_queries"):
+            self.client.get("/diagnosis/doctor/")
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN="scrape-secret", SECURE_SSL_REDIRECT=False)
+class MetricsTests(TestCase):
+    def setUp(self):
+        center = CenterDetail.objects.create(
+            center_name="Metered Center", address="1 Main Street", owner_name="Owner", owner_phone="9100000011",
+        )
+        self.user = StaffAccount.objects.create_user(
+            username="metered", email="metered@example.com", password="pass12345", first_name="Met",
+            last_name="Ered", address="Desk", phone_number="9100000013", center_detail=center,
+        )
+
+    def _scrape(self, token="scrape-secret"):
+        return self.client.get("/metrics/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    @staticmethod
+    def _sample(name, **labels):
+        from prometheus_client import REGISTRY
+
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_measured_by_url_name(self):
+        labels = {"url_name": "doctor-list", "method": "GET", "status": "200"}
+        before = self._sample("labledger_request_duration_seconds_count", **labels)
+        queries_before = self._sample("labledger_db_queries_total", url_name="doctor-list")
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.assertEqual(client.get("/diagnosis/doctor/").status_code, 200)
+
+        self.assertEqual(self._sample("labledger_request_duration_seconds_count", **labels), before + 1)
+        self.assertGreater(self._sample("labledger_db_queries_total", url_name="doctor-list"), queries_before)
+        response = self._scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'labledger_request_duration_seconds_bucket{le="0.01",method="GET"', response.content)
+
+    def test_audit_log_failures_are_counted(self):
+        from diagnosis.views import _safe_audit_log
+
+        before = self._sample("labledger_audit_log_failures_total", model_name="Bill", action="CREATE")
+        _safe_audit_log(user="not a user", action="CREATE", model_name="Bill")
+
+        self.assertEqual(
+            self._sample("labledger_audit_log_failures_total", model_name="Bill", action="CREATE"), before + 1,
+        )
+
+    def test_endpoint_needs_the_scrape_token(self):
+        self.assertEqual(self._scrape("wrong").status_code, 403)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self._scrape("").status_code, 403)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_endpoint_is_hidden_when_metrics_are_off(self):
+        self.assertEqual(self._scrape().status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SharedThrottleTests(TestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.path = os.path.join(workdir, "throttle.sqlite3")
+
+    def test_gcra_allows_a_full_burst_then_spaces_requests(self):
+        tat = None
+        for _ in range(3):
+            wait, tat = gcra(tat, 100.0, 20.0, 60.0)
+            self.assertEqual(wait, 0)
+        self.assertEqual(gcra(tat, 100.0, 20.0, 60.0)[0], 20.0)
+        self.assertEqual(gcra(tat, 120.0, 20.0, 60.0)[0], 0)
+
+    def test_workers_sharing_a_store_share_the_limit(self):
+        # Two stores on one file stand in for two gunicorn workers.
+        workers = [SQLiteThrottleStore(self.path, timeout=1), SQLiteThrottleStore(self.path, timeout=1)]
+        waits = [workers[index % 2].acquire("throttle_user_1", 4, 60) for index in range(5)]
+
+        self.assertEqual(waits[:4], [0, 0, 0, 0])
+        self.assertAlmostEqual(waits[4], 15, delta=1)
+        self.assertEqual(workers[0].acquire("throttle_user_2", 4, 60), 0)
+
+    def test_subscription_lookup_is_throttled_in_the_shared_store(self):
+        with override_settings(THROTTLE_STORE_URL=f"sqlite:///{self.path}"):
+            statuses = [
+                self.client.post("/center-details/subscription-plan-context/", {"username": "nobody"}).status_code
+                for _ in range(7)
+            ]
+            response = self.client.post("/center-details/subscription-plan-context/", {"username": "nobody"})
+
+        self.assertEqual(statuses, [200] * 6 + [429])
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+
+class InvalidationBusTests(TransactionTestCase):
+    def setUp(self):
+        self.received = []
+        self.arrived = threading.Event()
+        invalidation.subscribe("test", self._handle)
+        self.addCleanup(invalidation._subscribers["test"].remove, self._handle)
+
+    def _handle(self, argument):
+        self.received.append(argument)
+        if argument is not None:
+            self.arrived.set()
+
+    def _listen(self, bus):
+        listener = invalidation.Listener(bus)
+        listener.start()
+        self.addCleanup(listener.stop)
+        return listener
+
+    def test_publish_waits_for_the_commit(self):
+        with transaction.atomic():
+            invalidation.publish("test", "1")
+            self.assertEqual(self.received, [])
+        self.assertEqual(self.received, ["1"])
+
+        try:
+            with transaction.atomic():
+                invalidation.publish("test", "2")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.received, ["1"])
+
+    def test_sqlite_bus_reaches_other_processes(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        path = os.path.join(workdir, "invalidation.sqlite3")
+        # A sender and a listener on one file stand in for two workers.
+        invalidation.SQLiteBus(path, 0.01).send("test:before")
+        self._listen(invalidation.SQLiteBus(path, 0.01))
+        time.sleep(0.05)
+        invalidation.SQLiteBus(path, 0.01).send("test:5=abc")
+
+        self.assertTrue(self.arrived.wait(2))
+        self.assertEqual(self.received, [None, "5=abc"])
+
+    def test_postgres_bus_reaches_other_processes(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("LISTEN/NOTIFY needs PostgreSQL.")
+        bus = invalidation.PostgresBus()
+        self._listen(bus)
+        # The listener dispatches its gap once it is listening.
+        deadline = time.monotonic() + 2
+        while not self.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        bus.send("test:7=abc")
+
+        self.assertTrue(self.arrived.wait(2))
+        self.assertEqual(self.received, [None, "7=abc"])
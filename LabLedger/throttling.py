@@ -0,0 +1,259 @@
+"""
+DRF throttles that count in a store shared by every worker.
+
+DRF's own throttles keep a list of request timestamps per client in the
+Django cache, which is per-process memory here, so each gunicorn worker
+enforced its own limit. These throttles keep a single GCRA timestamp per
+client instead, in the store THROTTLE_STORE_URL names:
+
+- ``sqlite:///<path>``: a SQLite file, for the workers of a single host.
+- ``redis://[[user]:password@]host[:port][/db]`` (or ``rediss://``): any
+  server speaking the Redis protocol, for several hosts.
+
+Every check is one constant-time transaction, or script, in the store. If
+the store can't be reached the request is let through and a warning logged.
+"""
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from rest_framework import throttling
+
+logger = logging.getLogger(__name__)
+
+# Rows of clients idle past their window are dropped every this many checks.
+SQLITE_EXPIRE_EVERY = 1000
+
+
+class ThrottleStoreError(Exception):
+    pass
+
+
+def gcra(tat, now, interval, period):
+    """
+    Generic cell rate algorithm: `period / interval` requests per `period`,
+    all of which may come in a burst. `tat` is the client's theoretical
+    arrival time, None for a new client. Returns the seconds to wait (0 when
+    the request is allowed) and the client's new theoretical arrival time.
+    """
+    tat = max(tat or now, now)
+    allow_at = tat + interval - period
+    if now < allow_at:
+        return allow_at - now, tat
+    return 0.0, tat + interval
+
+
+class SQLiteThrottleStore:
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.checks = 0
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS throttle (key TEXT PRIMARY KEY, tat REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS throttle_tat ON throttle (tat)')
+            self.local.connection = connection
+        return connection
+
+    def acquire(self, key, limit, period):
+        """Count a request of `key`; returns the seconds it must wait, 0 if none."""
+        connection = self._connection()
+        self.checks += 1
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute('SELECT tat FROM throttle WHERE key = ?', (key,)).fetchone()
+            wait, tat = gcra(row[0] if row else None, now, period / limit, period)
+            if not wait:
+                connection.execute(
+                    'INSERT INTO throttle (key, tat) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET tat = excluded.tat',
+                    (key, tat),
+                )
+            if self.checks % SQLITE_EXPIRE_EVERY == 0:
+                connection.execute('DELETE FROM throttle WHERE tat < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def clear(self):
+        self._connection().execute('DELETE FROM throttle')
+
+
+# GCRA as a Redis script, in microseconds of the server's clock so that every
+# node agrees on the time. Returns the microseconds to wait, 0 if none.
+REDIS_GCRA_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000000 + tonumber(clock[2])
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local allow_at = tat + interval - period
+if now < allow_at then
+    return allow_at - now
+end
+redis.call('SET', KEYS[1], string.format('%d', tat + interval), 'PX', math.ceil((tat + interval - now) / 1000))
+return 0
+"""
+REDIS_GCRA_SHA = hashlib.sha1(REDIS_GCRA_SCRIPT.encode()).hexdigest()
+
+
+class RedisThrottleStore:
+    """Talks just enough of the Redis protocol (RESP) to run the GCRA script."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.address = (parts.hostname or 'localhost', parts.port or 6379)
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.tls = parts.scheme == 'rediss'
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            if self.tls:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.address[0])
+            connection = self.local.connection = (sock, sock.makefile('rb'))
+            if self.password:
+                self._command(connection, 'AUTH', *filter(None, [self.username, self.password]))
+            if self.db:
+                self._command(connection, 'SELECT', self.db)
+        return connection
+
+    def execute(self, *args):
+        try:
+            return self._command(self._connection(), *args)
+        except OSError:
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def _command(self, connection, *args):
+        sock, reader = connection
+        encoded = [str(arg).encode() for arg in args]
+        sock.sendall(b''.join(
+            [b'*%d\r\n' % len(encoded)] + [b'$%d\r\n%s\r\n' % (len(arg), arg) for arg in encoded]
+        ))
+        return self._reply(reader)
+
+    def _reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection to the throttle store closed.')
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value.decode()
+        if kind == b'-':
+            raise ThrottleStoreError(value.decode())
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            if value == b'-1':
+                return None
+            data = reader.read(int(value) + 2)
+            return data[:-2]
+        if kind == b'*':
+            return None if value == b'-1' else [self._reply(reader) for _ in range(int(value))]
+        raise ThrottleStoreError(f'Unexpected reply from the throttle store: {line!r}')
+
+    def acquire(self, key, limit, period):
+        """Count a request of `key`; returns the seconds it must wait, 0 if none."""
+        arguments = [1, key, round(period / limit * 1_000_000), round(period * 1_000_000)]
+        try:
+            wait = self.execute('EVALSHA', REDIS_GCRA_SHA, *arguments)
+        except ThrottleStoreError as exc:
+            if not str(exc).startswith('NOSCRIPT'):
+                raise
+            wait = self.execute('EVAL', REDIS_GCRA_SCRIPT, *arguments)
+        return wait / 1_000_000
+
+    def clear(self):
+        # Throttle keys are all DRF's "throttle_<scope>_<ident>".
+        cursor = '0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH', 'throttle_*', 'COUNT', 1000)
+            if keys:
+                self.execute('DEL', *[key.decode() for key in keys])
+            if cursor == b'0':
+                return
+            cursor = cursor.decode()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_throttle_store():
+    """The store of THROTTLE_STORE_URL, opened on first use."""
+    url = settings.THROTTLE_STORE_URL
+    with _stores_lock:
+        store = _stores.get(url)
+        if store is None:
+            scheme = urlsplit(url).scheme
+            if scheme == 'sqlite':
+                store = SQLiteThrottleStore(url[len('sqlite:///'):], settings.THROTTLE_STORE_TIMEOUT)
+            elif scheme in ('redis', 'rediss'):
+                store = RedisThrottleStore(url, settings.THROTTLE_STORE_TIMEOUT)
+            else:
+                raise ValueError(f'Unsupported THROTTLE_STORE_URL scheme: {scheme!r}')
+            _stores[url] = store
+    return store
+
+
+class SharedRateThrottle(throttling.SimpleRateThrottle):
+    """SimpleRateThrottle counting in the shared throttle store."""
+
+    wait_seconds = None
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        try:
+            self.wait_seconds = get_throttle_store().acquire(self.key, self.num_requests, self.duration)
+        except (ThrottleStoreError, OSError, sqlite3.Error):
+            logger.warning('Throttle store unavailable; letting the request through.', exc_info=True)
+            return True
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AnonRateThrottle(throttling.AnonRateThrottle, SharedRateThrottle):
+    pass
+
+
+class UserRateThrottle(throttling.UserRateThrottle, SharedRateThrottle):
+    pass
+
+
+class ScopedRateThrottle(throttling.ScopedRateThrottle, SharedRateThrottle):
+    pass
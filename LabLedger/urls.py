@@ -10,6 +10,9 @@ from rest_framework_simplejwt.views import (
 from django.conf import settings
 from django.conf.urls.static import static
 
+from LabLedger.metrics import metrics_view
+from LabLedger.probes import liveness, readiness
+
 from authentication.views import (
     AppInfoView,
     CustomTokenObtainPairView,
@@ -23,6 +26,9 @@ from all_urls import (
     ROOT_CENTER_DETAILS_INCLUDE,
     ROOT_DIAGNOSIS_INCLUDE,
     ROOT_HEALTH,
+    ROOT_LIVENESS,
+    ROOT_METRICS,
+    ROOT_READINESS,
     ROOT_TOKEN,
     ROOT_TOKEN_REFRESH,
     ROOT_TOKEN_VERIFY,
@@ -32,6 +38,9 @@ from all_urls import (
 urlpatterns = [
     path(ROOT_ADMIN, custom_admin_site.urls),
     path(ROOT_HEALTH, health_check),
+    path(ROOT_LIVENESS, liveness, name='liveness'),
+    path(ROOT_READINESS, readiness, name='readiness'),
+    path(ROOT_METRICS, metrics_view, name='metrics'),
     path(ROOT_APP_INFO, AppInfoView.as_view(), name='app-info'),
     path(ROOT_VERIFY_AUTH, ValidateTokenView.as_view(), name='validate-token'),
     path(ROOT_AUTH_INCLUDE, include('authentication.urls')),  # Include authentication URLs
@@ -11,6 +11,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from LabLedger.probes import LivenessProbe
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LabLedger.settings')
 
-application = get_wsgi_application()
+# Liveness probes are answered here, ahead of Django's middleware.
+application = LivenessProbe(get_wsgi_application())
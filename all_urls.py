@@ -7,6 +7,9 @@ internal audit scripts that call API endpoints.
 # Root URL patterns (LabLedger/urls.py)
 ROOT_ADMIN = "predator/"
 ROOT_HEALTH = ""
+ROOT_LIVENESS = "livez/"
+ROOT_READINESS = "readyz/"
+ROOT_METRICS = "metrics/"
 ROOT_APP_INFO = "api/app-info/"
 ROOT_VERIFY_AUTH = "verify-auth/"
 ROOT_AUTH_INCLUDE = "auth/"
@@ -41,22 +44,29 @@ DIAG_REFERRAL_STAT_ROUTER = "referral-stat"
 DIAG_BILL_CHART_STAT_ROUTER = "bill-chart-stat"
 DIAG_PENDING_REPORTS_ROUTER = "pending-reports"
 DIAG_CATEGORIES_ROUTER = "categories"
+DIAG_PATIENT_ROUTER = "patient"
 
 DIAG_AUDIT_LOGS = "audit-logs/"
 DIAG_REPORT_QUOTA_SUMMARY = "report-quota-summary/"
 DIAG_BILL_MESSAGE_REPORT = "bill-message/<str:token>/"
 DIAG_BILL_SEND_MESSAGE = "send-message"
 DIAG_PATIENT_REPORT_DOWNLOAD = "download"
+DIAG_DOCTOR_BULK_IMPORT = "bulk-import"
+DIAG_DIAGNOSIS_TYPE_REVISE_PRICES = "revise-prices"
+DIAG_PATIENT_AUTOCOMPLETE = "autocomplete"
+DIAG_PATIENT_VISITS = "visits"
 DIAG_DOCTOR_INCENTIVES = "doctors/<int:doctor_id>/incentives/"
 DIAG_DOCTOR_GROWTH_STATS = "doctors/<int:doctor_id>/growth-stats/"
 DIAG_BILLS_GROWTH_STATS = "bills/growth-stats/"
 DIAG_INCENTIVES = "incentives/"
+DIAG_DASHBOARD = "dashboard/"
 
 # Absolute API paths for scripts/tests
 API_TOKEN = "/api/token/"
 API_TOKEN_REFRESH = "/api/token/refresh/"
 API_AUTH_STAFFS = "/auth/staffs/staff/"
 API_DIAGNOSIS_BILL = "/diagnosis/bill/"
+API_DIAGNOSIS_DOCTOR_BULK_IMPORT = "/diagnosis/doctor/bulk-import/"
 API_DIAGNOSIS_BILL_GROWTH_STATS = "/diagnosis/bills/growth-stats/"
 API_DIAGNOSIS_INCENTIVES = "/diagnosis/incentives/"
 API_DIAGNOSIS_REFERRAL_STAT = "/diagnosis/referral-stat/"
@@ -253,4 +253,24 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         else:
             data["center_detail"] = None
 
-        return data
\ No newline at end of file
+        return data
+
+
+def verified_user_data(user):
+    """The account and center details returned once a token is verified."""
+    center = getattr(user, 'center_detail', None)
+    center_data = None
+    if center:
+        center_data = CenterDetailTokenSerializer(center).data
+
+    return {
+        "success": True,
+        "is_admin": user.is_admin,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "id": user.id,
+        "is_locked": user.is_locked,
+        "has_accepted_license": user.has_accepted_license,
+        "center_detail": center_data,
+    }
@@ -14,11 +14,12 @@ from authentication.serializers import (
     AdminPasswordResetSerializer,
     CustomTokenObtainPairSerializer,
     StaffAccountSerializer,
-    UserPasswordChangeSerializer
+    UserPasswordChangeSerializer,
+    verified_user_data,
 )
-from center_detail.serializers import CenterDetailTokenSerializer
 from diagnosis.views import CenterDetailFilterMixin, IsAdminUser
 from diagnosis.models import AuditLog
+from LabLedger.metrics import record_audit_log_failure
 
 
 def _safe_audit_log(user, action, model_name, object_id='', details='', request=None):
@@ -42,7 +43,7 @@ def _safe_audit_log(user, action, model_name, object_id='', details='', request=
             user_agent=user_agent,
         )
     except Exception:
-        pass
+        record_audit_log_failure(model_name, action)
 
 class StaffAccountViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
     queryset = StaffAccount.objects.all()
@@ -244,22 +245,7 @@ class ValidateTokenView(APIView):
                     status=status.HTTP_403_FORBIDDEN,
                 )
 
-        center = getattr(user, 'center_detail', None)
-        center_data = None
-        if center:
-            center_data = CenterDetailTokenSerializer(center).data
-
-        return Response({
-            "success": True,
-            "is_admin": user.is_admin,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "id": user.id,
-            "is_locked": user.is_locked,
-            "has_accepted_license": user.has_accepted_license,
-            "center_detail": center_data,
-        })
+        return Response(verified_user_data(user))
 
 class AppInfoView(APIView):
     permission_classes = [AllowAny]
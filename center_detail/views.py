@@ -1,8 +1,8 @@
 from django.contrib.auth import get_user_model
 from rest_framework import permissions, viewsets
-from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from LabLedger.throttling import ScopedRateThrottle
 from .models import ActiveSubscription, CenterDetail, SubscriptionPlan
 from .serializers import (
     ActiveSubscriptionSerializer,
@@ -10,6 +10,8 @@ from .models import (
     FranchiseName,
     DiagnosisCategory,
     DoctorCategoryPercentage,
+    DiagnosisTypePrice,
+    Patient,
 )
 
 # A generic admin class that includes our filtering for simple models
@@ -52,5 +54,7 @@ custom_admin_site.register(DiagnosisType, FilteredBaseAdmin)
 custom_admin_site.register(PatientReport, FilteredBaseAdmin)
 custom_admin_site.register(SampleTestReport, FilteredBaseAdmin)
 custom_admin_site.register(FranchiseName, FilteredBaseAdmin)
+custom_admin_site.register(Patient, FilteredBaseAdmin)
 custom_admin_site.register(DiagnosisCategory)
-custom_admin_site.register(DoctorCategoryPercentage)
\ No newline at end of file
+custom_admin_site.register(DoctorCategoryPercentage)
+custom_admin_site.register(DiagnosisTypePrice)
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Incentive of each line of a bill.
+
+A bill's incentive is what its lines earn at the doctor's percentages,
+less the doctor discount when the bill passes it on (see
+Bill.apply_totals_and_incentive). The lines share that discount in
+proportion to what they earn, rounded by largest remainder, so their
+incentives add up to the bill's exactly and a per-category breakdown is a
+plain SUM over lines.
+"""
+
+
+def allocate(amount, weights):
+    """
+    Split the whole `amount` in proportion to `weights`: every share is
+    rounded down, and the units left go to the largest remainders, earlier
+    lines first on ties. Equal weights are used when they add up to nothing.
+    """
+    if not weights:
+        return []
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1] * len(weights), len(weights)
+    shares = [amount * weight // total for weight in weights]
+    remainders = [amount * weight - share * total for weight, share in zip(weights, shares)]
+    left = amount - sum(shares)
+    for i in sorted(range(len(weights)), key=lambda i: -remainders[i])[:left]:
+        shares[i] += 1
+    return shares
+
+
+def net_incentives(earned, prices, incentive):
+    """
+    The incentive of each line, adding up to the bill's `incentive`, from
+    what each line `earned` at the doctor's percentage and its price (the
+    weights when the lines earn nothing).
+    """
+    discount = sum(earned) - incentive
+    weights = earned if sum(earned) > 0 else prices
+    return [line - share for line, share in zip(earned, allocate(discount, weights))]
+
+
+def fill_lines(bills, line_model, percentage_model):
+    """
+    Copy their diagnosis type's category and franchise lab flag onto the
+    lines of `bills` and split each bill's incentive over them, at the
+    doctors' current percentages. Takes the models, as this module is
+    imported by diagnosis.models. Returns the number of lines written.
+    """
+    bills = {bill.pk: bill for bill in bills}
+    lines = list(
+        line_model.objects.filter(bill_id__in=list(bills))
+        .select_related('diagnosis_type__category')
+        .order_by('bill_id', 'pk')
+    )
+    doctor_ids = {bill.referred_by_doctor_id for bill in bills.values()} - {None}
+    percentages = {
+        (doctor_id, category_id): percentage
+        for doctor_id, category_id, percentage in percentage_model.objects.filter(
+            doctor_id__in=doctor_ids
+        ).values_list('doctor_id', 'category_id', 'percentage')
+    }
+
+    lines_of = {}
+    for line in lines:
+        category = line.diagnosis_type.category
+        line.category = category
+        line.is_franchise_lab = category.is_franchise_lab
+        lines_of.setdefault(line.bill_id, []).append(line)
+
+    for bill_id, bill_lines in lines_of.items():
+        bill = bills[bill_id]
+        earned = [
+            (line.price_at_time * percentages.get((bill.referred_by_doctor_id, line.category.pk), 0)) // 100
+            if bill.referred_by_doctor_id else 0
+            for line in bill_lines
+        ]
+        prices = [line.price_at_time for line in bill_lines]
+        for line, incentive in zip(bill_lines, net_incentives(earned, prices, bill.incentive_amount)):
+            line.incentive_amount = incentive
+
+    line_model.objects.bulk_update(lines, ['category', 'is_franchise_lab', 'incentive_amount'])
+    return len(lines)
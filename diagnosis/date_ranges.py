@@ -0,0 +1,86 @@
+"""
+Calendar periods as half-open, timezone-aware timestamp ranges.
+
+Filtering with `date_of_bill__date`, `__month` and friends wraps the column
+in a time zone conversion, which keeps Postgres from using an index on it.
+The helpers here turn calendar dates into `[start, end)` datetimes in the
+current time zone, so filters compare the raw column and stay sargable.
+"""
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def day_start(day, tz=None):
+    """Aware datetime of local midnight at the start of `day`."""
+    return timezone.make_aware(datetime.combine(day, time.min), tz or timezone.get_current_timezone())
+
+
+def date_range(start_date, end_date, tz=None):
+    """`[start, end)` covering the calendar days `start_date`..`end_date` inclusive."""
+    return day_start(start_date, tz), day_start(end_date + timedelta(days=1), tz)
+
+
+def month_bounds(year, month):
+    """First and last calendar day of a month."""
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def quarter_bounds(year, quarter):
+    """First and last calendar day of a quarter (1-4)."""
+    first_month = (quarter - 1) * 3 + 1
+    return date(year, first_month, 1), month_bounds(year, first_month + 2)[1]
+
+
+def year_bounds(year):
+    """First and last calendar day of a year."""
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+def in_date_range(field, start_date=None, end_date=None, tz=None):
+    """
+    Q restricting `field` to the calendar days `start_date`..`end_date`
+    (either end may be left open).
+    """
+    condition = Q()
+    if start_date is not None:
+        condition &= Q(**{f"{field}__gte": day_start(start_date, tz)})
+    if end_date is not None:
+        condition &= Q(**{f"{field}__lt": day_start(end_date + timedelta(days=1), tz)})
+    return condition
+
+
+def growth_periods(today):
+    """
+    Calendar bounds of the current and previous month, quarter and year
+    around `today`, keyed as the growth and incentive stats report them.
+    """
+    first_curr_month, last_curr_month = month_bounds(today.year, today.month)
+    prev_month = first_curr_month - timedelta(days=1)
+    current_quarter = (today.month - 1) // 3 + 1
+    prev_quarter_year, prev_quarter = (
+        (today.year - 1, 4) if current_quarter == 1 else (today.year, current_quarter - 1)
+    )
+    return {
+        "current_month": (first_curr_month, last_curr_month),
+        "previous_month": month_bounds(prev_month.year, prev_month.month),
+        "current_quarter": quarter_bounds(today.year, current_quarter),
+        "previous_quarter": quarter_bounds(prev_quarter_year, prev_quarter),
+        "current_year": year_bounds(today.year),
+        "previous_year": year_bounds(today.year - 1),
+    }
+
+
+def calendar_periods(today):
+    """
+    Calendar bounds of the week (from Monday), month and year around
+    `today`, keyed as the referral and chart stats report them.
+    """
+    start_of_week = today - timedelta(days=today.weekday())
+    return {
+        "this_week": (start_of_week, start_of_week + timedelta(days=6)),
+        "this_month": month_bounds(today.year, today.month),
+        "this_year": year_bounds(today.year),
+    }
@@ -1,9 +1,10 @@
 import django_filters
-from django.utils.timezone import now, timedelta
-from calendar import monthrange
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import localdate, timedelta
+from .date_ranges import in_date_range, month_bounds, year_bounds
 from .models import Bill
 from center_detail.models import CenterDetail
-from .models import Doctor, DiagnosisType, PatientReport, SampleTestReport
+from .models import BillDiagnosisType, Doctor, DiagnosisType, PatientReport, SampleTestReport
 
 # Doctor Filter
 class DoctorFilter(django_filters.FilterSet):
@@ -46,19 +47,22 @@ class BillFilter(django_filters.FilterSet):
     referred_by_doctor = django_filters.NumberFilter(field_name='referred_by_doctor__id')
     test_done_by = django_filters.NumberFilter(field_name='test_done_by__id')
 
+    # Calendar filters compare the raw timestamp against local-day boundaries
+    # (see date_ranges) so the (center_detail, date) indexes can be used.
+
     # Date of Test
-    date_of_test = django_filters.DateFilter(field_name='date_of_test__date', lookup_expr='exact')
-    start_date = django_filters.DateFilter(field_name='date_of_test__date', lookup_expr='gte')
-    end_date = django_filters.DateFilter(field_name='date_of_test__date', lookup_expr='lte')
-    test_year = django_filters.NumberFilter(field_name='date_of_test__year', lookup_expr='exact')
-    test_month = django_filters.NumberFilter(field_name='date_of_test__month', lookup_expr='exact')
+    date_of_test = django_filters.DateFilter(field_name='date_of_test', method='filter_on_date')
+    start_date = django_filters.DateFilter(field_name='date_of_test', method='filter_from_date')
+    end_date = django_filters.DateFilter(field_name='date_of_test', method='filter_to_date')
+    test_year = django_filters.NumberFilter(field_name='date_of_test', method='filter_year', min_value=1, max_value=9999)
+    test_month = django_filters.NumberFilter(field_name='date_of_test', method='filter_month', min_value=1, max_value=12)
 
     # Date of Bill
-    date_of_bill = django_filters.DateFilter(field_name='date_of_bill__date', lookup_expr='exact')
-    bill_start_date = django_filters.DateFilter(field_name='date_of_bill__date', lookup_expr='gte')
-    bill_end_date = django_filters.DateFilter(field_name='date_of_bill__date', lookup_expr='lte')
-    bill_year = django_filters.NumberFilter(field_name='date_of_bill__year', lookup_expr='exact')
-    bill_month = django_filters.NumberFilter(field_name='date_of_bill__month', lookup_expr='exact')
+    date_of_bill = django_filters.DateFilter(field_name='date_of_bill', method='filter_on_date')
+    bill_start_date = django_filters.DateFilter(field_name='date_of_bill', method='filter_from_date')
+    bill_end_date = django_filters.DateFilter(field_name='date_of_bill', method='filter_to_date')
+    bill_year = django_filters.NumberFilter(field_name='date_of_bill', method='filter_year', min_value=1, max_value=9999)
+    bill_month = django_filters.NumberFilter(field_name='date_of_bill', method='filter_month', min_value=1, max_value=12)
     franchise_name_id = django_filters.NumberFilter(field_name='franchise_name__id')
 
     bill_status = django_filters.CharFilter(field_name='bill_status', lookup_expr='iexact')
@@ -93,28 +97,48 @@ class BillFilter(django_filters.FilterSet):
             'unpaid_or_partial',
         ]
 
+    # Year filter that narrows each date field's month filter
+    YEAR_FILTER_FOR_FIELD = {'date_of_test': 'test_year', 'date_of_bill': 'bill_year'}
+
+    # The date methods below receive the filter's field_name as `name`.
+    def filter_on_date(self, queryset, name, value):
+        return queryset.filter(in_date_range(name, value, value))
+
+    def filter_from_date(self, queryset, name, value):
+        return queryset.filter(in_date_range(name, start_date=value))
+
+    def filter_to_date(self, queryset, name, value):
+        return queryset.filter(in_date_range(name, end_date=value))
+
+    def filter_year(self, queryset, name, value):
+        return queryset.filter(in_date_range(name, *year_bounds(int(value))))
+
+    def filter_month(self, queryset, name, value):
+        year = self.form.cleaned_data.get(self.YEAR_FILTER_FOR_FIELD[name])
+        if year is None:
+            # A month without a year recurs every year, so no single range
+            # covers it; fall back to matching the extracted month.
+            return queryset.filter(**{f'{name}__month': int(value)})
+        return queryset.filter(in_date_range(name, *month_bounds(int(year), int(value))))
+
     def filter_last_month(self, queryset, name, value):
         if value:
-            today = now().date()
-            year = today.year
-            month = today.month - 1 or 12
-            if month == 12:
-                year -= 1
-            first_day = f"{year}-{month:02d}-01"
-            last_day = f"{year}-{month:02d}-{monthrange(year, month)[1]}"
-            return queryset.filter(date_of_test__date__range=[first_day, last_day])
+            previous_month = localdate().replace(day=1) - timedelta(days=1)
+            return queryset.filter(
+                in_date_range('date_of_test', *month_bounds(previous_month.year, previous_month.month))
+            )
         return queryset
 
     def filter_this_month(self, queryset, name, value):
         if value:
-            today = now().date()
-            return queryset.filter(date_of_test__year=today.year, date_of_test__month=today.month)
+            today = localdate()
+            return queryset.filter(in_date_range('date_of_test', *month_bounds(today.year, today.month)))
         return queryset
 
     def filter_last_7_days(self, queryset, name, value):
         if value:
-            cutoff = now().date() - timedelta(days=7)
-            return queryset.filter(date_of_test__date__gte=cutoff)
+            cutoff = localdate() - timedelta(days=7)
+            return queryset.filter(in_date_range('date_of_test', start_date=cutoff))
         return queryset
 
     def filter_unpaid_or_partial(self, queryset, name, value):
@@ -122,6 +146,22 @@ class BillFilter(django_filters.FilterSet):
             return queryset.filter(bill_status__in=['Unpaid', 'Partially Paid'])
         return queryset
 
+class PendingReportFilter(BillFilter):
+    """
+    The bill filters, and `category`: bills with a line in that category,
+    probed per pending bill rather than joined, so the queue keeps its order
+    from bill_pending_report_idx.
+    """
+    category = django_filters.NumberFilter(method='filter_category')
+
+    class Meta(BillFilter.Meta):
+        fields = BillFilter.Meta.fields + ['category']
+
+    def filter_category(self, queryset, name, value):
+        lines = BillDiagnosisType.objects.filter(bill_id=OuterRef('pk'), category_id=value)
+        return queryset.filter(Exists(lines))
+
+
 class PatientReportFilter(django_filters.FilterSet):
     patient_name = django_filters.CharFilter(field_name='patient_name', lookup_expr='icontains')
     start_date = django_filters.DateFilter(field_name='bill__date_of_bill', lookup_expr='gte')
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from diagnosis.bill_lines import fill_lines
+from diagnosis.models import Bill, BillDiagnosisType, DoctorCategoryPercentage
+from diagnosis.reference_data import invalidate_bills
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the category, franchise lab flag and incentive of bill lines "
+        "that have no category, such as lines written by older code during a "
+        "deploy. Each bill's incentive is split over its lines at the doctor's "
+        "current percentages. Works through the bills in id order, one batch "
+        "per transaction, so it can be stopped and re-run safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Bills processed per transaction (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pending = Bill.objects.filter(
+            pk__in=BillDiagnosisType.objects.filter(category__isnull=True).values("bill_id")
+        )
+
+        last_id = 0
+        filled = 0
+        while True:
+            batch = list(
+                pending.filter(pk__gt=last_id)
+                .order_by("pk")
+                .only("id", "referred_by_doctor_id", "incentive_amount", "center_detail_id")[:batch_size]
+            )
+            if not batch:
+                break
+
+            last_id = batch[-1].pk
+            with transaction.atomic():
+                filled += fill_lines(batch, BillDiagnosisType, DoctorCategoryPercentage)
+                for center_id in {bill.center_detail_id for bill in batch}:
+                    invalidate_bills(center_id)
+            self.stdout.write(f"Filled {filled} bill lines (up to bill id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {filled} bill lines filled."))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from diagnosis.models import PLACEHOLDER_PHONE_NUMBER, Bill, Patient
+
+
+class Command(BaseCommand):
+    help = (
+        "Create patients from existing bills and link each bill to its patient. "
+        "Works through unlinked bills in id order, one batch per transaction, "
+        "so it can be stopped and re-run safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Bills processed per transaction (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        unlinked = Bill.objects.filter(patient__isnull=True).exclude(
+            patient_phone_number=PLACEHOLDER_PHONE_NUMBER
+        )
+        patient_of_bill = Patient.objects.filter(
+            center_detail=OuterRef("center_detail"),
+            phone_number=OuterRef("patient_phone_number"),
+        ).values("pk")[:1]
+
+        last_id = 0
+        linked = 0
+        while True:
+            batch = list(
+                unlinked.filter(pk__gt=last_id)
+                .order_by("pk")
+                .only(
+                    "id", "center_detail_id", "patient_phone_number",
+                    "patient_name", "patient_age", "patient_sex",
+                )[:batch_size]
+            )
+            if not batch:
+                break
+
+            first_id, last_id = batch[0].pk, batch[-1].pk
+            with transaction.atomic():
+                # Bills come in id order, so the newest details of a patient win.
+                Patient.upsert_from_bills(batch)
+                linked += unlinked.filter(pk__gte=first_id, pk__lte=last_id).update(
+                    patient=Subquery(patient_of_bill)
+                )
+            self.stdout.write(f"Linked {linked} bills (up to bill id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {linked} bills linked to patients."))
@@ -0,0 +1,360 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from multiprocessing import get_context
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from authentication.models import StaffAccount
+from center_detail.models import CenterDetail
+from diagnosis.models import (
+    Bill,
+    BillDiagnosisType,
+    DiagnosisCategory,
+    DiagnosisType,
+    DiagnosisTypePrice,
+    Doctor,
+    DoctorCategoryPercentage,
+    FranchiseName,
+    Patient,
+    PatientReport,
+)
+from diagnosis.reference_data import invalidate_bills
+
+# (name, is_franchise_lab, price range)
+CATEGORIES = [
+    ("Ultrasound", False, (600, 2500)),
+    ("X-Ray", False, (300, 1200)),
+    ("Pathology", False, (100, 900)),
+    ("ECG", False, (200, 600)),
+    ("CT Scan", False, (2000, 6000)),
+    ("Franchise Lab", True, (300, 3000)),
+]
+LINES_PER_BILL = [1, 2, 3, 4]
+LINES_PER_BILL_WEIGHTS = [55, 30, 10, 5]
+STATUSES = ["Fully Paid", "Partially Paid", "Unpaid"]
+STATUS_WEIGHTS = [80, 12, 8]
+SEXES = ["Male", "Female", "Others"]
+FIRST_NAMES = ["Asha", "Ravi", "Meera", "Kabir", "Neha", "Arjun", "Pooja", "Vikram", "Sana", "Rohan"]
+LAST_NAMES = ["Rao", "Shah", "Iyer", "Das", "Sen", "Gupta", "Khan", "Patel", "Nair", "Singh"]
+PATIENT_PHONE_BASE = 9_100_000_000
+PRICE_HISTORY_START = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+REPORT_PLACEHOLDER = "reports/load-test-placeholder.pdf"
+
+
+def _rng(seed, *parts):
+    """Generator of its own, so every center and chunk is reproducible on its own."""
+    return random.Random(":".join(str(part) for part in (seed, *parts)))
+
+
+def _patient(k):
+    """Name, age and sex of the k-th patient of a center."""
+    return f"{FIRST_NAMES[k % 10]} {LAST_NAMES[k // 10 % 10]}", 1 + k * 7 % 90, SEXES[k % 3]
+
+
+def _load_chunk(chunk):
+    """
+    Build and insert one chunk of bills, with their lines and reports, for
+    one center. Everything is drawn from a generator seeded by the chunk's
+    position, so the data doesn't depend on which worker loads which chunk.
+    """
+    rng = _rng(chunk["seed"], "bills", chunk["center_index"], chunk["start"])
+    categories = {
+        category_id: DiagnosisCategory(id=category_id, name=name, is_franchise_lab=is_franchise_lab)
+        for category_id, name, is_franchise_lab in chunk["categories"]
+    }
+    types = [
+        DiagnosisType(id=type_id, price=price, category=categories[category_id], center_detail_id=chunk["center_id"])
+        for type_id, price, category_id in chunk["types"]
+    ]
+    percentages = {doctor_id: dict(rates) for doctor_id, rates in chunk["doctors"]}
+    doctor_ids = list(percentages)
+    end, days = chunk["end"], chunk["days"]
+
+    bills, lines_per_bill = [], []
+    for i in range(chunk["start"], chunk["start"] + chunk["count"]):
+        bill_types = rng.sample(types, rng.choices(LINES_PER_BILL, LINES_PER_BILL_WEIGHTS)[0])
+        lines = [BillDiagnosisType(diagnosis_type=dt, price_at_time=dt.price) for dt in bill_types]
+        has_franchise_line = any(dt.category.is_franchise_lab for dt in bill_types)
+        total = sum(dt.price for dt in bill_types)
+        doctor_id = rng.choice(doctor_ids) if rng.random() < 0.9 else None
+
+        disc_by_doctor = int(round(total * rng.uniform(0.05, 0.15), -1)) if doctor_id and rng.random() < 0.2 else 0
+        disc_by_center = int(round(total * rng.uniform(0.02, 0.1), -1)) if rng.random() < 0.1 else 0
+        status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+        due = max(total - disc_by_doctor - disc_by_center, 0)
+        paid = {"Fully Paid": due, "Partially Paid": due // 2, "Unpaid": 0}[status]
+
+        # Bills are spread evenly over the period, oldest first, during opening hours.
+        day = end - timedelta(days=days * (chunk["total"] - i) // chunk["total"])
+        billed_at = timezone.make_aware(
+            datetime.combine(day, time(8)) + timedelta(minutes=rng.randrange(12 * 60))
+        )
+        patient = rng.randrange(chunk["patients"])
+        patient_name, patient_age, patient_sex = _patient(patient)
+        bill = Bill(
+            bill_number=f"LT{chunk['seed']:04d}{chunk['center_index']:04d}{i:08d}",
+            date_of_test=billed_at,
+            date_of_bill=billed_at,
+            patient_name=patient_name,
+            patient_age=patient_age,
+            patient_sex=patient_sex,
+            patient_phone_number=PATIENT_PHONE_BASE + patient,
+            test_done_by_id=rng.choice(chunk["staff"]),
+            referred_by_doctor_id=doctor_id,
+            franchise_name_id=rng.choice(chunk["franchises"]) if has_franchise_line else None,
+            bill_status=status,
+            paid_amount=paid,
+            disc_by_center=disc_by_center,
+            disc_by_doctor=disc_by_doctor,
+            center_detail_id=chunk["center_id"],
+        )
+        bill.apply_totals_and_incentive(lines, percentages.get(doctor_id, {}))
+        bills.append(bill)
+        lines_per_bill.append(lines)
+
+    # Reports are uploaded for most bills, except for the last couple of days.
+    report_cutoff = timezone.make_aware(datetime.combine(end - timedelta(days=2), time.min))
+    with_report = [
+        bill for bill in bills
+        if bill.date_of_bill < report_cutoff and rng.random() < chunk["report_ratio"]
+    ]
+    for bill in with_report:
+        bill.has_report = True
+
+    with transaction.atomic():
+        patient_ids = dict(
+            Patient.objects.filter(
+                center_detail_id=chunk["center_id"],
+                phone_number__in={bill.patient_phone_number for bill in bills},
+            ).values_list("phone_number", "id")
+        )
+        for bill in bills:
+            bill.patient_id = patient_ids[bill.patient_phone_number]
+        Bill.objects.bulk_create(bills)
+        for bill, lines in zip(bills, lines_per_bill):
+            for line in lines:
+                line.bill = bill
+        BillDiagnosisType.objects.bulk_create(line for lines in lines_per_bill for line in lines)
+        PatientReport.objects.bulk_create(
+            PatientReport(bill=bill, center_detail_id=chunk["center_id"], report_file=REPORT_PLACEHOLDER)
+            for bill in with_report
+        )
+        invalidate_bills(chunk["center_id"])
+    return len(bills)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic multi-center dataset for load tests and EXPLAIN "
+        "checks: centers with staff, doctors and their category percentages, "
+        "diagnosis types, franchises, patients and bills with lines, discounts "
+        "and reports. Bills are loaded with bulk_create in chunks spread over "
+        "worker processes. The same arguments always produce the same data, so "
+        "a seed can only be generated once per database. Reports all point at "
+        "one placeholder file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--centers", type=int, default=3, help="Centers to create (default: 3).")
+        parser.add_argument(
+            "--bills-per-center", type=int, default=10000, help="Bills per center (default: 10000).",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the generated data (default: 1).")
+        parser.add_argument(
+            "--days", type=int, default=730, help="Days of history the bills are spread over (default: 730).",
+        )
+        parser.add_argument(
+            "--end-date", type=date.fromisoformat, default=None,
+            help="Date of the newest bills, YYYY-MM-DD (default: today).",
+        )
+        parser.add_argument("--doctors", type=int, default=40, help="Doctors per center (default: 40).")
+        parser.add_argument(
+            "--types-per-category", type=int, default=8,
+            help="Diagnosis types per category and center (default: 8).",
+        )
+        parser.add_argument(
+            "--report-ratio", type=float, default=0.85,
+            help="Share of bills older than two days with a report (default: 0.85).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000, help="Bills inserted per transaction (default: 5000).",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Worker processes loading chunks; 1 loads in this process (default: 4).",
+        )
+
+    def handle(self, *args, **options):
+        seed = options["seed"]
+        if not 0 <= seed < 10000:
+            raise CommandError("--seed must be between 0 and 9999.")
+        if options["centers"] < 1 or options["bills_per_center"] < 1:
+            raise CommandError("--centers and --bills-per-center must be at least 1.")
+        owner_phones = [self._owner_phone(seed, center_index) for center_index in range(options["centers"])]
+        if CenterDetail.objects.filter(owner_phone__in=owner_phones).exists():
+            raise CommandError(f"Seed {seed} has already been generated in this database; pick another seed.")
+
+        end = options["end_date"] or timezone.localdate()
+        if options["report_ratio"] > 0 and not default_storage.exists(REPORT_PLACEHOLDER):
+            default_storage.save(REPORT_PLACEHOLDER, ContentFile(b"%PDF-1.4\n% load test placeholder\n"))
+
+        categories = self._categories()
+        chunks = []
+        for center_index in range(options["centers"]):
+            center_chunk = self._create_center(seed, center_index, categories, options)
+            bills = options["bills_per_center"]
+            for start in range(0, bills, options["chunk_size"]):
+                chunks.append({
+                    **center_chunk,
+                    "seed": seed,
+                    "center_index": center_index,
+                    "start": start,
+                    "count": min(options["chunk_size"], bills - start),
+                    "total": bills,
+                    "end": end,
+                    "days": options["days"],
+                    "report_ratio": options["report_ratio"],
+                })
+            self.stdout.write(f"Created center {center_index + 1}/{options['centers']}")
+
+        loaded = 0
+        for count in self._run(chunks, options["workers"]):
+            loaded += count
+            self.stdout.write(f"Loaded {loaded} bills")
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                for model in (Patient, Bill, BillDiagnosisType, PatientReport):
+                    cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {options['centers']} centers and {loaded} bills generated from seed {seed}."
+        ))
+
+    def _run(self, chunks, workers):
+        if workers <= 1:
+            yield from map(_load_chunk, chunks)
+            return
+
+        # Workers are fresh interpreters with their own connections. They set
+        # Django up before the first chunk brings this module (and the models)
+        # in.
+        connections.close_all()
+        with ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=django.setup) as pool:
+            yield from pool.map(_load_chunk, chunks)
+
+    @staticmethod
+    def _owner_phone(seed, center_index):
+        return f"7{seed:04d}{center_index:05d}"
+
+    @staticmethod
+    def _categories():
+        categories = []
+        for name, is_franchise_lab, price_range in CATEGORIES:
+            category, _ = DiagnosisCategory.objects.get_or_create(
+                name=name, defaults={"is_franchise_lab": is_franchise_lab},
+            )
+            categories.append((category, price_range))
+        return categories
+
+    @transaction.atomic
+    def _create_center(self, seed, center_index, categories, options):
+        """
+        Create one center and its reference data; returns the part of the
+        chunk description the bill workers need to know about it.
+        """
+        rng = _rng(seed, "center", center_index)
+        tag = f"lt{seed}c{center_index}"
+        center = CenterDetail.objects.create(
+            center_name=f"Load Center {seed}-{center_index}"[:30],
+            address=f"{center_index + 1} Load Street",
+            owner_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            owner_phone=self._owner_phone(seed, center_index),
+        )
+
+        password = make_password(tag)
+        staff = StaffAccount.objects.bulk_create(
+            StaffAccount(
+                username=f"{tag}s{k}",
+                email=f"{tag}s{k}@loadtest.invalid",
+                password=password,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                address=center.address,
+                phone_number=f"6{seed:04d}{center_index:04d}{k}",
+                center_detail=center,
+                is_admin=k == 0,
+                is_staff=k == 0,
+                has_accepted_license=True,
+            )
+            for k in range(4)
+        )
+
+        types = DiagnosisType.objects.bulk_create(
+            DiagnosisType(
+                center_detail=center,
+                name=f"{category.name} {k + 1}",
+                category=category,
+                price=rng.randrange(low, high + 1, 50),
+            )
+            for category, (low, high) in categories
+            for k in range(options["types_per_category"])
+        )
+        DiagnosisTypePrice.objects.bulk_create(
+            DiagnosisTypePrice(diagnosis_type=dt, price=dt.price, effective_from=PRICE_HISTORY_START)
+            for dt in types
+        )
+
+        doctors = Doctor.objects.bulk_create(
+            Doctor(
+                center_detail=center,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                hospital_name=f"Clinic {k + 1}",
+                phone_number=f"8{center_index:04d}{k:05d}",
+            )
+            for k in range(options["doctors"])
+        )
+        percentages = DoctorCategoryPercentage.objects.bulk_create(
+            DoctorCategoryPercentage(doctor=doctor, category=category, percentage=rng.randrange(0, 45, 5))
+            for doctor in doctors
+            for category, _ in categories
+        )
+        franchises = FranchiseName.objects.bulk_create(
+            FranchiseName(
+                franchise_name=f"Load Lab {seed}-{center_index}-{k + 1}",
+                address=f"{k + 1} Lab Road",
+                phone_number=f"5{seed:04d}{center_index:04d}{k}",
+                center_detail=center,
+            )
+            for k in range(3)
+        )
+
+        # Roughly three visits per patient.
+        patient_count = max(1, options["bills_per_center"] // 3)
+        for start in range(0, patient_count, options["chunk_size"]):
+            Patient.objects.bulk_create(
+                Patient(center_detail=center, phone_number=PATIENT_PHONE_BASE + k, name=name, age=age, sex=sex)
+                for k in range(start, min(start + options["chunk_size"], patient_count))
+                for name, age, sex in [_patient(k)]
+            )
+
+        rates = {}
+        for percentage in percentages:
+            rates.setdefault(percentage.doctor_id, []).append((percentage.category_id, percentage.percentage))
+        return {
+            "center_id": center.pk,
+            "categories": [(c.pk, c.name, c.is_franchise_lab) for c, _ in categories],
+            "types": [(dt.pk, dt.price, dt.category_id) for dt in types],
+            "doctors": [(doctor.pk, rates.get(doctor.pk, [])) for doctor in doctors],
+            "staff": [member.pk for member in staff],
+            "franchises": [franchise.pk for franchise in franchises],
+            "patients": patient_count,
+        }
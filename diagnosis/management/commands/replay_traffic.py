@@ -0,0 +1,299 @@
+import json
+import math
+import queue
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve, reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import StaffAccount
+from center_detail.models import CenterDetail
+
+# Combined log format, as gunicorn writes it:
+# host - user [time] "METHOD /path?query HTTP/1.1" status size "referer" "agent"
+LOG_LINE = re.compile(r'^\S+ \S+ \S+ \[[^\]]+\] "(?P<method>[A-Z]+) (?P<target>\S+) HTTP/[\d.]+" (?P<status>\d{3}) ')
+# The log has no request bodies, so only reads can be replayed.
+REPLAYED_METHODS = {"GET", "HEAD"}
+SAMPLE_IDS = 200
+# Access tokens normally expire within minutes; replay tokens outlive the run.
+TOKEN_LIFETIME = timedelta(hours=6)
+
+
+class Route:
+    """One URL pattern of the mix and how often, and how, the log hit it."""
+
+    def __init__(self, match, path):
+        self.name = f"/{match.route}"
+        self.match = match
+        self.path = path
+        self.hits = 0
+        self.variants = Counter()
+
+    def record(self, method, query):
+        self.hits += 1
+        self.variants[(method, query)] += 1
+
+
+def parse_access_log(lines, exclude=None):
+    """
+    Weighted request mix of an access log: the routes that answered reads
+    successfully, keyed by URL pattern. Returns the routes and a count of
+    the lines left out, by reason.
+    """
+    routes, skipped = {}, Counter()
+    for line in lines:
+        parsed = LOG_LINE.match(line)
+        if not parsed:
+            skipped["unparsed lines"] += 1
+            continue
+        if parsed["method"] not in REPLAYED_METHODS:
+            skipped["writes"] += 1
+            continue
+        if int(parsed["status"]) >= 400:
+            skipped["failed requests"] += 1
+            continue
+        path, _, query = parsed["target"].partition("?")
+        if exclude and exclude.search(path):
+            skipped["excluded paths"] += 1
+            continue
+        try:
+            match = resolve(path)
+        except Resolver404:
+            skipped["unknown paths"] += 1
+            continue
+        if match.app_name == "admin":
+            skipped["admin site"] += 1
+            continue
+        routes.setdefault(match.route, Route(match, path)).record(parsed["method"], query)
+    return routes, skipped
+
+
+def _model_for(match, argument):
+    """Model whose ids fill a path argument, if it can be told from the view."""
+    if argument == "pk":
+        view = getattr(match.func, "cls", None)
+        queryset = getattr(view, "queryset", None)
+        if queryset is not None:
+            return queryset.model
+        serializer = getattr(view, "serializer_class", None)
+        return getattr(getattr(serializer, "Meta", None), "model", None)
+    if argument.endswith("_id"):
+        for model in apps.get_models():
+            if model._meta.model_name == argument[:-3]:
+                return model
+    return None
+
+
+def _percentile(ordered, percent):
+    """Nearest-rank percentile of an ordered list."""
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the request mix of a gunicorn access log against a running "
+        "server. Successful reads are grouped by URL pattern and weighted by "
+        "how often they appear; path ids are filled in from the local "
+        "database and requests carry JWTs minted for its admin users, so the "
+        "server must share this database and SECRET_KEY. Reports p50/p95/p99 "
+        "latency and throughput per route."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--log", default="logs/gunicorn-access.log",
+            help="Access log to take the request mix from (default: logs/gunicorn-access.log).",
+        )
+        parser.add_argument(
+            "--base-url", default="http://127.0.0.1:8000", help="Server to replay against.",
+        )
+        parser.add_argument("--requests", type=int, default=1000, help="Requests to send (default: 1000).")
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight (default: 8).")
+        parser.add_argument(
+            "--username", action="append", default=[],
+            help="Send requests as this user; repeatable (default: up to --users unlocked admins).",
+        )
+        parser.add_argument("--users", type=int, default=10, help="Admins to spread requests over (default: 10).")
+        parser.add_argument("--exclude", help="Regular expression of paths to leave out of the mix.")
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the request sequence (default: 1).")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request fails (default: 30).")
+        parser.add_argument("--output", help="Also write the results as JSON to this file.")
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Print the request mix without sending anything.",
+        )
+
+    def handle(self, *args, **options):
+        exclude = re.compile(options["exclude"]) if options["exclude"] else None
+        try:
+            with open(options["log"], encoding="utf-8", errors="replace") as log:
+                routes, skipped = parse_access_log(log, exclude)
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['log']}: {exc}")
+
+        users = self._users(options)
+        replayable = self._with_sample_ids(routes.values(), users, skipped)
+        if not replayable:
+            raise CommandError("No replayable requests in the log.")
+
+        self._write_mix(replayable, skipped)
+        if options["dry_run"]:
+            return
+
+        plan = self._plan(replayable, users, options)
+        results, elapsed = self._replay(plan, options)
+        report = self._report(replayable, results, elapsed)
+        self._write_report(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(report, output, indent=2)
+
+    def _users(self, options):
+        users = StaffAccount.objects.filter(
+            is_active=True, is_locked=False, center_detail__isnull=False,
+        ).order_by("pk")
+        if options["username"]:
+            users = list(users.filter(username__in=options["username"]))
+        else:
+            users = list(users.filter(is_admin=True)[:options["users"]])
+        if not users:
+            raise CommandError("No users to send requests as; seed some with generate_load_data.")
+        return users
+
+    def _with_sample_ids(self, routes, users, skipped):
+        """
+        Attach to every route the ids each user's center can fill its path
+        arguments with, and drop the routes some argument can't be filled for.
+        """
+        replayable = []
+        for route in sorted(routes, key=lambda route: -route.hits):
+            route.ids = {}
+            for user in users:
+                ids = {}
+                for argument in route.match.kwargs:
+                    model = _model_for(route.match, argument)
+                    ids[argument] = self._sample_ids(model, user.center_detail_id) if model else []
+                if all(ids.values()):
+                    route.ids[user.pk] = ids
+            if route.match.kwargs and (not route.ids or not route.match.view_name):
+                skipped[f"no local ids for {route.name}"] += route.hits
+                continue
+            replayable.append(route)
+        return replayable
+
+    @staticmethod
+    def _sample_ids(model, center_id):
+        queryset = model.objects.all()
+        if model is CenterDetail:
+            queryset = queryset.filter(pk=center_id)
+        elif any(field.name == "center_detail" for field in model._meta.get_fields()):
+            queryset = queryset.filter(center_detail_id=center_id)
+        return list(queryset.order_by("-pk").values_list("pk", flat=True)[:SAMPLE_IDS])
+
+    def _plan(self, routes, users, options):
+        """The requests to send, drawn from the mix in a seeded order."""
+        rng = random.Random(options["seed"])
+        tokens = {}
+        for user in users:
+            token = AccessToken.for_user(user)
+            token.set_exp(lifetime=TOKEN_LIFETIME)
+            tokens[user.pk] = str(token)
+
+        plan = queue.SimpleQueue()
+        weights = [route.hits for route in routes]
+        for _ in range(options["requests"]):
+            route = rng.choices(routes, weights)[0]
+            method, query = rng.choices(list(route.variants), list(route.variants.values()))[0]
+            user_pk = rng.choice(list(route.ids) if route.match.kwargs else list(tokens))
+            if route.match.kwargs:
+                kwargs = {argument: rng.choice(ids) for argument, ids in route.ids[user_pk].items()}
+                path = reverse(route.match.view_name, kwargs=kwargs)
+            else:
+                path = route.path
+            plan.put((route.name, method, f"{path}?{query}" if query else path, tokens[user_pk]))
+        return plan
+
+    def _replay(self, plan, options):
+        results = {}
+        lock = threading.Lock()
+
+        def worker():
+            session = requests.Session()
+            while True:
+                try:
+                    name, method, target, token = plan.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    response = session.request(
+                        method, options["base_url"].rstrip("/") + target,
+                        headers={"Authorization": f"Bearer {token}"}, timeout=options["timeout"],
+                    )
+                    ok = response.status_code < 400
+                except requests.RequestException:
+                    ok = False
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies, errors = results.setdefault(name, ([], Counter()))
+                    latencies.append(latency)
+                    errors[ok] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            for future in [pool.submit(worker) for _ in range(options["concurrency"])]:
+                future.result()
+        return results, time.perf_counter() - start
+
+    @staticmethod
+    def _report(routes, results, elapsed):
+        report = {"elapsed_s": round(elapsed, 3), "routes": {}}
+        total, failed = 0, 0
+        for route in routes:
+            if route.name not in results:
+                continue
+            latencies, outcomes = results[route.name]
+            ordered = sorted(latencies)
+            total += len(ordered)
+            failed += outcomes[False]
+            report["routes"][route.name] = {
+                "requests": len(ordered),
+                "errors": outcomes[False],
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+                "throughput_rps": round(len(ordered) / elapsed, 2),
+            }
+        report.update(requests=total, errors=failed, throughput_rps=round(total / elapsed, 2))
+        return report
+
+    def _write_mix(self, routes, skipped):
+        total = sum(route.hits for route in routes)
+        self.stdout.write(f"Request mix ({total} replayable log lines):")
+        for route in routes:
+            self.stdout.write(f"  {route.hits / total:7.2%}  {route.name}")
+        for reason, count in sorted(skipped.items()):
+            self.stdout.write(f"  skipped {count} {reason}")
+
+    def _write_report(self, report):
+        self.stdout.write(
+            f"{'route':<55} {'reqs':>6} {'errs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7}"
+        )
+        for name, stats in report["routes"].items():
+            self.stdout.write(
+                f"{name[:55]:<55} {stats['requests']:>6} {stats['errors']:>5} {stats['p50_ms']:>8} "
+                f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['throughput_rps']:>7}"
+            )
+        style = self.style.SUCCESS if not report["errors"] else self.style.WARNING
+        self.stdout.write(style(
+            f"{report['requests']} requests, {report['errors']} errors in {report['elapsed_s']}s "
+            f"({report['throughput_rps']} req/s)"
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from diagnosis.models import PendingDeletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish the background deletions of diagnosis types and categories "
+        "that were cut short, for example by a worker restart. Bills are "
+        "deleted in batches that commit on their own, so it can be stopped "
+        "and re-run safely; run it after every deploy."
+    )
+
+    def handle(self, *args, **options):
+        pending = PendingDeletion.objects.select_related("diagnosis_type", "category").order_by("pk")
+        finished = 0
+        for deletion in pending:
+            self.stdout.write(f"Deleting {deletion.diagnosis_type or deletion.category}")
+            deletion.run()
+            finished += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {finished} deletions finished."))
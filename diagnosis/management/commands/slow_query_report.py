@@ -0,0 +1,98 @@
+import glob
+import json
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Fingerprint:
+    """The logged runs of one statement, whatever its literals."""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.route_ms = Counter()
+        self.sql = ""
+        self.plan = None
+
+    def record(self, entry):
+        self.count += 1
+        self.total_ms += entry["duration_ms"]
+        self.max_ms = max(self.max_ms, entry["duration_ms"])
+        self.route_ms[entry.get("route") or "-"] += entry["duration_ms"]
+        self.sql = entry["sql"]
+        if entry.get("plan"):
+            self.plan = entry["plan"]
+
+
+def read_slow_query_log(paths):
+    """Slow-query log entries grouped by fingerprint, and the lines that didn't parse."""
+    fingerprints, unparsed = {}, 0
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                    fingerprint = entry["fingerprint"]
+                except (ValueError, KeyError, TypeError):
+                    unparsed += 1
+                    continue
+                fingerprints.setdefault(fingerprint, Fingerprint(fingerprint)).record(entry)
+    return fingerprints, unparsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the slow-query log: the statements that cost the most in "
+        "total, overall and for each endpoint, with their captured plans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--log", default="logs/slow-queries.jsonl",
+            help=(
+                "Slow-query log; the files of every worker process, rotated ones "
+                "included, are read (default: logs/slow-queries.jsonl)."
+            ),
+        )
+        parser.add_argument("--top", type=int, default=5, help="Statements to show per list (default: 5).")
+        parser.add_argument("--plans", action="store_true", help="Print the captured plan of each statement.")
+
+    def handle(self, *args, **options):
+        paths = sorted(glob.glob(f"{glob.escape(options['log'])}*"))
+        if not paths:
+            raise CommandError(f"No slow-query log at {options['log']}.")
+        fingerprints, unparsed = read_slow_query_log(paths)
+        if not fingerprints:
+            raise CommandError("The slow-query log has no entries.")
+
+        ranked = sorted(fingerprints.values(), key=lambda item: -item.total_ms)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Slowest statements overall ({len(ranked)} fingerprints):"))
+        for item in ranked[:options["top"]]:
+            self._write_fingerprint(item, options["plans"])
+
+        by_route = defaultdict(list)
+        for item in ranked:
+            for route in item.route_ms:
+                by_route[route].append(item)
+        route_ms = {route: sum(item.route_ms[route] for item in items) for route, items in by_route.items()}
+        for route in sorted(by_route, key=lambda route: -route_ms[route]):
+            name = f"/{route}" if route != "-" else "(no route)"
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name} ({route_ms[route]:.1f} ms in slow statements):"))
+            items = sorted(by_route[route], key=lambda item: -item.route_ms[route])
+            for item in items[:options["top"]]:
+                self._write_fingerprint(item, plans=False)
+        if unparsed:
+            self.stdout.write(self.style.WARNING(f"Skipped {unparsed} unparsed lines."))
+
+    def _write_fingerprint(self, item, plans):
+        self.stdout.write(
+            f"  {item.fingerprint}  {item.count:>5} runs  {item.total_ms:>10.1f} ms total  "
+            f"{item.total_ms / item.count:>8.1f} ms mean  {item.max_ms:>8.1f} ms max"
+        )
+        self.stdout.write(f"    {item.sql[:200]}")
+        if plans and item.plan:
+            for line in item.plan:
+                self.stdout.write(f"      {line}")
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.12 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+def normalize_doctor_phone_numbers(apps, schema_editor):
+    """
+    Store missing phone numbers as NULL and clear the phone number of any
+    later duplicate within a center, so the unique constraint can be added.
+    The oldest doctor keeps the number. Every cleared number is recorded in
+    the audit log, with the doctor who kept it.
+    """
+    Doctor = apps.get_model("diagnosis", "Doctor")
+    AuditLog = apps.get_model("diagnosis", "AuditLog")
+    Doctor.objects.filter(phone_number="").update(phone_number=None)
+
+    kept_by = {}
+    cleared = []
+    doctors = (
+        Doctor.objects.exclude(phone_number=None)
+        .order_by("id")
+        .values_list("id", "center_detail_id", "phone_number")
+    )
+    for doctor_id, center_id, phone_number in doctors.iterator():
+        key = (center_id, phone_number)
+        if key in kept_by:
+            cleared.append((doctor_id, center_id, phone_number, kept_by[key]))
+        else:
+            kept_by[key] = doctor_id
+
+    if not cleared:
+        return
+    AuditLog.objects.bulk_create(
+        AuditLog(
+            action="UPDATE",
+            model_name="Doctor",
+            object_id=str(doctor_id),
+            details=(
+                f"Cleared phone number {phone_number}, duplicating doctor {kept_id} of "
+                f"center {center_id}, to add unique_doctor_phone_per_center"
+            ),
+        )
+        for doctor_id, center_id, phone_number, kept_id in cleared
+    )
+    Doctor.objects.filter(id__in=[doctor_id for doctor_id, *_ in cleared]).update(phone_number=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0012_alter_sampletestreport_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_doctor_phone_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='doctor',
+            constraint=models.UniqueConstraint(fields=('center_detail', 'phone_number'), name='unique_doctor_phone_per_center'),
+        ),
+    ]
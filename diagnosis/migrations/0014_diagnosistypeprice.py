@@ -0,0 +1,51 @@
+# Generated by Django 5.2.12 on 2026-10-19 13:01
+
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_price_history(apps, schema_editor):
+    """
+    Record every current price as in force since the epoch: the history of
+    earlier prices is unknown, so all existing bills fall under today's price.
+    """
+    DiagnosisType = apps.get_model("diagnosis", "DiagnosisType")
+    DiagnosisTypePrice = apps.get_model("diagnosis", "DiagnosisTypePrice")
+    since = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    DiagnosisTypePrice.objects.bulk_create(
+        (
+            DiagnosisTypePrice(diagnosis_type_id=dt_id, price=price, effective_from=since)
+            for dt_id, price in DiagnosisType.objects.values_list("id", "price").iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0013_doctor_unique_doctor_phone_per_center'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisTypePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.IntegerField()),
+                ('effective_from', models.DateTimeField(default=django.utils.timezone.now)),
+                ('diagnosis_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='diagnosis.diagnosistype')),
+            ],
+            options={
+                'verbose_name': 'Diagnosis Type Price',
+                'verbose_name_plural': 'Diagnosis Type Prices',
+                'ordering': ['-effective_from'],
+                'indexes': [models.Index(fields=['diagnosis_type', 'effective_from'], name='diag_price_type_from_idx')],
+            },
+        ),
+        migrations.RunPython(seed_price_history, migrations.RunPython.noop),
+    ]
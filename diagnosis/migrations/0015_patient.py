@@ -0,0 +1,44 @@
+# Generated by Django 5.2.12 on 2026-10-19 13:03
+
+import diagnosis.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('center_detail', '0025_alter_activesubscription_subscription_plan'),
+        ('diagnosis', '0014_diagnosistypeprice'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Patient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.PositiveBigIntegerField()),
+                ('name', models.CharField(max_length=60)),
+                ('age', models.PositiveIntegerField(validators=[diagnosis.models.validate_age])),
+                ('sex', models.CharField(choices=[('Male', 'Male'), ('Female', 'Female'), ('Others', 'Others')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('center_detail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patients', to='center_detail.centerdetail')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='patient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bills', to='diagnosis.patient'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['patient', '-date_of_bill'], name='bill_patient_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='patient',
+            constraint=models.UniqueConstraint(fields=('center_detail', 'phone_number'), name='unique_patient_phone_per_center'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.12 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0015_patient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['center_detail', 'date_of_test'], name='bill_center_test_date_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.12 on 2026-10-19 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('center_detail', '0025_alter_activesubscription_subscription_plan'),
+        ('diagnosis', '0016_bill_center_date_indexes'),
+    ]
+
+    operations = [
+        # Build the new indexes before dropping the ones they replace.
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['center_detail', '-date_of_bill', '-id'], name='bill_center_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['center_detail', 'referred_by_doctor', 'date_of_bill'], name='bill_center_doctor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('bill_status__in', ['Unpaid', 'Partially Paid'])), fields=['center_detail', '-date_of_bill', '-id'], name='bill_unpaid_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billdiagnosistype',
+            index=models.Index(fields=['diagnosis_type', 'bill'], name='billline_type_bill_idx'),
+        ),
+        migrations.AlterField(
+            model_name='bill',
+            name='center_detail',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='center_detail_bill', to='center_detail.centerdetail'),
+        ),
+        migrations.AlterField(
+            model_name='billdiagnosistype',
+            name='bill',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='bill_diagnosis_types', to='diagnosis.bill'),
+        ),
+        migrations.AlterField(
+            model_name='billdiagnosistype',
+            name='diagnosis_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='bill_references', to='diagnosis.diagnosistype'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.12 on 2026-10-19 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0017_bill_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billdiagnosistype',
+            name='category',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bill_lines', to='diagnosis.diagnosiscategory'),
+        ),
+        migrations.AddField(
+            model_name='billdiagnosistype',
+            name='incentive_amount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='billdiagnosistype',
+            name='is_franchise_lab',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='billdiagnosistype',
+            index=models.Index(fields=['category', 'bill'], name='billline_category_bill_idx'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+
+
+# A frozen copy of diagnosis.bill_lines as of this migration, so that later
+# changes to it don't change what the migration does.
+
+def allocate(amount, weights):
+    if not weights:
+        return []
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1] * len(weights), len(weights)
+    shares = [amount * weight // total for weight in weights]
+    remainders = [amount * weight - share * total for weight, share in zip(weights, shares)]
+    left = amount - sum(shares)
+    for i in sorted(range(len(weights)), key=lambda i: -remainders[i])[:left]:
+        shares[i] += 1
+    return shares
+
+
+def net_incentives(earned, prices, incentive):
+    discount = sum(earned) - incentive
+    weights = earned if sum(earned) > 0 else prices
+    return [line - share for line, share in zip(earned, allocate(discount, weights))]
+
+
+def fill_lines(bills, BillDiagnosisType, DoctorCategoryPercentage):
+    bills = {bill.pk: bill for bill in bills}
+    lines = list(
+        BillDiagnosisType.objects.filter(bill_id__in=list(bills))
+        .select_related("diagnosis_type__category")
+        .order_by("bill_id", "pk")
+    )
+    doctor_ids = {bill.referred_by_doctor_id for bill in bills.values()} - {None}
+    percentages = {
+        (doctor_id, category_id): percentage
+        for doctor_id, category_id, percentage in DoctorCategoryPercentage.objects.filter(
+            doctor_id__in=doctor_ids
+        ).values_list("doctor_id", "category_id", "percentage")
+    }
+
+    lines_of = {}
+    for line in lines:
+        category = line.diagnosis_type.category
+        line.category = category
+        line.is_franchise_lab = category.is_franchise_lab
+        lines_of.setdefault(line.bill_id, []).append(line)
+
+    for bill_id, bill_lines in lines_of.items():
+        bill = bills[bill_id]
+        earned = [
+            (line.price_at_time * percentages.get((bill.referred_by_doctor_id, line.category.pk), 0)) // 100
+            if bill.referred_by_doctor_id else 0
+            for line in bill_lines
+        ]
+        prices = [line.price_at_time for line in bill_lines]
+        for line, incentive in zip(bill_lines, net_incentives(earned, prices, bill.incentive_amount)):
+            line.incentive_amount = incentive
+
+    BillDiagnosisType.objects.bulk_update(lines, ["category", "is_franchise_lab", "incentive_amount"])
+
+
+def fill_bill_lines(apps, schema_editor):
+    """
+    Split the incentive of every existing bill over its lines, doctor
+    discount included, and copy their categories onto them. Bills are
+    filled in id order, one batch per transaction, so a large table is
+    never locked at once.
+    """
+    Bill = apps.get_model("diagnosis", "Bill")
+    BillDiagnosisType = apps.get_model("diagnosis", "BillDiagnosisType")
+    DoctorCategoryPercentage = apps.get_model("diagnosis", "DoctorCategoryPercentage")
+
+    last_id = 0
+    while True:
+        batch = list(
+            Bill.objects.filter(pk__gt=last_id)
+            .order_by("pk")
+            .only("id", "referred_by_doctor_id", "incentive_amount")[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].pk
+        with transaction.atomic(using=schema_editor.connection.alias):
+            fill_lines(batch, BillDiagnosisType, DoctorCategoryPercentage)
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ('diagnosis', '0018_bill_line_denormalized_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_bill_lines, migrations.RunPython.noop),
+    ]
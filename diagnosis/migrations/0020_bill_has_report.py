@@ -0,0 +1,28 @@
+# Generated by Django 5.2.12 on 2026-10-19 14:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('center_detail', '0025_alter_activesubscription_subscription_plan'),
+        ('diagnosis', '0019_fill_bill_line_incentives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReportCount',
+            fields=[
+                ('center_detail', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_report_count', serialize=False, to='center_detail.centerdetail')),
+                ('count', models.IntegerField(default=0)),
+                ('counted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='has_report',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, transaction
+from django.db.models import Exists, OuterRef
+
+BATCH_SIZE = 2000
+
+
+def mark_reported_bills(apps, schema_editor):
+    """
+    Set has_report on every bill with a report, in id order, one batch per
+    transaction, before the partial index over the rest is built.
+    """
+    Bill = apps.get_model("diagnosis", "Bill")
+    PatientReport = apps.get_model("diagnosis", "PatientReport")
+    reports = PatientReport.objects.filter(bill_id=OuterRef("pk"))
+
+    last_id = 0
+    while True:
+        batch = list(Bill.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1]
+        with transaction.atomic(using=schema_editor.connection.alias):
+            Bill.objects.filter(pk__in=batch).filter(Exists(reports)).update(has_report=True)
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ('diagnosis', '0020_bill_has_report'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_reported_bills, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.12 on 2026-10-19 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0021_fill_bill_has_report'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('has_report', False)), fields=['center_detail', '-date_of_bill', '-id'], name='bill_pending_report_idx'),
+        ),
+    ]
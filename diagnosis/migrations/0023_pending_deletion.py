@@ -0,0 +1,26 @@
+# Generated by Django 5.2.12 on 2026-10-19 14:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0022_bill_pending_report_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pending_deletions', to='diagnosis.diagnosiscategory')),
+                ('diagnosis_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pending_deletions', to='diagnosis.diagnosistype')),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(('diagnosis_type__isnull', True), ('category__isnull', True), _connector='XOR'), name='pending_deletion_one_target')],
+            },
+        ),
+    ]
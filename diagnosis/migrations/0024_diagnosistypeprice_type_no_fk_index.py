@@ -0,0 +1,19 @@
+# Generated by Django 5.2.12 on 2026-10-19 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0023_pending_deletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='diagnosistypeprice',
+            name='diagnosis_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='diagnosis.diagnosistype'),
+        ),
+    ]
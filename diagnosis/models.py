@@ -1,5 +1,7 @@
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Q, Value
+from django.db.models.functions import Cast, Greatest, Round
 from django.forms import ValidationError
 from django.core.validators import RegexValidator
 # from django.utils.text import slugify
@@ -7,6 +9,7 @@ from datetime import timedelta
 import secrets
 import uuid
 from center_detail.models import CenterDetail
+from .bill_lines import net_incentives
 from authentication.models import StaffAccount
 from django.conf import settings
 import os
@@ -71,20 +74,34 @@ class DiagnosisCategory(models.Model):
         verbose_name_plural = "Diagnosis Categories"
         ordering = ['name']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored flag so save() can tell whether it changed.
+        instance._recorded_is_franchise_lab = instance.__dict__.get('is_franchise_lab')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save and copy a changed franchise lab flag onto the bill lines of the category."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            recorded = getattr(self, '_recorded_is_franchise_lab', None)
+            if recorded is not None and self.is_franchise_lab != recorded:
+                self.bill_lines.update(is_franchise_lab=self.is_franchise_lab)
+            self._recorded_is_franchise_lab = self.is_franchise_lab
+
     def delete(self, *args, **kwargs):
         """
-        Custom delete to ensure each diagnosis type's delete method is called
-        (which implements smart cascade logic for bills)
+        Smart cascade delete for every diagnosis type in this category:
+        bills made up only of this category's types are deleted, other bills
+        just lose those lines (via CASCADE on BillDiagnosisType). The bills
+        go in batches that commit on their own, the category last, in a
+        short transaction that also takes the bills added meanwhile.
         """
-        # Get all diagnosis types in this category
-        diagnosis_types = list(self.diagnosis_types.all())
-
-        # Delete each one individually to trigger their custom delete logic
-        for dt in diagnosis_types:
-            dt.delete()
-
-        # Now delete the category itself
-        super().delete(*args, **kwargs)
+        delete_bills_only_containing(self.diagnosis_types.values('id'))
+        with transaction.atomic():
+            delete_bills_only_containing(self.diagnosis_types.values('id'))
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -107,6 +124,16 @@ class Doctor(models.Model):
     franchise_lab_percentage = models.IntegerField(null=True, blank=True, default=0)
     others_percentage = models.IntegerField(null=True, blank=True, default=0)
 
+    class Meta:
+        constraints = [
+            # Doctors without a phone number (NULL) never collide. Bulk imports
+            # upsert on this pair.
+            models.UniqueConstraint(
+                fields=['center_detail', 'phone_number'],
+                name='unique_doctor_phone_per_center',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} {self.address} {self.phone_number}"
 
@@ -142,28 +169,224 @@ class DiagnosisType(models.Model):
     category = models.ForeignKey(DiagnosisCategory, on_delete=models.CASCADE, related_name='diagnosis_types')
     price = models.IntegerField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored price and category so save() can tell whether they changed.
+        instance._recorded_price = instance.__dict__.get('price')
+        instance._recorded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Save and, when the price is new or changed, record it in the price
+        history. A new category is copied onto the bill lines of this type;
+        their incentive stays what the bill was charged with.
+        """
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if 'price' in self.__dict__ and self.price != getattr(self, '_recorded_price', None):
+                DiagnosisTypePrice.objects.create(
+                    diagnosis_type=self, price=self.price, effective_from=timezone.now()
+                )
+                self._recorded_price = self.price
+            recorded_category_id = getattr(self, '_recorded_category_id', None)
+            if recorded_category_id is not None and self.category_id != recorded_category_id:
+                self.bill_references.update(
+                    category_id=self.category_id, is_franchise_lab=self.category.is_franchise_lab
+                )
+            self._recorded_category_id = self.category_id
+
     def delete(self, *args, **kwargs):
         """
         Smart cascade delete:
         - Delete bills that ONLY have this diagnosis type
         - Keep bills that have other diagnosis types (just remove this type)
+        The bills go in batches that commit on their own, the type last, in a
+        short transaction that also takes the bills added meanwhile.
         """
-        # Find all bills that reference this diagnosis type
-        bill_diagnosis_types = self.bill_references.all()
+        delete_bills_only_containing([self.pk])
+        with transaction.atomic():
+            delete_bills_only_containing([self.pk])
+            # CASCADE handles the remaining BillDiagnosisType entries
+            return super().delete(*args, **kwargs)
 
-        # For each bill, check if it only has this diagnosis type
-        for bdt in bill_diagnosis_types:
-            bill = bdt.bill
-            # Count how many diagnosis types this bill has
-            diagnosis_count = bill.bill_diagnosis_types.count()
 
-            if diagnosis_count == 1:
-                # This is the only diagnosis type, delete the entire bill
-                bill.delete()
-            # If diagnosis_count > 1, the CASCADE will just remove the BillDiagnosisType entry
+# ========================
+# DIAGNOSIS TYPE PRICE HISTORY
+# ========================
 
-        # Now delete the diagnosis type itself (CASCADE will handle remaining BillDiagnosisType entries)
-        super().delete(*args, **kwargs)
+class DiagnosisTypePrice(models.Model):
+    """
+    Effective-dated price history of a diagnosis type. The row with the latest
+    `effective_from` not after a date is the price in force on that date.
+    """
+    diagnosis_type = models.ForeignKey(
+        DiagnosisType,
+        on_delete=models.CASCADE,
+        related_name='price_history',
+        db_index=False,  # covered by diag_price_type_from_idx
+    )
+    price = models.IntegerField()
+    effective_from = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-effective_from']
+        indexes = [
+            models.Index(fields=['diagnosis_type', 'effective_from'], name='diag_price_type_from_idx'),
+        ]
+        verbose_name = "Diagnosis Type Price"
+        verbose_name_plural = "Diagnosis Type Prices"
+
+    def __str__(self):
+        return f"{self.diagnosis_type.name} - {self.price} from {self.effective_from:%Y-%m-%d}"
+
+    @classmethod
+    def prices_in_force(cls, diagnosis_type_ids, on_date):
+        """
+        Map each diagnosis type id to its price in force on `on_date`, in one
+        index-backed query. Types without history on that date are left out.
+        """
+        return dict(
+            cls.objects.filter(diagnosis_type_id__in=diagnosis_type_ids, effective_from__lte=on_date)
+            .order_by('diagnosis_type_id', '-effective_from')
+            .distinct('diagnosis_type_id')
+            .values_list('diagnosis_type_id', 'price')
+        )
+
+
+PRICE_REVISION_PERCENTAGE = 'percentage'
+PRICE_REVISION_ABSOLUTE = 'absolute'
+PRICE_REVISION_MODES = [
+    (PRICE_REVISION_PERCENTAGE, 'Percentage'),
+    (PRICE_REVISION_ABSOLUTE, 'Absolute'),
+]
+
+
+def revise_prices(center, mode, value, category=None):
+    """
+    Change the price of every diagnosis type of `center` (optionally only
+    those in `category`) by `value` percent or by `value` in absolute terms,
+    with one UPDATE. Prices are rounded to whole units and never drop below
+    zero. The new prices are recorded in the price history, effective now.
+    Returns the number of diagnosis types revised.
+    """
+    diagnosis_types = DiagnosisType.objects.filter(center_detail=center)
+    if category is not None:
+        diagnosis_types = diagnosis_types.filter(category=category)
+
+    if mode == PRICE_REVISION_PERCENTAGE:
+        factor = ExpressionWrapper(
+            F('price') * Value((100 + value) / 100),
+            output_field=DecimalField(max_digits=14, decimal_places=4),
+        )
+        new_price = Cast(Round(factor), output_field=IntegerField())
+    else:
+        new_price = F('price') + Value(int(value))
+
+    effective_from = timezone.now()
+    with transaction.atomic():
+        revised = diagnosis_types.update(price=Greatest(new_price, Value(0)))
+        DiagnosisTypePrice.objects.bulk_create(
+            DiagnosisTypePrice(diagnosis_type_id=dt_id, price=price, effective_from=effective_from)
+            for dt_id, price in diagnosis_types.values_list('id', 'price')
+        )
+    return revised
+
+
+def bills_only_containing(diagnosis_type_ids):
+    """
+    Ids of bills whose every line is one of `diagnosis_type_ids` (a list or
+    an `id` values queryset), found with a single grouped query over the
+    lines of the bills that reference those types.
+    """
+    touched_bills = BillDiagnosisType.objects.filter(
+        diagnosis_type_id__in=diagnosis_type_ids
+    ).values('bill_id')
+    return (
+        BillDiagnosisType.objects.filter(bill_id__in=touched_bills)
+        .values('bill_id')
+        .annotate(
+            line_count=Count('id'),
+            matched_count=Count('id', filter=Q(diagnosis_type_id__in=diagnosis_type_ids)),
+        )
+        .filter(line_count=F('matched_count'))
+        .values_list('bill_id', flat=True)
+    )
+
+
+def delete_bills_only_containing(diagnosis_type_ids, batch_size=None):
+    """
+    Bulk-delete the bills returned by `bills_only_containing` in batches,
+    one transaction each unless called inside one, and remove their report
+    files once the deletion commits. Returns the number of bills deleted.
+    """
+    from .reference_data import invalidate_bills
+
+    batch_size = batch_size or getattr(settings, 'SMART_DELETE_BATCH_SIZE', 1000)
+    bill_ids = list(bills_only_containing(diagnosis_type_ids))
+
+    for start in range(0, len(bill_ids), batch_size):
+        batch = bill_ids[start:start + batch_size]
+        with transaction.atomic():
+            # Queryset deletes skip PatientReport.delete(), so collect the
+            # report files first and remove them after commit.
+            report_files = list(
+                PatientReport.objects.filter(bill_id__in=batch)
+                .exclude(report_file='')
+                .values_list('report_file', flat=True)
+            )
+            center_ids = set(Bill.objects.filter(pk__in=batch).values_list('center_detail_id', flat=True))
+            PendingReportCount.forget(center_ids)
+            Bill.objects.filter(pk__in=batch).delete()
+            for center_id in center_ids:
+                invalidate_bills(center_id)
+            transaction.on_commit(lambda files=report_files: remove_report_files(files))
+
+    return len(bill_ids)
+
+
+class PendingDeletion(models.Model):
+    """
+    A diagnosis type or category whose smart cascade delete runs in the
+    background. The record is written before the job starts and goes with
+    the type or category, so a job cut short, by a worker restart say, is
+    left on record for `resume_deletions` to finish.
+    """
+    diagnosis_type = models.ForeignKey(
+        DiagnosisType, on_delete=models.CASCADE, null=True, blank=True, related_name='pending_deletions'
+    )
+    category = models.ForeignKey(
+        DiagnosisCategory, on_delete=models.CASCADE, null=True, blank=True, related_name='pending_deletions'
+    )
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(diagnosis_type__isnull=True) ^ Q(category__isnull=True),
+                name='pending_deletion_one_target',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Deletion of {self.diagnosis_type or self.category}"
+
+    def run(self):
+        """Delete the type or category; this record goes with it."""
+        (self.diagnosis_type or self.category).delete()
+
+
+def remove_report_files(file_names):
+    """Best-effort removal of stored report files by name."""
+    storage = PatientReport._meta.get_field('report_file').storage
+    for name in file_names:
+        try:
+            path = storage.path(name)
+            if os.path.isfile(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"Failed to delete report file: {e}")
 
 
 class AuditLog(models.Model):
@@ -212,14 +435,193 @@ class FranchiseName(models.Model):
     def __str__(self):
         return f"{self.franchise_name}, {self.address}, {self.phone_number}"
 
+# Phone number carried by bills recorded before phone numbers were collected.
+PLACEHOLDER_PHONE_NUMBER = 9999999999
+
+# Lengths a patient phone number can have (see Bill.patient_phone_number).
+PATIENT_PHONE_LENGTHS = range(10, 16)
+
+
+# ========================
+# PATIENT
+# ========================
+
+class Patient(models.Model):
+    """
+    A patient of a center, identified by phone number. Keeps the name, age and
+    sex given on the patient's latest bill; every visit is a Bill linked
+    through `patient`.
+    """
+    center_detail = models.ForeignKey(CenterDetail, on_delete=models.CASCADE, related_name='patients')
+    phone_number = models.PositiveBigIntegerField()
+    name = models.CharField(max_length=60)
+    age = models.PositiveIntegerField(validators=[validate_age])
+    sex = models.CharField(choices=SEX_CHOICES, max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Also serves phone lookups and prefix searches within a center.
+            models.UniqueConstraint(
+                fields=['center_detail', 'phone_number'],
+                name='unique_patient_phone_per_center',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.phone_number})"
+
+    @staticmethod
+    def phone_prefix_filter(prefix):
+        """
+        Q matching phone numbers that start with the digits in `prefix`.
+
+        Numbers are stored as integers, so a prefix becomes one range per
+        possible number length, each of which is an index range scan.
+        """
+        value = int(prefix)
+        condition = Q()
+        for length in PATIENT_PHONE_LENGTHS:
+            if length < len(prefix):
+                continue
+            scale = 10 ** (length - len(prefix))
+            condition |= Q(phone_number__gte=value * scale, phone_number__lt=(value + 1) * scale)
+        return condition
+
+    @classmethod
+    def upsert_from_bills(cls, bills):
+        """
+        Create or refresh the patients of `bills` with one query and point each
+        bill's `patient` at its record. Later bills in the list win when they
+        share a phone number; bills carrying the placeholder number are left
+        unlinked.
+        """
+        latest = {}
+        for bill in bills:
+            if bill.patient_phone_number == PLACEHOLDER_PHONE_NUMBER:
+                bill.patient = None
+                continue
+            latest[(bill.center_detail_id, bill.patient_phone_number)] = bill
+
+        patients = {
+            key: cls(
+                center_detail_id=key[0],
+                phone_number=key[1],
+                name=bill.patient_name,
+                age=bill.patient_age,
+                sex=bill.patient_sex,
+            )
+            for key, bill in latest.items()
+        }
+        cls.objects.bulk_create(
+            list(patients.values()),
+            update_conflicts=True,
+            unique_fields=['center_detail', 'phone_number'],
+            update_fields=['name', 'age', 'sex', 'updated_at'],
+        )
+
+        for bill in bills:
+            key = (bill.center_detail_id, bill.patient_phone_number)
+            if key in patients:
+                bill.patient = patients[key]
+        return patients
+
+    @classmethod
+    def link_edited_bill(cls, bill):
+        """
+        Point an edited bill at the patient of its phone number. The patient's
+        details are only refreshed from the bill when it is their latest one
+        (or the patient is new), so editing an old bill leaves later visits be.
+        """
+        if bill.patient_phone_number == PLACEHOLDER_PHONE_NUMBER:
+            bill.patient = None
+            return
+        patient = cls.objects.filter(
+            center_detail_id=bill.center_detail_id, phone_number=bill.patient_phone_number
+        ).first()
+        later_bills = Bill.objects.filter(patient=patient).exclude(pk=bill.pk).filter(
+            Q(date_of_bill__gt=bill.date_of_bill) | Q(date_of_bill=bill.date_of_bill, pk__gt=bill.pk)
+        )
+        if patient is None or not later_bills.exists():
+            cls.upsert_from_bills([bill])
+        else:
+            bill.patient = patient
+
+
+class PendingReportCount(models.Model):
+    """
+    Bills of a center still waiting for a report. Bill and report writes keep
+    it up to date; bill deletes, and counts older than
+    PENDING_REPORT_COUNT_MAX_AGE seconds, are counted afresh over
+    bill_pending_report_idx, which also puts right deletes cascading from
+    elsewhere and writes racing a recount.
+    """
+    center_detail = models.OneToOneField(
+        CenterDetail, on_delete=models.CASCADE, primary_key=True, related_name='pending_report_count'
+    )
+    count = models.IntegerField(default=0)
+    counted_at = models.DateTimeField()
+
+    @classmethod
+    def current(cls, center_id):
+        now = timezone.now()
+        max_age = timedelta(seconds=settings.PENDING_REPORT_COUNT_MAX_AGE)
+        count = (
+            cls.objects.filter(center_detail_id=center_id, counted_at__gt=now - max_age)
+            .values_list('count', flat=True)
+            .first()
+        )
+        if count is None:
+            count = Bill.objects.filter(center_detail_id=center_id, has_report=False).count()
+            cls.objects.bulk_create(
+                [cls(center_detail_id=center_id, count=count, counted_at=now)],
+                update_conflicts=True,
+                unique_fields=['center_detail'],
+                update_fields=['count', 'counted_at'],
+            )
+        return count
+
+    @classmethod
+    def adjust(cls, center_id, delta):
+        cls.objects.filter(center_detail_id=center_id).update(count=F('count') + delta)
+
+    @classmethod
+    def forget(cls, center_ids):
+        """Have the counts of `center_ids` (a list or values queryset) counted afresh."""
+        cls.objects.filter(center_detail_id__in=center_ids).delete()
+
+
 class BillDiagnosisType(models.Model):
     """Junction model to link Bill with multiple DiagnosisTypes"""
-    bill = models.ForeignKey('Bill', on_delete=models.CASCADE, related_name='bill_diagnosis_types')
-    diagnosis_type = models.ForeignKey(DiagnosisType, on_delete=models.CASCADE, related_name='bill_references')
+    # Both FKs are covered by the composite indexes below.
+    bill = models.ForeignKey('Bill', on_delete=models.CASCADE, related_name='bill_diagnosis_types', db_index=False)
+    diagnosis_type = models.ForeignKey(
+        DiagnosisType, on_delete=models.CASCADE, related_name='bill_references', db_index=False
+    )
     price_at_time = models.IntegerField()  # Store price at time of bill creation
+    # Copied from the diagnosis type and its category, and kept in step with
+    # them, so stats group lines without joining either. Null until
+    # backfill_bill_lines has run on lines from before these fields.
+    category = models.ForeignKey(
+        DiagnosisCategory, on_delete=models.CASCADE, related_name='bill_lines', null=True, db_index=False
+    )
+    is_franchise_lab = models.BooleanField(default=False)
+    # The line's share of the bill's incentive, doctor discount included
+    # (see bill_lines.net_incentives): the lines of a bill add up to it.
+    incentive_amount = models.IntegerField(default=0)
+
+    DENORMALIZED_FIELDS = ['category', 'is_franchise_lab', 'incentive_amount']
 
     class Meta:
+        # The unique index leads with bill: lines of a bill and joins from bills.
         unique_together = ('bill', 'diagnosis_type')
+        indexes = [
+            # Bills that contain a diagnosis type (filters, cascade deletes).
+            models.Index(fields=['diagnosis_type', 'bill'], name='billline_type_bill_idx'),
+            # Lines of a category (stats by category).
+            models.Index(fields=['category', 'bill'], name='billline_category_bill_idx'),
+        ]
 
     def __str__(self):
         return f"{self.bill.bill_number} - {self.diagnosis_type.name}"
@@ -231,7 +633,7 @@ class Bill(models.Model):
     patient_age = models.PositiveIntegerField(validators=[validate_age])
     patient_sex = models.CharField(choices=SEX_CHOICES, max_length=10)
     patient_phone_number = models.PositiveBigIntegerField(
-        default=9999999999,  # Placeholder for old records
+        default=PLACEHOLDER_PHONE_NUMBER,  # Placeholder for old records
         validators=[
             RegexValidator(
                 regex=r'^\d{10,15}$',
@@ -239,6 +641,14 @@ class Bill(models.Model):
             )
         ]
     )
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='bills',
+        db_index=False,  # covered by bill_patient_date_idx
+    )
     diagnosis_types = models.ManyToManyField(DiagnosisType, through='BillDiagnosisType', related_name="bills")
     test_done_by = models.ForeignKey(StaffAccount, on_delete=models.CASCADE, related_name="test_done_by", null=True, blank=True)
     referred_by_doctor = models.ForeignKey(
@@ -261,7 +671,46 @@ class Bill(models.Model):
     disc_by_center = models.IntegerField(default=0)
     disc_by_doctor = models.IntegerField(default=0)
     incentive_amount = models.IntegerField(editable=False, default=0)
-    center_detail = models.ForeignKey(CenterDetail, on_delete=models.CASCADE, related_name="center_detail_bill")
+    # Whether a PatientReport exists for the bill; written only by the
+    # report's save() and delete() (see mark_reported).
+    has_report = models.BooleanField(default=False, editable=False)
+    center_detail = models.ForeignKey(
+        CenterDetail,
+        on_delete=models.CASCADE,
+        related_name="center_detail_bill",
+        db_index=False,  # every Bill index below leads with center_detail
+    )
+
+    # Relations whose existence is guaranteed by FK constraints (and, for the
+    # API, by the serializer's center-scoped lookups).
+    CLEAN_SKIPPED_FIELDS = ['center_detail', 'test_done_by', 'referred_by_doctor', 'franchise_name', 'patient']
+
+    class Meta:
+        indexes = [
+            # Bill lists (newest first, id as tie-breaker) and date-range
+            # filters and stats within a center (see date_ranges).
+            models.Index(fields=['center_detail', '-date_of_bill', '-id'], name='bill_center_recent_idx'),
+            models.Index(fields=['center_detail', 'date_of_test'], name='bill_center_test_date_idx'),
+            # Per-doctor stats and incentive reports.
+            models.Index(
+                fields=['center_detail', 'referred_by_doctor', 'date_of_bill'],
+                name='bill_center_doctor_date_idx',
+            ),
+            # Outstanding payments: a small slice of the table.
+            models.Index(
+                fields=['center_detail', '-date_of_bill', '-id'],
+                condition=Q(bill_status__in=['Unpaid', 'Partially Paid']),
+                name='bill_unpaid_recent_idx',
+            ),
+            # Visit history of a patient, newest first.
+            models.Index(fields=['patient', '-date_of_bill'], name='bill_patient_date_idx'),
+            # Reports still to upload: the pending-report queue and its count.
+            models.Index(
+                fields=['center_detail', '-date_of_bill', '-id'],
+                condition=Q(has_report=False),
+                name='bill_pending_report_idx',
+            ),
+        ]
 
     def clean(self):
         # Note: For many-to-many fields, we need to validate after the instance is saved
@@ -314,11 +763,39 @@ class Bill(models.Model):
             if self.incentive_amount is None:
                 self.incentive_amount = 0
 
-        # Run basic validations
-        self.full_clean()
+        # Run basic validations. Uniqueness (bill_number, message_link_token)
+        # and foreign keys are enforced by database constraints, so skip the
+        # extra SELECT probes full_clean() would otherwise issue for them.
+        self.full_clean(exclude=self.CLEAN_SKIPPED_FIELDS, validate_unique=False)
+
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Never write back a has_report read before a report came or went.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'has_report'
+            ]
 
         # Save the bill instance first
         super().save(*args, **kwargs)
+        if is_new and not self.has_report:
+            PendingReportCount.adjust(self.center_detail_id, 1)
+
+    def delete(self, *args, **kwargs):
+        PendingReportCount.forget([self.center_detail_id])
+        return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def mark_reported(bill_id, center_id):
+        """Take the bill off the pending-report queue, if it is on it."""
+        if Bill.objects.filter(pk=bill_id, has_report=False).update(has_report=True):
+            PendingReportCount.adjust(center_id, -1)
+
+    @staticmethod
+    def refresh_reported(bill_id, center_id):
+        """Put the bill back on the pending-report queue if it has no report left."""
+        reports = PatientReport.objects.filter(bill_id=OuterRef('pk'))
+        if Bill.objects.filter(pk=bill_id, has_report=True).exclude(Exists(reports)).update(has_report=False):
+            PendingReportCount.adjust(center_id, 1)
 
     def prepare_message_link(self):
         self.message_link_token = secrets.token_urlsafe(32)
@@ -333,36 +810,39 @@ class Bill(models.Model):
         expiry_hours = getattr(settings, 'REPORT_LINK_EXPIRY_HOURS', 6)
         return timezone.now() <= self.message_link_created_at + timedelta(hours=expiry_hours)
 
-    def calculate_totals_and_incentive(self):
+    def apply_totals_and_incentive(self, bill_diagnosis_types, category_percentages=None):
         """
-        Calculate total_amount and incentive_amount based on all diagnosis types.
-        This should be called after the m2m relationship is set up.
+        Compute total_amount and incentive_amount in memory from the given
+        BillDiagnosisType rows (saved or not) without writing the bill, and
+        set the rows' category, is_franchise_lab and incentive_amount.
+        `category_percentages` maps category id -> doctor percentage; when it is
+        omitted it is read from the doctor's (possibly prefetched) percentages.
         """
-        # Calculate total amount from all diagnosis types
-        bill_diagnosis_types = self.bill_diagnosis_types.all()
+        bill_diagnosis_types = list(bill_diagnosis_types)
 
-        if not bill_diagnosis_types.exists():
+        if not bill_diagnosis_types:
             self.total_amount = 0
             self.incentive_amount = 0
-            super(Bill, self).save(update_fields=['total_amount', 'incentive_amount'])
             return
 
         # Check if any diagnosis type is Franchise Lab
-        has_franchise_lab = any(
-            bdt.diagnosis_type.category.name.lower() == 'franchise lab'
-            for bdt in bill_diagnosis_types
-        )
-        has_non_franchise = any(
-            bdt.diagnosis_type.category.name.lower() != 'franchise lab'
-            for bdt in bill_diagnosis_types
-        )
+        def is_franchise_line(bdt):
+            category = bdt.diagnosis_type.category
+            return category.is_franchise_lab or category.name.lower() == 'franchise lab'
+
+        for bdt in bill_diagnosis_types:
+            bdt.category = bdt.diagnosis_type.category
+            bdt.is_franchise_lab = bdt.category.is_franchise_lab
+
+        has_franchise_lab = any(is_franchise_line(bdt) for bdt in bill_diagnosis_types)
+        has_non_franchise = any(not is_franchise_line(bdt) for bdt in bill_diagnosis_types)
 
         # Validate franchise name requirement
-        if has_franchise_lab and not self.franchise_name:
+        if has_franchise_lab and not self.franchise_name_id:
             raise ValidationError({
                 'franchise_name': "A franchise name is required when 'Franchise Lab' diagnosis type is selected."
             })
-        elif not has_franchise_lab and has_non_franchise and self.franchise_name:
+        elif not has_franchise_lab and has_non_franchise and self.franchise_name_id:
             # Clear franchise name if no franchise lab diagnosis types
             self.franchise_name = None
 
@@ -374,26 +854,21 @@ class Bill(models.Model):
         paid = int(self.paid_amount or 0)
         center_disc = int(self.disc_by_center or 0)
         doctor_disc = int(self.disc_by_doctor or 0)
-        total_incentive = 0
-
-        if self.referred_by_doctor:
-            doctor = self.referred_by_doctor
-
-            # Calculate incentive for each diagnosis type
-            for bdt in bill_diagnosis_types:
-                category = bdt.diagnosis_type.category
-                price = bdt.price_at_time
-
-                # Get doctor's percentage for this category dynamically
-                try:
-                    category_percentage = doctor.category_percentages.get(category=category)
-                    percent = category_percentage.percentage
-                except DoctorCategoryPercentage.DoesNotExist:
-                    # Default to 0 if no percentage is set for this category
-                    percent = 0
 
-                diagnosis_incentive = (price * percent) // 100
-                total_incentive += diagnosis_incentive
+        if self.referred_by_doctor_id:
+            if category_percentages is None:
+                category_percentages = {
+                    cp.category_id: cp.percentage
+                    for cp in self.referred_by_doctor.category_percentages.all()
+                }
+
+            # Calculate incentive for each diagnosis type; categories without
+            # a configured percentage default to 0
+            earned = [
+                (bdt.price_at_time * category_percentages.get(bdt.diagnosis_type.category_id, 0)) // 100
+                for bdt in bill_diagnosis_types
+            ]
+            total_incentive = sum(earned)
 
             # Apply discounts to the total incentive
             if total_amount == paid + center_disc or (doctor_disc == 0 and center_disc > 0):
@@ -403,10 +878,15 @@ class Bill(models.Model):
             else:
                 self.incentive_amount = total_incentive
         else:
+            earned = [0] * len(bill_diagnosis_types)
             self.incentive_amount = 0
 
+        # Split the bill's incentive, doctor discount included, over its lines.
+        prices = [bdt.price_at_time for bdt in bill_diagnosis_types]
+        for bdt, incentive in zip(bill_diagnosis_types, net_incentives(earned, prices, self.incentive_amount)):
+            bdt.incentive_amount = incentive
+
         # Validate bill status with updated total
-        paid = int(self.paid_amount or 0)
         bill_status = self.bill_status
 
         if bill_status == 'Fully Paid' and self.total_amount != paid + center_disc + doctor_disc:
@@ -418,8 +898,26 @@ class Bill(models.Model):
                 'paid_amount': f"For a partially paid bill, total amount ({self.total_amount}) must be greater than paid ({paid}) + discounts ({center_disc + doctor_disc})."
             })
 
+    def calculate_totals_and_incentive(self):
+        """
+        Calculate total_amount and incentive_amount based on all diagnosis types.
+        This should be called after the m2m relationship is set up.
+        """
+        bill_diagnosis_types = list(
+            self.bill_diagnosis_types.select_related('diagnosis_type__category')
+        )
+
+        if not bill_diagnosis_types:
+            self.apply_totals_and_incentive([])
+            super(Bill, self).save(update_fields=['total_amount', 'incentive_amount'])
+            return
+
+        self.apply_totals_and_incentive(bill_diagnosis_types)
+
         # Save with updated totals
-        super(Bill, self).save(update_fields=['total_amount', 'incentive_amount', 'franchise_name'])
+        with transaction.atomic():
+            super(Bill, self).save(update_fields=['total_amount', 'incentive_amount', 'franchise_name'])
+            BillDiagnosisType.objects.bulk_update(bill_diagnosis_types, BillDiagnosisType.DENORMALIZED_FIELDS)
 
     def __str__(self):
         doctor_name = "No Doctor"
@@ -436,7 +934,23 @@ class PatientReport(models.Model):
         doc_name = f"Dr. {ref_doc.first_name} {ref_doc.last_name}" if ref_doc else "No Doctor"
         return f"{self.bill.date_of_bill.strftime('%d-%m-%Y')} Report for {self.bill.patient_name} Ref by {doc_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored bill so save() can tell whether the report moved.
+        instance._recorded_bill_id = instance.__dict__.get('bill_id')
+        return instance
+
     def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self._save(*args, **kwargs)
+            Bill.mark_reported(self.bill_id, self.center_detail_id)
+            recorded_bill_id = getattr(self, '_recorded_bill_id', None)
+            if recorded_bill_id is not None and recorded_bill_id != self.bill_id:
+                Bill.refresh_reported(recorded_bill_id, self.center_detail_id)
+            self._recorded_bill_id = self.bill_id
+
+    def _save(self, *args, **kwargs):
         if self.report_file:
             bill_number = self.bill.bill_number
             extension = os.path.splitext(self.report_file.name)[1]
@@ -477,7 +991,10 @@ class PatientReport(models.Model):
             except Exception as e:
                 logger.error(f"Failed to delete report file: {e}")
 
-        super().delete(*args, **kwargs)
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Bill.refresh_reported(self.bill_id, self.center_detail_id)
+        return result
 
 class SampleTestReport(models.Model):
     category = models.CharField(
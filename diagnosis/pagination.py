@@ -1,4 +1,5 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 class StandardResultsSetPagination(PageNumberPagination):
     """
@@ -7,4 +8,28 @@ class StandardResultsSetPagination(PageNumberPagination):
     """
     page_size = 40
     page_size_query_param = 'page_size'
-    max_page_size = 10000000
\ No newline at end of file
+    max_page_size = 10000000
+
+
+class PendingReportPagination(CursorPagination):
+    """
+    The pending-report queue, newest bill first, one cursor page at a time:
+    each page is read from the queue's partial index however deep it is.
+    `count` is the view's pending_count() of the whole queue.
+    """
+    page_size = 40
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-date_of_bill', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = view.pending_count(queryset) if view is not None else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,210 @@
+"""
+Per-center reference data, cached in two tiers.
+
+A center's diagnosis types, doctors (with their category percentages) and
+franchises, and the diagnosis categories, change rarely but are read by
+every screen and every bill. They are loaded together into a snapshot
+stored under the center's current version: first in a per-process LRU of
+REFERENCE_DATA_LRU_SIZE snapshots, then in the shared 'reference_data'
+cache for REFERENCE_DATA_TIMEOUT seconds. Writes replace the version, once
+their transaction commits, so an outdated snapshot is never read again.
+Categories are global and have a version of their own, which is part of
+every center's snapshot key. Bills have a per-center version too, which
+no snapshot uses: with the others it makes the ETags of the lists and
+stats built from them (see data_version).
+
+New versions travel on the invalidation bus (LabLedger/invalidation.py):
+every process stores them in its 'reference_data' cache and evicts the
+snapshots they retire, so that cache may also be a per-process one.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.functions import Lower
+
+from LabLedger import invalidation
+
+from .models import DiagnosisCategory, DiagnosisType, Doctor, FranchiseName
+
+CATEGORIES = 'categories'
+BILLS = 'bills'
+TOPIC = 'reference_data'
+
+
+class ReferenceData:
+    """A snapshot of one center's reference data."""
+
+    def __init__(self, center_id):
+        from .serializers import DiagnosisTypeSerializer, DoctorSerializer, FranchiseNameSerializer
+
+        diagnosis_types = list(
+            DiagnosisType.objects.filter(center_detail_id=center_id).select_related('category').order_by('name')
+        )
+        doctors = list(
+            Doctor.objects.filter(center_detail_id=center_id)
+            .prefetch_related('category_percentages__category')
+            .order_by(Lower('first_name'))
+        )
+        franchises = list(FranchiseName.objects.filter(center_detail_id=center_id).order_by('franchise_name'))
+
+        self.diagnosis_types = {diagnosis_type.pk: diagnosis_type for diagnosis_type in diagnosis_types}
+        self.doctors = {doctor.pk: doctor for doctor in doctors}
+        self.franchises = {franchise.pk: franchise for franchise in franchises}
+        # The unfiltered list responses, ready to be returned as they are.
+        self.diagnosis_type_list = DiagnosisTypeSerializer(diagnosis_types, many=True).data
+        self.doctor_list = DoctorSerializer(doctors, many=True).data
+        self.franchise_list = FranchiseNameSerializer(franchises, many=True).data
+
+
+def _category_list():
+    from .serializers import DiagnosisCategorySerializer
+
+    return DiagnosisCategorySerializer(
+        DiagnosisCategory.objects.filter(is_active=True).order_by('name'), many=True,
+    ).data
+
+
+class LRUCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.REFERENCE_DATA_LRU_SIZE:
+                self.entries.popitem(last=False)
+
+    def evict(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LRUCache()
+# Scopes whose version this process has read.
+_seen_scopes = set()
+
+
+def _shared_cache():
+    return caches['reference_data']
+
+
+def _version_key(scope):
+    return f'reference_data:version:{scope}'
+
+
+def _versions(*scopes):
+    """The current version of each scope, starting one for scopes without."""
+    cache = _shared_cache()
+    _seen_scopes.update(scopes)
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _cached(key, build):
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+    cache = _shared_cache()
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, settings.REFERENCE_DATA_TIMEOUT)
+    local_cache.set(key, value)
+    return value
+
+
+def get_reference_data(center_id):
+    """The center's current ReferenceData snapshot."""
+    invalidation.ensure_listener()
+    center_version, category_version = _versions(center_id, CATEGORIES)
+    if center_version is None or category_version is None:
+        # The shared cache keeps nothing (a dummy backend): no versions to trust.
+        return ReferenceData(center_id)
+    return _cached(
+        f'reference_data:{center_id}:{center_version}:{category_version}',
+        lambda: ReferenceData(center_id),
+    )
+
+
+def get_category_list():
+    """The serialized list of active diagnosis categories."""
+    invalidation.ensure_listener()
+    (category_version,) = _versions(CATEGORIES)
+    if category_version is None:
+        return _category_list()
+    return _cached(f'reference_data:{CATEGORIES}:{category_version}', _category_list)
+
+
+def data_version(center_id, parts):
+    """
+    A token that changes whenever any of the center's data in `parts` does:
+    'reference' (diagnosis types, doctors, franchises), 'categories' or
+    'bills'. None when the shared cache keeps nothing to compare against.
+    """
+    invalidation.ensure_listener()
+    scopes = {'reference': center_id, 'categories': CATEGORIES, 'bills': f'{BILLS}:{center_id}'}
+    versions = _versions(*[scopes[part] for part in parts])
+    if None in versions:
+        return None
+    return '-'.join(versions)
+
+
+def _bump(scope):
+    invalidation.publish(TOPIC, f'{scope}={uuid.uuid4().hex}')
+
+
+def _apply_version(argument):
+    if argument is None:
+        # Versions may have changed unseen: start new ones.
+        _shared_cache().delete_many([_version_key(scope) for scope in list(_seen_scopes)])
+        local_cache.clear()
+        return
+    scope, version = argument.split('=')
+    _shared_cache().set(_version_key(scope), version, None)
+    if scope == CATEGORIES:
+        # Every snapshot key has the category version.
+        local_cache.clear()
+    else:
+        local_cache.evict(f'reference_data:{scope}:')
+
+
+invalidation.subscribe(TOPIC, _apply_version)
+
+
+def invalidate_center(center_id):
+    """Retire the center's snapshot once the current transaction commits."""
+    if center_id is not None:
+        _bump(center_id)
+
+
+def invalidate_bills(center_id):
+    """Retire the center's bill version once the current transaction commits."""
+    if center_id is not None:
+        _bump(f'{BILLS}:{center_id}')
+
+
+def invalidate_categories():
+    """Retire every snapshot once the current transaction commits."""
+    _bump(CATEGORIES)
@@ -1,11 +1,15 @@
+import csv
+import io
 import os
 from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from authentication.serializers import MinimalStaffAccountSerializer
 from center_detail.serializers import MinimalCenterDetailSerializer
-from .models import Bill, DiagnosisType, Doctor, FranchiseName, PatientReport, SampleTestReport, BillDiagnosisType, DiagnosisCategory, DoctorCategoryPercentage, AuditLog
+from .reference_data import get_reference_data
+from .models import Bill, DiagnosisType, Doctor, FranchiseName, PatientReport, SampleTestReport, BillDiagnosisType, DiagnosisCategory, DoctorCategoryPercentage, AuditLog, DiagnosisTypePrice, Patient, PRICE_REVISION_ABSOLUTE, PRICE_REVISION_MODES, PRICE_REVISION_PERCENTAGE
 
 
 # ========================
@@ -114,6 +118,22 @@ class DiagnosisTypeSerializer(serializers.ModelSerializer):
             })
 
         return attrs
+class PriceRevisionSerializer(serializers.Serializer):
+    """Input for a catalog-wide price revision of the user's center."""
+    mode = serializers.ChoiceField(choices=PRICE_REVISION_MODES)
+    value = serializers.DecimalField(max_digits=9, decimal_places=2)
+    category = serializers.PrimaryKeyRelatedField(
+        queryset=DiagnosisCategory.objects.all(), required=False, allow_null=True
+    )
+
+    def validate(self, attrs):
+        if attrs['mode'] == PRICE_REVISION_PERCENTAGE and attrs['value'] <= -100:
+            raise serializers.ValidationError({'value': 'A percentage revision must be greater than -100.'})
+        if attrs['mode'] == PRICE_REVISION_ABSOLUTE and attrs['value'] != attrs['value'].to_integral_value():
+            raise serializers.ValidationError({'value': 'An absolute revision must be a whole amount.'})
+        return attrs
+
+
 class DoctorSerializer(serializers.ModelSerializer):
     category_percentages = DoctorCategoryPercentageSerializer(many=True, required=False)
 
@@ -159,8 +179,10 @@ class DoctorSerializer(serializers.ModelSerializer):
         doctor = Doctor.objects.create(**validated_data)
 
         # Create category percentages if provided
-        for cat_perc_data in category_percentages_data:
-            DoctorCategoryPercentage.objects.create(doctor=doctor, **cat_perc_data)
+        _upsert_category_percentages(
+            DoctorCategoryPercentage(doctor=doctor, **cat_perc_data)
+            for cat_perc_data in _unique_by_category(category_percentages_data)
+        )
 
         return doctor
 
@@ -174,14 +196,22 @@ class DoctorSerializer(serializers.ModelSerializer):
 
         # Update category percentages if provided
         if category_percentages_data is not None:
-            # Delete existing category percentages
-            instance.category_percentages.all().delete()
-            # Create new ones
-            for cat_perc_data in category_percentages_data:
-                DoctorCategoryPercentage.objects.create(doctor=instance, **cat_perc_data)
+            category_percentages_data = _unique_by_category(category_percentages_data)
+            # Drop percentages for categories no longer listed, upsert the rest
+            instance.category_percentages.exclude(
+                category__in=[data['category'] for data in category_percentages_data]
+            ).delete()
+            _upsert_category_percentages(
+                DoctorCategoryPercentage(doctor=instance, **cat_perc_data)
+                for cat_perc_data in category_percentages_data
+            )
 
         return instance
 
+    def validate_phone_number(self, value):
+        # Missing numbers are stored as NULL so they never clash.
+        return (value or '').strip() or None
+
     def validate(self, attrs):
         """
         Check for uniqueness of phone_number within the user's center.
@@ -202,13 +232,154 @@ class DoctorSerializer(serializers.ModelSerializer):
             queryset = queryset.exclude(pk=self.instance.pk)
 
         # If any other doctor with this phone number exists in the center, raise an error.
-        if queryset.exists():
+        if phone_number and queryset.exists():
             raise serializers.ValidationError({
                 'phone_number': 'A doctor with this phone number already exists in your center.'
             })
 
         return attrs
 
+
+def _unique_by_category(category_percentages_data):
+    """Keep the last percentage given for each category."""
+    return list({data['category']: data for data in category_percentages_data}.values())
+
+
+def _upsert_category_percentages(percentages):
+    """Insert or update doctor/category percentages in a single query."""
+    DoctorCategoryPercentage.objects.bulk_create(
+        list(percentages),
+        update_conflicts=True,
+        unique_fields=['doctor', 'category'],
+        update_fields=['percentage'],
+    )
+
+
+# ========================
+# DOCTOR BULK IMPORT
+# ========================
+
+DOCTOR_IMPORT_FIELDS = ['first_name', 'last_name', 'hospital_name', 'address', 'phone_number', 'email']
+
+
+class DoctorImportPercentageSerializer(serializers.Serializer):
+    """A category percentage in an import row; the category is an id or a name."""
+    category = serializers.CharField()
+    percentage = serializers.IntegerField(min_value=0, max_value=100)
+
+    def validate_category(self, value):
+        category_id = self.context['categories'].get(value.strip().lower())
+        if category_id is None:
+            raise serializers.ValidationError(f"Unknown diagnosis category '{value}'.")
+        return category_id
+
+
+class DoctorImportRowSerializer(serializers.ModelSerializer):
+    """
+    One row of a doctor roster import. Validation never touches the database;
+    `context['categories']` maps lower-cased category ids and names to ids.
+    The phone number is required, as it is what a re-import matches on.
+    """
+    phone_number = serializers.CharField(max_length=15)
+    category_percentages = DoctorImportPercentageSerializer(many=True, required=False)
+
+    class Meta:
+        model = Doctor
+        fields = DOCTOR_IMPORT_FIELDS + ['category_percentages']
+
+
+def doctor_rows_from_csv(uploaded_file):
+    """
+    Turn an uploaded roster CSV into import rows.
+
+    Columns named after doctor fields fill those fields; every other column
+    is read as a diagnosis category name holding that doctor's percentage.
+    Empty cells are left out.
+    """
+    try:
+        text = uploaded_file.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise DRFValidationError({'file': 'Upload a UTF-8 encoded CSV file.'})
+
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        row = {'category_percentages': []}
+        for column, cell in record.items():
+            if column is None or cell is None or not cell.strip():
+                continue
+            column = column.strip()
+            if column.lower() in DOCTOR_IMPORT_FIELDS:
+                row[column.lower()] = cell.strip()
+            else:
+                row['category_percentages'].append({'category': column, 'percentage': cell.strip()})
+        rows.append(row)
+    return rows
+
+
+def import_doctors(center, rows):
+    """
+    Validate a doctor roster and upsert it into `center`.
+
+    Rows are matched to existing doctors by phone number, so a row without
+    one is invalid; a matched doctor's details are replaced by the row, and
+    the listed category percentages are inserted or updated (unlisted ones are
+    kept). Valid rows are written with one upsert for doctors and one for
+    percentages, invalid rows are skipped and reported by their 1-based
+    position.
+    """
+    categories = {}
+    for category_id, name in DiagnosisCategory.objects.values_list('id', 'name'):
+        categories[str(category_id)] = category_id
+        categories[name.lower()] = category_id
+
+    errors = []
+    valid_rows = []
+    row_by_phone = {}
+    for row_number, row in enumerate(rows, start=1):
+        serializer = DoctorImportRowSerializer(data=row, context={'categories': categories})
+        if not serializer.is_valid():
+            errors.append({'row': row_number, 'errors': serializer.errors})
+            continue
+
+        phone_number = serializer.validated_data['phone_number']
+        if phone_number in row_by_phone:
+            errors.append({
+                'row': row_number,
+                'errors': {'phone_number': [f"Duplicates the phone number in row {row_by_phone[phone_number]}."]},
+            })
+            continue
+        row_by_phone[phone_number] = row_number
+        valid_rows.append(serializer.validated_data)
+
+    existing_phones = set(
+        Doctor.objects.filter(center_detail=center, phone_number__in=row_by_phone)
+        .values_list('phone_number', flat=True)
+    )
+    doctors = [
+        Doctor(center_detail=center, **{field: data.get(field) for field in DOCTOR_IMPORT_FIELDS})
+        for data in valid_rows
+    ]
+
+    with transaction.atomic():
+        Doctor.objects.bulk_create(
+            doctors,
+            update_conflicts=True,
+            unique_fields=['center_detail', 'phone_number'],
+            update_fields=[field for field in DOCTOR_IMPORT_FIELDS if field != 'phone_number'],
+        )
+        _upsert_category_percentages(
+            DoctorCategoryPercentage(doctor=doctor, category_id=item['category'], percentage=item['percentage'])
+            for doctor, data in zip(doctors, valid_rows)
+            for item in _unique_by_category(data.get('category_percentages', []))
+        )
+
+    return {
+        'created': len(doctors) - len(existing_phones),
+        'updated': len(existing_phones),
+        'errors': errors,
+    }
+
+
 class FranchiseNameSerializer(serializers.ModelSerializer):
     class Meta:
         model = FranchiseName
@@ -243,6 +414,26 @@ class FranchiseNameSerializer(serializers.ModelSerializer):
 
         return attrs
 
+# ========================
+# PATIENT SERIALIZERS
+# ========================
+
+class PatientSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Patient
+        fields = ['id', 'phone_number', 'name', 'age', 'sex', 'updated_at']
+
+
+class PatientVisitSerializer(serializers.ModelSerializer):
+    """A past bill of a patient, as listed in the visit history."""
+    class Meta:
+        model = Bill
+        fields = [
+            'id', 'bill_number', 'date_of_bill', 'patient_name', 'patient_age',
+            'bill_status', 'total_amount', 'paid_amount', 'referred_by_doctor',
+        ]
+
+
 class BillDiagnosisTypeSerializer(serializers.ModelSerializer):
     """Serializer for the junction model"""
     diagnosis_type_detail = MinimalDiagnosisTypeSerializer(source='diagnosis_type', read_only=True)
@@ -251,6 +442,47 @@ class BillDiagnosisTypeSerializer(serializers.ModelSerializer):
         model = BillDiagnosisType
         fields = ['diagnosis_type', 'diagnosis_type_detail', 'price_at_time']
 
+def _bill_lines(bill):
+    """Bill lines with diagnosis type and category, using the prefetch cache when present."""
+    if 'bill_diagnosis_types' in getattr(bill, '_prefetched_objects_cache', {}):
+        return bill.bill_diagnosis_types.all()
+    # DRF drops the prefetch cache after an update; load the lines in one query.
+    return bill.bill_diagnosis_types.select_related('diagnosis_type__category')
+
+def _reference_data(context, center_id):
+    # One snapshot per serializer, shared by its fields and validators.
+    if 'reference_data' not in context:
+        context['reference_data'] = get_reference_data(center_id)
+    return context['reference_data']
+
+
+class ReferencePrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves the primary key from the user's center reference data (doctors,
+    franchises, ...) instead of querying for it.
+    """
+
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        request = self.context.get('request')
+        center_id = getattr(request.user, 'center_detail_id', None) if request else None
+        if center_id is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = getattr(_reference_data(self.context, center_id), self.reference).get(pk)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
+
+
 class BillSerializer(serializers.ModelSerializer):
     # --- Write-Only Fields (for input) ---
     diagnosis_types = serializers.ListField(
@@ -259,11 +491,13 @@ class BillSerializer(serializers.ModelSerializer):
         required=True,
         allow_empty=False
     )
-    referred_by_doctor = serializers.PrimaryKeyRelatedField(
+    referred_by_doctor = ReferencePrimaryKeyRelatedField(
+        'doctors',
         queryset=Doctor.objects.all(),
         write_only=True
     )
-    franchise_name = serializers.PrimaryKeyRelatedField(
+    franchise_name = ReferencePrimaryKeyRelatedField(
+        'franchises',
         queryset=FranchiseName.objects.all(),
         write_only=True,
         required=False,
@@ -278,6 +512,9 @@ class BillSerializer(serializers.ModelSerializer):
     center_detail = MinimalCenterDetailSerializer(read_only=True)
     match_reason = serializers.SerializerMethodField(read_only=True)
 
+    # Bill fields an edit has to change for the patient to be looked at again.
+    PATIENT_FIELDS = ('patient_name', 'patient_age', 'patient_sex', 'patient_phone_number')
+
     class Meta:
         model = Bill
         fields = [
@@ -287,24 +524,31 @@ class BillSerializer(serializers.ModelSerializer):
             'is_message_sent',
             'diagnosis_types', 'referred_by_doctor', 'franchise_name',
             'diagnosis_types_output', 'referred_by_doctor_output', 'franchise_name_output',
-            'test_done_by', 'center_detail', 'match_reason', 'patient_phone_number'
+            'test_done_by', 'center_detail', 'match_reason', 'patient_phone_number',
+            'patient',
         ]
         read_only_fields = (
             "bill_number", "test_done_by", "center_detail",
-            "incentive_amount", "total_amount",
+            "incentive_amount", "total_amount", "patient",
         )
 
     def get_diagnosis_types_output(self, bill):
         """Get all diagnosis types for this bill with their details"""
-        bill_diagnosis_types = bill.bill_diagnosis_types.all()
-        return BillDiagnosisTypeSerializer(bill_diagnosis_types, many=True).data
+        lines = self.context.get('saved_lines', {}).get(bill.pk)
+        if lines is None:
+            lines = _bill_lines(bill)
+        return BillDiagnosisTypeSerializer(lines, many=True).data
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         request = self.context.get('request')
         if request and hasattr(request.user, 'center_detail'):
             user_center = request.user.center_detail
-            self.fields['referred_by_doctor'].queryset = Doctor.objects.filter(center_detail=user_center)
+            # Prefetch percentages with the doctor lookup so the incentive
+            # calculation does not have to query them again.
+            self.fields['referred_by_doctor'].queryset = Doctor.objects.filter(
+                center_detail=user_center
+            ).prefetch_related('category_percentages')
             self.fields['franchise_name'].queryset = FranchiseName.objects.filter(center_detail=user_center)
 
     def get_match_reason(self, obj):
@@ -315,81 +559,102 @@ class BillSerializer(serializers.ModelSerializer):
         if not value:
             raise serializers.ValidationError("At least one diagnosis type must be selected.")
 
-        user_center = self.context['request'].user.center_detail
-        diagnosis_types = DiagnosisType.objects.filter(
-            id__in=value,
-            center_detail=user_center
-        )
+        # Resolved once here, from the center's reference data, and reused by
+        # validate(), create() and update().
+        center_id = self.context['request'].user.center_detail_id
+        center_types = _reference_data(self.context, center_id).diagnosis_types
+        self._resolved_diagnosis_types = {dt_id: center_types[dt_id] for dt_id in value if dt_id in center_types}
 
-        if diagnosis_types.count() != len(value):
+        if len(self._resolved_diagnosis_types) != len(value):
             raise serializers.ValidationError("One or more diagnosis types are invalid or don't belong to your center.")
 
         return value
 
-    def validate(self, attrs):
-        user = self.context['request'].user
-        attrs['center_detail'] = user.center_detail
-        attrs['test_done_by'] = user
+    def _diagnosis_types_for(self, diagnosis_type_ids):
+        resolved = self._resolved_diagnosis_types
+        return [resolved[dt_id] for dt_id in diagnosis_type_ids]
 
+    def validate(self, attrs):
         # Check if any diagnosis type is Franchise Lab
         diagnosis_type_ids = attrs.get('diagnosis_types', [])
         if diagnosis_type_ids:
-            user_center = user.center_detail
-            diagnosis_types = DiagnosisType.objects.filter(
-                id__in=diagnosis_type_ids,
-                center_detail=user_center
+            has_franchise_lab = any(
+                dt.category.is_franchise_lab
+                for dt in self._diagnosis_types_for(diagnosis_type_ids)
             )
-            # Check if franchise_name is required (any diagnosis type has franchise lab category)
-            has_franchise_lab = diagnosis_types.filter(category__is_franchise_lab=True).exists()
 
             if has_franchise_lab and not attrs.get('franchise_name'):
                 raise serializers.ValidationError({
                     'franchise_name': "A franchise name is required when 'Franchise Lab' diagnosis type is selected."
                 })
 
-        # Remove temporary keys before the serializer saves the data
-        attrs.pop('center_detail')
-        attrs.pop('test_done_by')
+        # Lines of a dated (possibly backdated) bill are priced at the
+        # prices in force on the bill date rather than today's prices.
+        bill_date = attrs.get('date_of_bill')
+        if bill_date is None and self.instance is not None:
+            bill_date = self.instance.date_of_bill
+        self._prices_in_force = {}
+        if diagnosis_type_ids and bill_date is not None:
+            self._prices_in_force = DiagnosisTypePrice.prices_in_force(diagnosis_type_ids, bill_date)
 
         return attrs
 
-    def create(self, validated_data):
-        diagnosis_type_ids = validated_data.pop('diagnosis_types')
-        user = self.context['request'].user
+    def _build_lines(self, bill, diagnosis_type_ids):
+        return [
+            BillDiagnosisType(
+                bill=bill,
+                diagnosis_type=diagnosis_type,
+                price_at_time=self._prices_in_force.get(diagnosis_type.id, diagnosis_type.price)
+            )
+            for diagnosis_type in self._diagnosis_types_for(diagnosis_type_ids)
+        ]
+
+    @staticmethod
+    def _line_values(line):
+        return line.category_id, line.is_franchise_lab, line.incentive_amount
 
-        # Create the bill instance
+    @staticmethod
+    def _apply_totals(bill, lines):
         try:
-            bill = Bill.objects.create(
-                center_detail=user.center_detail,
-                test_done_by=user,
-                **validated_data
-            )
+            bill.apply_totals_and_incentive(lines)
+        except DjangoValidationError as e:
+            # Convert Django ValidationError to DRF ValidationError for proper API response
+            raise DRFValidationError(e.message_dict if hasattr(e, 'message_dict') else {'error': str(e)})
+
+    @staticmethod
+    def _save_bill(bill):
+        try:
+            bill.save()
         except DjangoValidationError as e:
             raise DRFValidationError(
                 e.message_dict if hasattr(e, 'message_dict') else {'error': str(e)}
             )
 
-        # Create BillDiagnosisType entries for each diagnosis type
-        user_center = user.center_detail
-        diagnosis_types = DiagnosisType.objects.filter(
-            id__in=diagnosis_type_ids,
-            center_detail=user_center
+    def _keep_lines(self, bill, lines):
+        # The lines already carry their diagnosis type and category, so hand
+        # them to the response through the context instead of loading them.
+        self.context.setdefault('saved_lines', {})[bill.pk] = lines
+
+    def create(self, validated_data):
+        diagnosis_type_ids = validated_data.pop('diagnosis_types')
+        user = self.context['request'].user
+
+        bill = Bill(
+            center_detail=user.center_detail,
+            test_done_by=user,
+            **validated_data
         )
+        lines = self._build_lines(bill, diagnosis_type_ids)
 
-        for diagnosis_type in diagnosis_types:
-            BillDiagnosisType.objects.create(
-                bill=bill,
-                diagnosis_type=diagnosis_type,
-                price_at_time=diagnosis_type.price
-            )
+        # Totals are computed before the insert so the bill is written once.
+        self._apply_totals(bill, lines)
 
-        # Calculate totals and incentive
-        try:
-            bill.calculate_totals_and_incentive()
-        except DjangoValidationError as e:
-            # Convert Django ValidationError to DRF ValidationError for proper API response
-            raise DRFValidationError(e.message_dict if hasattr(e, 'message_dict') else {'error': str(e)})
+        with transaction.atomic():
+            Patient.upsert_from_bills([bill])
+            self._save_bill(bill)
+            BillDiagnosisType.objects.bulk_create(lines)
 
+        self._keep_lines(bill, lines)
         return bill
 
     def update(self, instance, validated_data):
@@ -397,26 +662,16 @@ class BillSerializer(serializers.ModelSerializer):
 
         user = self.context['request'].user
 
-        # Update diagnosis types FIRST (before save) so validation uses new totals
         if diagnosis_type_ids is not None:
-            # Clear existing diagnosis types
-            instance.bill_diagnosis_types.all().delete()
-
-            # Add new diagnosis types
-            user_center = user.center_detail
-            diagnosis_types = DiagnosisType.objects.filter(
-                id__in=diagnosis_type_ids,
-                center_detail=user_center
-            )
-
-            for diagnosis_type in diagnosis_types:
-                BillDiagnosisType.objects.create(
-                    bill=instance,
-                    diagnosis_type=diagnosis_type,
-                    price_at_time=diagnosis_type.price
-                )
-
-        # NOW update basic fields and save
+            lines = self._build_lines(instance, diagnosis_type_ids)
+        else:
+            lines = list(_bill_lines(instance))
+            stored = {line.pk: self._line_values(line) for line in lines}
+
+        patient_changed = instance.patient_id is None or any(
+            validated_data.get(field, getattr(instance, field)) != getattr(instance, field)
+            for field in self.PATIENT_FIELDS
+        )
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
@@ -424,19 +679,22 @@ class BillSerializer(serializers.ModelSerializer):
         instance.test_done_by = user
 
         # Calculate totals BEFORE save so validation has correct total
-        try:
-            instance.calculate_totals_and_incentive()
-        except DjangoValidationError as e:
-            # Convert Django ValidationError to DRF ValidationError for proper API response
-            raise DRFValidationError(e.message_dict if hasattr(e, 'message_dict') else {'error': str(e)})
-
-        # Now save with correct totals - validation will pass
-        try:
-            instance.save()
-        except DjangoValidationError as e:
-            # Convert Django ValidationError to DRF ValidationError for proper API response
-            raise DRFValidationError(e.message_dict if hasattr(e, 'message_dict') else {'error': str(e)})
-
+        self._apply_totals(instance, lines)
+
+        with transaction.atomic():
+            if patient_changed:
+                Patient.link_edited_bill(instance)
+            self._save_bill(instance)
+            if diagnosis_type_ids is not None:
+                instance.bill_diagnosis_types.all().delete()
+                BillDiagnosisType.objects.bulk_create(lines)
+            else:
+                # A new doctor or category changes the kept lines too.
+                changed = [line for line in lines if self._line_values(line) != stored[line.pk]]
+                if changed:
+                    BillDiagnosisType.objects.bulk_update(changed, BillDiagnosisType.DENORMALIZED_FIELDS)
+
+        self._keep_lines(instance, lines)
         return instance
 class IncentiveDiagnosisTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -481,8 +739,7 @@ class IncentiveBillSerializer(serializers.ModelSerializer):
 
     def get_diagnosis_types_output(self, obj):
         """Return list of diagnosis types with details for this bill"""
-        bill_diagnosis_types = obj.bill_diagnosis_types.select_related('diagnosis_type').all()
-        return BillDiagnosisTypeSerializer(bill_diagnosis_types, many=True).data
+        return BillDiagnosisTypeSerializer(_bill_lines(obj), many=True).data
 
 
 
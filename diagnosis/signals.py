@@ -0,0 +1,59 @@
+"""Signals for diagnosis app."""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Bill,
+    BillDiagnosisType,
+    DiagnosisCategory,
+    DiagnosisType,
+    Doctor,
+    DoctorCategoryPercentage,
+    FranchiseName,
+)
+from .reference_data import invalidate_bills, invalidate_categories, invalidate_center
+
+
+@receiver([post_save, post_delete], sender=DiagnosisType)
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=FranchiseName)
+def invalidate_center_reference_data(sender, instance, **kwargs):
+    """
+    Saving or deleting reference data anywhere (the admin included) retires
+    the center's cached snapshot. Bulk writes send no signals; the views
+    that make them invalidate explicitly.
+    """
+    invalidate_center(instance.center_detail_id)
+
+
+@receiver([post_save, post_delete], sender=DoctorCategoryPercentage)
+def invalidate_doctor_percentages(sender, instance, **kwargs):
+    """The snapshot's doctors carry their percentages, which price incentives."""
+    invalidate_center(instance.doctor.center_detail_id)
+
+
+@receiver([post_save, post_delete], sender=DiagnosisCategory)
+def invalidate_category_reference_data(sender, instance, **kwargs):
+    invalidate_categories()
+
+
+@receiver([post_save, post_delete], sender=Bill)
+@receiver(post_save, sender=BillDiagnosisType)
+def invalidate_center_bills(sender, instance, origin=None, **kwargs):
+    """
+    Saving or deleting a bill, or saving a bill line, anywhere (the admin
+    included) retires the center's bill version. Lines are deleted with or
+    through their bill, which is saved too; a delete receiver on them would
+    make Django load every line before deleting it. Queryset deletes are
+    counted once by the code that makes them, like the queryset updates and
+    bulk writes that send no signals.
+    """
+    if origin is not None and origin is not instance:
+        return
+    if sender is Bill:
+        invalidate_bills(instance.center_detail_id)
+    elif BillDiagnosisType.bill.field.is_cached(instance):
+        invalidate_bills(instance.bill.center_detail_id)
+    else:
+        invalidate_bills(Bill.objects.filter(pk=instance.bill_id).values_list('center_detail_id', flat=True).first())
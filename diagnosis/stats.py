@@ -0,0 +1,219 @@
+"""
+Home-screen statistics of one center, shared by the stats endpoints and the
+dashboard, which computes them together.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Trunc
+
+from .date_ranges import growth_periods, in_date_range
+from .models import Bill, BillDiagnosisType
+from .reference_data import get_category_list
+
+# Bills listed as waiting for a report.
+PENDING_REPORTS_LIMIT = 40
+
+CHART_GRANULARITIES = ("day", "week", "month")
+# Buckets a chart series may have.
+CHART_MAX_BUCKETS = 1000
+
+
+def _center_bills(center_id, doctor_id=None):
+    qs = Bill.objects.filter(center_detail_id=center_id)
+    if doctor_id:
+        qs = qs.filter(referred_by_doctor_id=doctor_id)
+    return qs
+
+
+# The category columns of the stats from before categories could be added,
+# still reported under their old keys.
+LEGACY_CATEGORY_KEYS = {"ultrasound": "Ultrasound", "ecg": "ECG", "xray": "X-Ray", "pathology": "Pathology"}
+
+
+class CategoryPivot:
+    """
+    Bills per group and category, each bill counted once per category
+    however many of its lines are in it. `lines` are the bill lines to
+    count, annotated with the `key` of their group; they are grouped once,
+    by key and category, whatever the number of categories.
+    """
+
+    def __init__(self, lines):
+        self.counts = defaultdict(dict)
+        self.categories = {}
+        rows = lines.values(
+            "key", "category_id", "category__name", "is_franchise_lab",
+        ).annotate(bills=Count("bill_id", distinct=True)).order_by()
+        for row in rows:
+            category_id = row["category_id"]
+            self.counts[row["key"]][category_id] = row["bills"]
+            self.categories[category_id] = (row["category__name"], row["is_franchise_lab"])
+
+        franchise_lab_ids = [category_id for category_id, (_, franchise_lab) in self.categories.items() if franchise_lab]
+        if len(franchise_lab_ids) > 1:
+            # A bill with tests of two franchise lab categories counts once.
+            self.franchise_lab = dict(
+                lines.filter(is_franchise_lab=True)
+                .values("key")
+                .annotate(bills=Count("bill_id", distinct=True))
+                .order_by()
+                .values_list("key", "bills")
+            )
+        else:
+            self.franchise_lab = {
+                key: sum(counts.get(category_id, 0) for category_id in franchise_lab_ids)
+                for key, counts in self.counts.items()
+            }
+
+    def columns(self, key, active_categories):
+        """The category columns of group `key`: the legacy ones and `categories`, by name."""
+        counts = self.counts.get(key, {})
+        by_name = {self.categories[category_id][0]: bills for category_id, bills in counts.items()}
+        columns = {column: by_name.get(name, 0) for column, name in LEGACY_CATEGORY_KEYS.items()}
+        columns["franchise_lab"] = self.franchise_lab.get(key, 0)
+        columns["categories"] = {category["name"]: counts.get(category["id"], 0) for category in active_categories}
+        return columns
+
+
+def _lines_of(bills, key):
+    return BillDiagnosisType.objects.filter(bill__in=bills.values("id")).annotate(key=key)
+
+
+def _referral_stats(bills, active_categories):
+    rows = (
+        bills.values("referred_by_doctor")
+        .annotate(
+            doctor_full_name=Concat("referred_by_doctor__first_name", Value(" "), "referred_by_doctor__last_name"),
+            total=Count("id"),
+            incentive_amount=Coalesce(Sum("incentive_amount"), 0),
+        )
+        .values("referred_by_doctor__id", "doctor_full_name", "total", "incentive_amount")
+        .order_by("-total")
+    )
+    pivot = CategoryPivot(_lines_of(bills, F("bill__referred_by_doctor_id")))
+    return [
+        {
+            "referred_by_doctor__id": row["referred_by_doctor__id"],
+            "doctor_full_name": row["doctor_full_name"],
+            "total": row["total"],
+            **pivot.columns(row["referred_by_doctor__id"], active_categories),
+            "incentive_amount": row["incentive_amount"],
+        }
+        for row in rows
+    ]
+
+
+def referral_stats(center_id, periods, tz, doctor_id=None):
+    """
+    Bills and incentive per referring doctor, in total and by category,
+    for each of `periods` and all time.
+    """
+    bills = _center_bills(center_id, doctor_id)
+    active_categories = get_category_list()
+    data = {
+        period: _referral_stats(bills.filter(in_date_range("date_of_bill", start_date, end_date, tz)), active_categories)
+        for period, (start_date, end_date) in periods.items()
+    }
+    data["all_time"] = _referral_stats(bills, active_categories)
+    return data
+
+
+def bucket_start(day, granularity):
+    """First day of the `granularity` bucket holding `day`; weeks start on Monday, as in date_trunc."""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def calendar_buckets(start_date, end_date, granularity):
+    """First day of every `granularity` bucket overlapping `start_date`..`end_date`."""
+    buckets = []
+    bucket = bucket_start(start_date, granularity)
+    while bucket <= end_date:
+        buckets.append(bucket)
+        if granularity == "month":
+            bucket = (bucket + timedelta(days=31)).replace(day=1)
+        else:
+            bucket += timedelta(days=7 if granularity == "week" else 1)
+    return buckets
+
+
+def _bill_chart_stats(bills, active_categories, buckets, granularity, tz):
+    def truncated(field):
+        return Trunc(field, granularity, output_field=DateField(), tzinfo=tz)
+
+    totals = dict(
+        bills.annotate(bucket=truncated("date_of_bill"))
+        .values("bucket")
+        .annotate(total=Count("id"))
+        .order_by()
+        .values_list("bucket", "total")
+    )
+    pivot = CategoryPivot(_lines_of(bills, truncated("bill__date_of_bill")))
+    return [
+        {granularity: bucket, "total": totals.get(bucket, 0), **pivot.columns(bucket, active_categories)}
+        for bucket in buckets
+    ]
+
+
+def bill_chart_stats(center_id, periods, tz, doctor_id=None, granularity="day"):
+    """
+    Bills per day, week or month, in total and by category, for each of
+    `periods`. Buckets are truncated in `tz` by the database, and every
+    bucket of a period is listed, those without bills with zeros.
+    """
+    bills = _center_bills(center_id, doctor_id)
+    active_categories = get_category_list()
+    return {
+        period: _bill_chart_stats(
+            bills.filter(in_date_range("date_of_bill", start_date, end_date, tz)),
+            active_categories,
+            calendar_buckets(start_date, end_date, granularity),
+            granularity,
+            tz,
+        )
+        for period, (start_date, end_date) in periods.items()
+    }
+
+
+def category_counts(bills):
+    """Bills of `bills` per category name."""
+    return dict(
+        BillDiagnosisType.objects.filter(bill__in=bills.values("id"), category__isnull=False)
+        .values("category__name")
+        .annotate(count=Count("bill_id", distinct=True))
+        .order_by()
+        .values_list("category__name", "count")
+    )
+
+
+def category_incentives(bills):
+    """Incentive of `bills` per category name: their lines' shares, doctor discounts included."""
+    return dict(
+        BillDiagnosisType.objects.filter(bill__in=bills.values("id"), category__isnull=False)
+        .values("category__name")
+        .annotate(incentive=Sum("incentive_amount"))
+        .order_by()
+        .values_list("category__name", "incentive")
+    )
+
+
+def bill_growth_stats(center_id, today):
+    """Bills, in total and by category, in the growth periods around `today`."""
+    data = {}
+    for period, (start_date, end_date) in growth_periods(today).items():
+        qs = _center_bills(center_id).filter(in_date_range('date_of_bill', start_date, end_date))
+        data[period] = {
+            "total_bills": qs.values('id').distinct().count(),
+            "diagnosis_counts": category_counts(qs),
+        }
+    return data
+
+
+def pending_report_bills(center_id):
+    """The latest bills still waiting for a report."""
+    return Bill.objects.filter(center_detail_id=center_id, has_report=False).order_by("-date_of_bill", "-id")
@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run `func` on a daemon thread once the current transaction commits.
+
+    The thread uses its own database connection, which is closed when the
+    job finishes. Failures are logged rather than raised, since there is no
+    request left to report them to.
+    """
+    def runner():
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background job %s failed", getattr(func, '__name__', func))
+        finally:
+            connections.close_all()
+
+    def start():
+        threading.Thread(target=runner, daemon=True).start()
+
+    transaction.on_commit(start)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(settings.DASHBOARD_WORKERS, thread_name_prefix='concurrent-job')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def _timed_on_pool(func):
+    # Pool threads keep their connection between jobs, as long as
+    # CONN_MAX_AGE allows and it still works.
+    close_old_connections()
+    try:
+        return _timed(func)
+    finally:
+        close_old_connections()
+
+
+def run_concurrently(jobs):
+    """
+    Run the read-only callables of `jobs`, a {name: callable} dict, on a
+    shared pool of DASHBOARD_WORKERS threads, each with its own database
+    connection. Returns {name: result} and {name: seconds taken}.
+
+    Inside a transaction the other connections can't see its writes, so
+    the jobs then run in turn on the current thread, as they do with fewer
+    than two workers. A failing job's exception is raised to the caller.
+    """
+    if settings.DASHBOARD_WORKERS < 2 or connection.in_atomic_block:
+        outcomes = {name: _timed(func) for name, func in jobs.items()}
+    else:
+        pool = _get_pool()
+        futures = {name: pool.submit(_timed_on_pool, func) for name, func in jobs.items()}
+        outcomes = {name: future.result() for name, future in futures.items()}
+    return (
+        {name: result for name, (result, _) in outcomes.items()},
+        {name: seconds for name, (_, seconds) in outcomes.items()},
+    )
@@ -1,3 +1,1345 @@
-from django.test import TestCase
+import calendar
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import StaffAccount
+from center_detail.models import CenterDetail
+from LabLedger import invalidation
+from .bill_lines import allocate, net_incentives
+from .filters import BillFilter
+from .models import (
+    Bill,
+    BillDiagnosisType,
+    DiagnosisCategory,
+    DiagnosisType,
+    DiagnosisTypePrice,
+    Doctor,
+    DoctorCategoryPercentage,
+    FranchiseName,
+    Patient,
+    PatientReport,
+    PendingDeletion,
+    PendingReportCount,
+)
+from .reference_data import get_reference_data, local_cache
+from .tasks import run_concurrently
+
+# The test runner's reference-data cache keeps nothing; tests of the cached
+# paths use this one instead.
+REFERENCE_DATA_CACHES = {
+    **settings.CACHES,
+    "reference_data": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "reference-data"},
+}
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DiagnosisAPITestCase(TestCase):
+    """One center with a doctor, a franchise, three scans and a franchise lab test."""
+
+    def setUp(self):
+        self.center = CenterDetail.objects.create(
+            center_name="Query Center",
+            address="1 Main Street",
+            owner_name="Owner",
+            owner_phone="9000000001",
+        )
+        self.user = StaffAccount.objects.create_user(
+            username="reception",
+            email="reception@example.com",
+            password="pass12345",
+            first_name="Front",
+            last_name="Desk",
+            address="Desk",
+            phone_number="9000000002",
+            center_detail=self.center,
+        )
+        self.ultrasound = DiagnosisCategory.objects.create(name="Ultrasound")
+        self.franchise_lab = DiagnosisCategory.objects.create(name="Franchise Lab", is_franchise_lab=True)
+        self.doctor = Doctor.objects.create(
+            center_detail=self.center, first_name="Asha", last_name="Rao", phone_number="9000000003",
+        )
+        DoctorCategoryPercentage.objects.create(doctor=self.doctor, category=self.ultrasound, percentage=40)
+        DoctorCategoryPercentage.objects.create(doctor=self.doctor, category=self.franchise_lab, percentage=10)
+        self.franchise = FranchiseName.objects.create(
+            franchise_name="City Lab", address="Road", phone_number="9000000004", center_detail=self.center,
+        )
+        self.types = [
+            DiagnosisType.objects.create(
+                center_detail=self.center, name=f"Scan {i}", category=self.ultrasound, price=500 + i * 100,
+            )
+            for i in range(3)
+        ]
+        self.lab_test = DiagnosisType.objects.create(
+            center_detail=self.center, name="CBC", category=self.franchise_lab, price=300,
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, types, **overrides):
+        total = sum(dt.price for dt in types)
+        payload = {
+            "patient_name": "Ravi",
+            "patient_age": 40,
+            "patient_sex": "Male",
+            "patient_phone_number": 9876543210,
+            "diagnosis_types": [dt.id for dt in types],
+            "referred_by_doctor": self.doctor.id,
+            "franchise_name": self.franchise.id,
+            "bill_status": "Fully Paid",
+            "paid_amount": total - 100,
+            "disc_by_center": 0,
+            "disc_by_doctor": 100,
+        }
+        payload.update(overrides)
+        return payload
+
+    def _create_bill(self, types, **overrides):
+        response = self.client.post("/diagnosis/bill/", self._payload(types, **overrides), format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        return Bill.objects.get(pk=response.data["id"])
+
+
+@override_settings(CACHES=REFERENCE_DATA_CACHES)
+class BillWritePathQueryTests(DiagnosisAPITestCase):
+    # Diagnosis types, doctor and franchise come from the cached reference
+    # data: savepoint pair + patient upsert + bill insert + pending-report
+    # count update + line bulk insert + audit log insert.
+    CREATE_QUERIES = 7
+    # bill + prices in force on the bill date + savepoint pair + bill update
+    # + line delete/insert + audit log insert. The patient is left alone
+    # while the patient fields stay the same.
+    UPDATE_QUERIES = 8
+
+    def setUp(self):
+        super().setUp()
+        caches["reference_data"].clear()
+        local_cache.clear()
+        get_reference_data(self.center.pk)
+
+    def test_create_bill_query_budget(self):
+        types = self.types + [self.lab_test]
+        with self.assertNumQueries(self.CREATE_QUERIES):
+            response = self.client.post("/diagnosis/bill/", self._payload(types), format="json")
+
+        self.assertEqual(response.status_code, 201, response.data)
+
+        bill = Bill.objects.get(pk=response.data["id"])
+        self.assertEqual(bill.total_amount, 500 + 600 + 700 + 300)
+        # 40% of the scans + 10% of the lab test, less the doctor's discount
+        self.assertEqual(bill.incentive_amount, (500 + 600 + 700) * 40 // 100 + 30 - 100)
+        self.assertEqual(bill.bill_diagnosis_types.count(), 4)
+        self.assertEqual(len(response.data["diagnosis_types_output"]), 4)
+
+    def test_create_bill_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as one_line:
+            self.client.post("/diagnosis/bill/", self._payload(self.types[:1]), format="json")
+        with CaptureQueriesContext(connection) as many_lines:
+            self.client.post("/diagnosis/bill/", self._payload(self.types + [self.lab_test]), format="json")
+
+        self.assertEqual(len(one_line.captured_queries), len(many_lines.captured_queries))
+
+    def test_update_bill_query_budget(self):
+        response = self.client.post("/diagnosis/bill/", self._payload(self.types), format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.user.is_admin = True
+        self.user.save()
+
+        payload = self._payload(self.types[:2], franchise_name=None)
+        with self.assertNumQueries(self.UPDATE_QUERIES):
+            response = self.client.put(f"/diagnosis/bill/{response.data['id']}/", payload, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        bill = Bill.objects.get(pk=response.data["id"])
+        self.assertEqual(bill.total_amount, 1100)
+        self.assertEqual(bill.bill_diagnosis_types.count(), 2)
+
+    def test_invalid_bill_is_not_written(self):
+        payload = self._payload(self.types, paid_amount=1)
+        response = self.client.post("/diagnosis/bill/", payload, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Bill.objects.exists())
+
+
+@override_settings(CACHES=REFERENCE_DATA_CACHES)
+class ReferenceDataCacheTests(DiagnosisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        caches["reference_data"].clear()
+        local_cache.clear()
+
+    def test_lists_are_served_from_the_cache(self):
+        for url in ("/diagnosis/doctor/", "/diagnosis/diagnosis-type/", "/diagnosis/franchise-name/",
+                    "/diagnosis/categories/"):
+            first = self.client.get(url)
+            # Only the request's own lookups (user, center, subscription) remain.
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url)
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual(second.data, first.data)
+            tables = " ".join(query["sql"] for query in queries.captured_queries)
+            self.assertNotIn("diagnosis_", tables, url)
+
+    def test_filtered_lists_still_query(self):
+        response = self.client.get("/diagnosis/doctor/", {"search": "Nobody"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+    def test_writes_replace_the_snapshot_on_commit(self):
+        self.assertEqual(len(self.client.get("/diagnosis/doctor/").data), 1)
+
+        payload = {"first_name": "Vikram", "last_name": "Shah", "phone_number": "9000000009",
+                   "category_percentages": [{"category": self.ultrasound.id, "percentage": 30}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/diagnosis/doctor/", payload, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+
+        doctors = self.client.get("/diagnosis/doctor/").data
+        self.assertEqual(sorted(doctor["first_name"] for doctor in doctors), ["Asha", "Vikram"])
+        vikram = next(doctor for doctor in doctors if doctor["first_name"] == "Vikram")
+        self.assertEqual(len(vikram["category_percentages"]), 1)
+
+    def test_percentage_edits_price_the_next_bill(self):
+        scan = self.types[2]
+        self.assertEqual(self._create_bill([scan], franchise_name=None).incentive_amount, 700 * 40 // 100 - 100)
+
+        percentage = DoctorCategoryPercentage.objects.get(doctor=self.doctor, category=self.ultrasound)
+        with self.captureOnCommitCallbacks(execute=True):
+            percentage.percentage = 20
+            percentage.save()
+
+        self.assertEqual(self._create_bill([scan], franchise_name=None).incentive_amount, 700 * 20 // 100 - 100)
+
+    def test_rolled_back_writes_keep_the_snapshot(self):
+        snapshot = get_reference_data(self.center.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.franchise.delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(callbacks, [])
+        self.assertIs(get_reference_data(self.center.pk), snapshot)
+
+    def test_versions_from_other_workers_retire_the_snapshot(self):
+        snapshot = get_reference_data(self.center.pk)
+
+        # As the invalidation listener hands over another worker's write.
+        invalidation.dispatch(f"reference_data:{self.center.pk}=from-another-worker")
+
+        prefix = f"reference_data:{self.center.pk}:"
+        self.assertEqual([key for key in local_cache.entries if key.startswith(prefix)], [])
+        self.assertIsNot(get_reference_data(self.center.pk), snapshot)
+
+    def test_category_changes_reach_every_center(self):
+        self.client.get("/diagnosis/categories/")
+        with self.captureOnCommitCallbacks(execute=True):
+            DiagnosisCategory.objects.create(name="X-Ray")
+
+        names = [category["name"] for category in self.client.get("/diagnosis/categories/").data]
+        self.assertIn("X-Ray", names)
+        self.assertIn(self.ultrasound.pk, {
+            dt.category_id for dt in get_reference_data(self.center.pk).diagnosis_types.values()
+        })
+
+    def test_bill_rejects_references_of_another_center(self):
+        other = CenterDetail.objects.create(
+            center_name="Other", address="2 Main Street", owner_name="Owner", owner_phone="9000000010",
+        )
+        doctor = Doctor.objects.create(
+            center_detail=other, first_name="Other", last_name="Doctor", phone_number="9000000011",
+        )
+        foreign_type = DiagnosisType.objects.create(
+            center_detail=other, name="Foreign", category=self.ultrasound, price=100,
+        )
+
+        response = self.client.post("/diagnosis/bill/", self._payload(self.types, referred_by_doctor=doctor.id),
+                                    format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("referred_by_doctor", response.data)
+
+        response = self.client.post("/diagnosis/bill/", self._payload([foreign_type]), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("diagnosis_types", response.data)
+
+
+@override_settings(CACHES=REFERENCE_DATA_CACHES)
+class ConditionalGetTests(DiagnosisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        caches["reference_data"].clear()
+        local_cache.clear()
+
+    def _revalidate(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, " ".join(query["sql"] for query in queries.captured_queries)
+
+    def test_unchanged_lists_are_not_modified(self):
+        for url in ("/diagnosis/doctor/", "/diagnosis/diagnosis-type/", "/diagnosis/franchise-name/",
+                    "/diagnosis/categories/", "/diagnosis/doctor/?search=Asha"):
+            etag = self.client.get(url)["ETag"]
+            self.assertTrue(etag.startswith('W/"'), url)
+
+            response, sql = self._revalidate(url, etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b"")
+            self.assertNotIn("diagnosis_", sql, url)
+
+    def test_stats_are_not_modified_until_a_bill_is_written(self):
+        url = "/diagnosis/referral-stat/"
+        etag = self.client.get(url)["ETag"]
+        response, sql = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn("diagnosis_bill", sql)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_bill(self.types[:1])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["all_time"][0]["total"], 1)
+
+    def test_bills_edited_outside_the_api_change_the_stats_etag(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bill = self._create_bill(self.types[:1])
+        url = "/diagnosis/referral-stat/"
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bill.bill_status = "Partially Paid"
+            bill.paid_amount -= 50
+            bill.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            line = bill.bill_diagnosis_types.get()
+            line.incentive_amount += 1
+            line.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get("/diagnosis/doctor/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.franchise.address = "New Road"
+            self.franchise.save()
+
+        response = self.client.get("/diagnosis/doctor/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CACHES=settings.CACHES)
+    def test_no_etag_without_a_shared_cache(self):
+        self.assertFalse(self.client.get("/diagnosis/doctor/").has_header("ETag"))
+
+
+class DashboardTests(DiagnosisAPITestCase):
+    def test_dashboard_matches_the_separate_endpoints(self):
+        self._create_bill(self.types[:2])
+        self._create_bill([self.types[0], self.lab_test])
+
+        response = self.client.get("/diagnosis/dashboard/")
+
+        self.assertEqual(response.status_code, 200)
+        expected = {
+            "referral_stats": "/diagnosis/referral-stat/",
+            "bill_chart_stats": "/diagnosis/bill-chart-stat/",
+            "bill_growth_stats": "/diagnosis/bills/growth-stats/",
+            "pending_reports": "/diagnosis/pending-reports/",
+        }
+        for widget, url in expected.items():
+            data = self.client.get(url).data
+            if widget == "pending_reports":
+                data = {"count": data["count"], "results": data["results"]}
+            self.assertEqual(
+                json.loads(json.dumps(response.data[widget], default=str)),
+                json.loads(json.dumps(data, default=str)),
+                widget,
+            )
+        self.assertEqual(response.data["auth"]["username"], "reception")
+        self.assertEqual(set(response.data["timings_ms"]), set(expected))
+
+    def test_doctor_filter_applies_to_the_referral_widgets(self):
+        self._create_bill(self.types[:1])
+
+        response = self.client.get("/diagnosis/dashboard/", {"referred_by_doctor": self.doctor.pk + 1})
+
+        self.assertEqual(response.data["referral_stats"]["all_time"], [])
+        self.assertEqual(response.data["pending_reports"]["count"], 1)
+
+
+class PendingReportQueueTests(DiagnosisAPITestCase):
+    URL = "/diagnosis/pending-reports/"
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.bills = [self._create_bill([dt]) for dt in self.types + [self.lab_test]]
+
+    def _upload(self, bill):
+        return PatientReport.objects.create(
+            bill=bill, center_detail=self.center, report_file=SimpleUploadedFile("scan.pdf", b"%PDF-1.4"),
+        )
+
+    def _ids(self, data):
+        return [row["id"] for row in data["results"]]
+
+    def test_reports_leave_and_rejoin_the_queue(self):
+        self.assertEqual(self.client.get(self.URL).data["count"], 4)
+
+        report = self._upload(self.bills[0])
+        self._upload(self.bills[0])
+        data = self.client.get(self.URL).data
+        self.assertEqual((data["count"], len(data["results"])), (3, 3))
+        self.assertEqual(Bill.objects.get(pk=self.bills[0].pk).has_report, True)
+
+        PatientReport.objects.get(bill=self.bills[0]).delete()
+        self.assertFalse(PatientReport.objects.filter(pk=report.pk).exists())
+        data = self.client.get(self.URL).data
+        self.assertEqual((data["count"], self._ids(data)[-1]), (4, self.bills[0].pk))
+
+    def test_cursor_pages_walk_the_whole_queue(self):
+        first = self.client.get(self.URL, {"page_size": 3}).data
+        second = self.client.get(first["next"]).data
+
+        self.assertEqual(self._ids(first) + self._ids(second), [bill.pk for bill in reversed(self.bills)])
+        self.assertIsNone(second["next"])
+        self.assertEqual(second["count"], 4)
+
+    def test_doctor_and_category_filters_are_counted(self):
+        other = Doctor.objects.create(center_detail=self.center, first_name="Vik", last_name="Das")
+        self._create_bill(self.types[:1], referred_by_doctor=other.pk)
+
+        by_doctor = self.client.get(self.URL, {"referred_by_doctor": other.pk}).data
+        by_category = self.client.get(self.URL, {"category": self.franchise_lab.pk}).data
+
+        self.assertEqual(by_doctor["count"], 1)
+        self.assertEqual((by_category["count"], self._ids(by_category)), (1, [self.bills[3].pk]))
+
+    def test_detail_of_an_older_pending_bill(self):
+        response = self.client.get(f"{self.URL}{self.bills[0].pk}/")
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_count_is_recounted_when_stale_or_forgotten(self):
+        self.client.get(self.URL)
+        Bill.objects.filter(pk=self.bills[0].pk).update(has_report=True)
+        self.assertEqual(PendingReportCount.current(self.center.pk), 4)
+
+        with override_settings(PENDING_REPORT_COUNT_MAX_AGE=0):
+            self.assertEqual(PendingReportCount.current(self.center.pk), 3)
+        self.bills[1].delete()
+        self.assertEqual(PendingReportCount.current(self.center.pk), 2)
+
+
+class CategoryPivotTests(DiagnosisAPITestCase):
+    def _add_category(self, name):
+        category = DiagnosisCategory.objects.create(name=name)
+        return DiagnosisType.objects.create(center_detail=self.center, name=f"{name} test", category=category, price=200)
+
+    def test_custom_categories_are_counted_once_per_bill(self):
+        ct_scan = self._add_category("CT Scan")
+        self._create_bill([ct_scan, self.types[0], self.types[1]])
+        self._create_bill([self.types[2], self.lab_test])
+
+        row = self.client.get("/diagnosis/referral-stat/").data["all_time"][0]
+
+        self.assertEqual(row["total"], 2)
+        self.assertEqual(row["ultrasound"], 2)
+        self.assertEqual(row["franchise_lab"], 1)
+        self.assertEqual(row["categories"], {"CT Scan": 1, "Franchise Lab": 1, "Ultrasound": 2})
+        day = self.client.get("/diagnosis/bill-chart-stat/").data["this_week"][0]
+        self.assertEqual((day["total"], day["categories"]["CT Scan"]), (2, 1))
+
+    def test_bills_in_two_franchise_lab_categories_count_once(self):
+        other_lab = DiagnosisCategory.objects.create(name="Partner Lab", is_franchise_lab=True)
+        partner_test = DiagnosisType.objects.create(
+            center_detail=self.center, name="Lipid", category=other_lab, price=400,
+        )
+        self._create_bill([self.lab_test, partner_test])
+
+        row = self.client.get("/diagnosis/referral-stat/").data["all_time"][0]
+
+        self.assertEqual(row["franchise_lab"], 1)
+        self.assertEqual(row["categories"]["Partner Lab"], 1)
+
+    def test_query_count_does_not_grow_with_categories(self):
+        self._create_bill(self.types[:1])
+        with CaptureQueriesContext(connection) as before:
+            self.client.get("/diagnosis/referral-stat/")
+        for name in ("CT Scan", "MRI", "Dental"):
+            self._create_bill([self._add_category(name)])
+        with CaptureQueriesContext(connection) as after:
+            self.client.get("/diagnosis/referral-stat/")
+
+        self.assertEqual(len(after.captured_queries), len(before.captured_queries))
+
+
+class BillLineFieldsTests(DiagnosisAPITestCase):
+    def _lines(self, bill):
+        return sorted(bill.bill_diagnosis_types.values_list(
+            "category__name", "is_franchise_lab", "incentive_amount",
+        ))
+
+    def test_lines_carry_category_franchise_flag_and_incentive(self):
+        bill = self._create_bill([self.types[0], self.lab_test])
+
+        # 200 + 30 earned, less the doctor discount of 100 shared 87/13.
+        self.assertEqual(self._lines(bill), [("Franchise Lab", True, 17), ("Ultrasound", False, 113)])
+        self.assertEqual(bill.incentive_amount, 130)
+
+    def test_new_doctor_recomputes_kept_lines(self):
+        bill = self._create_bill([self.types[0]])
+        other = Doctor.objects.create(center_detail=self.center, first_name="Vik", last_name="Das")
+        DoctorCategoryPercentage.objects.create(doctor=other, category=self.ultrasound, percentage=20)
+        self.user.is_admin = True
+        self.user.save()
+
+        response = self.client.patch(f"/diagnosis/bill/{bill.pk}/", {"referred_by_doctor": other.pk}, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self._lines(bill), [("Ultrasound", False, 0)])
+
+    def test_category_changes_reach_existing_lines(self):
+        bill = self._create_bill([self.types[0]])
+        other = DiagnosisCategory.objects.create(name="Radiology")
+
+        self.types[0].category = other
+        self.types[0].save()
+        self.assertEqual(self._lines(bill), [("Radiology", False, 100)])
+
+        other.is_franchise_lab = True
+        other.save()
+        self.assertEqual(self._lines(bill), [("Radiology", True, 100)])
+
+    def test_backfill_fills_lines_without_category(self):
+        bills = [self._create_bill([self.types[0], self.lab_test]), self._create_bill([self.types[1]])]
+        expected = [self._lines(bill) for bill in bills]
+        BillDiagnosisType.objects.update(category=None, is_franchise_lab=False, incentive_amount=0)
+
+        call_command("backfill_bill_lines", batch_size=2, stdout=StringIO())
+
+        self.assertEqual([self._lines(bill) for bill in bills], expected)
+
+    def test_incentive_breakdown_sums_lines_per_category(self):
+        self._create_bill([self.types[0], self.lab_test])
+        self._create_bill([self.types[1]])
+
+        response = self.client.get(f"/diagnosis/doctors/{self.doctor.pk}/incentives/")
+
+        self.assertEqual(response.data["current_month"]["diagnosis_counts"], {"Ultrasound": 253, "Franchise Lab": 17})
+
+
+class LineIncentiveAllocationTests(SimpleTestCase):
+    def test_shares_add_up_by_largest_remainder(self):
+        self.assertEqual(allocate(100, [200, 30]), [87, 13])
+        self.assertEqual(allocate(10, [1, 1, 1]), [4, 3, 3])
+        self.assertEqual(allocate(-7, [1, 1]), [-3, -4])
+        self.assertEqual(allocate(5, [0, 0]), [3, 2])
+
+    def test_line_incentives_add_up_to_the_bill(self):
+        for earned, prices, incentive in (
+            ([200, 30, 0], [500, 300, 100], 129),
+            ([0, 0], [500, 300], -80),
+            ([45, 45, 45], [100, 100, 100], 134),
+        ):
+            lines = net_incentives(earned, prices, incentive)
+            self.assertEqual(sum(lines), incentive)
+            self.assertTrue(all(line <= earned_line for line, earned_line in zip(lines, earned)))
+
+        self.assertEqual(net_incentives([0, 0], [500, 300], -80), [-50, -30])
+
+
+class ChartGranularityTests(DiagnosisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        self._create_bill(self.types[:1])
+        self._create_bill([self.lab_test], date_of_bill=(timezone.now() - timedelta(days=40)).isoformat())
+
+    def test_year_by_month_has_a_zero_filled_row_per_month(self):
+        response = self.client.get("/diagnosis/bill-chart-stat/", {"granularity": "month"})
+
+        rows = response.data["this_year"]
+        self.assertEqual([row["month"] for row in rows], [self.today.replace(month=m, day=1) for m in range(1, 13)])
+        this_month = rows[self.today.month - 1]
+        self.assertEqual((this_month["total"], this_month["ultrasound"]), (1, 1))
+        self.assertEqual(sum(row["total"] for row in rows), Bill.objects.filter(
+            date_of_bill__year=self.today.year).count())
+
+    def test_days_are_zero_filled(self):
+        rows = self.client.get("/diagnosis/bill-chart-stat/").data["this_month"]
+
+        self.assertEqual(rows[0]["day"], self.today.replace(day=1))
+        self.assertEqual(len(rows), calendar.monthrange(self.today.year, self.today.month)[1])
+        self.assertEqual(sum(row["total"] for row in rows), 1)
+
+    def test_arbitrary_range_by_week(self):
+        start = self.today - timedelta(days=60)
+        response = self.client.get("/diagnosis/bill-chart-stat/", {
+            "granularity": "week", "start": start.isoformat(), "end": self.today.isoformat(),
+        })
+
+        rows = response.data["range"]
+        self.assertEqual(rows[0]["week"], start - timedelta(days=start.weekday()))
+        self.assertTrue(all(row["week"].weekday() == 0 for row in rows))
+        self.assertEqual(sum(row["total"] for row in rows), 2)
+        self.assertEqual(sum(row["franchise_lab"] for row in rows), 1)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({"granularity": "hour"}, {"start": "2024-01-01"}, {"start": "2024-02-01", "end": "2024-01-01"},
+                       {"start": "2000-01-01", "end": "2024-01-01"}):
+            response = self.client.get("/diagnosis/bill-chart-stat/", params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(DASHBOARD_WORKERS=2)
+class RunConcurrentlyTests(TransactionTestCase):
+    def test_jobs_run_on_pool_threads_with_their_own_connections(self):
+        results, seconds = run_concurrently({
+            "thread": lambda: threading.current_thread().name,
+            "bills": lambda: Bill.objects.count(),
+        })
+
+        self.assertTrue(results["thread"].startswith("concurrent-job"))
+        self.assertEqual(results["bills"], 0)
+        self.assertEqual(set(seconds), {"thread", "bills"})
+
+    def test_jobs_run_in_turn_inside_a_transaction(self):
+        with transaction.atomic():
+            results, _ = run_concurrently({"thread": lambda: threading.current_thread().name})
+
+        self.assertEqual(results["thread"], threading.current_thread().name)
+
+
+class SmartCascadeDeleteTests(DiagnosisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_admin = True
+        self.user.save()
+        self.scan, self.other_scan = self.types[0], self.types[1]
+
+    def test_deletes_only_bills_whose_sole_line_is_the_type(self):
+        only_scan = self._create_bill([self.scan])
+        mixed = self._create_bill([self.scan, self.other_scan])
+        unrelated = self._create_bill([self.other_scan])
+
+        response = self.client.delete(f"/diagnosis/diagnosis-type/{self.scan.id}/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Bill.objects.filter(pk=only_scan.pk).exists())
+        self.assertEqual(
+            list(mixed.bill_diagnosis_types.values_list("diagnosis_type_id", flat=True)),
+            [self.other_scan.id],
+        )
+        self.assertTrue(Bill.objects.filter(pk=unrelated.pk).exists())
+
+    def test_query_count_does_not_grow_with_bills(self):
+        for _ in range(2):
+            self._create_bill([self.scan])
+        with CaptureQueriesContext(connection) as few_bills:
+            self.scan.delete()
+
+        for _ in range(8):
+            self._create_bill([self.other_scan])
+        with CaptureQueriesContext(connection) as many_bills:
+            self.other_scan.delete()
+
+        self.assertEqual(len(few_bills.captured_queries), len(many_bills.captured_queries))
+        self.assertFalse(Bill.objects.exists())
+
+    def test_category_delete_keeps_bills_with_other_categories(self):
+        scans_only = self._create_bill([self.scan, self.other_scan], franchise_name=None)
+        mixed = self._create_bill([self.scan, self.lab_test])
+
+        response = self.client.delete(f"/diagnosis/categories/{self.ultrasound.id}/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Bill.objects.filter(pk=scans_only.pk).exists())
+        self.assertEqual(
+            list(mixed.bill_diagnosis_types.values_list("diagnosis_type_id", flat=True)),
+            [self.lab_test.id],
+        )
+
+    def test_report_files_of_deleted_bills_are_removed(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        bill = self._create_bill([self.scan])
+
+        with override_settings(MEDIA_ROOT=media_root):
+            report = PatientReport.objects.create(
+                bill=bill,
+                center_detail=self.center,
+                report_file=SimpleUploadedFile("scan.pdf", b"%PDF-1.4"),
+            )
+            report_path = report.report_file.path
+            self.assertTrue(os.path.isfile(report_path))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.scan.delete()
+
+        self.assertFalse(PatientReport.objects.exists())
+        self.assertFalse(os.path.isfile(report_path))
+
+    @override_settings(SMART_DELETE_BACKGROUND_THRESHOLD=1)
+    def test_large_cascade_runs_in_background(self):
+        self._create_bill([self.scan])
+        self._create_bill([self.scan])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.delete(f"/diagnosis/diagnosis-type/{self.scan.id}/")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(DiagnosisType.objects.filter(pk=self.scan.pk).exists())
+
+        # The job is on record, so one lost to a restart can be finished.
+        self.assertEqual(PendingDeletion.objects.get().diagnosis_type, self.scan)
+        call_command("resume_deletions", stdout=StringIO())
+        self.assertFalse(DiagnosisType.objects.filter(pk=self.scan.pk).exists())
+        self.assertFalse(Bill.objects.exists())
+        self.assertFalse(PendingDeletion.objects.exists())
+
+
+class DoctorBulkImportTests(DiagnosisAPITestCase):
+    URL = "/diagnosis/doctor/bulk-import/"
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_admin = True
+        self.user.save()
+
+    def _roster(self, count, start=100):
+        return [
+            {
+                "first_name": f"Doc{i}",
+                "last_name": "Import",
+                "phone_number": f"9100000{i:03d}",
+                "category_percentages": [{"category": self.ultrasound.id, "percentage": 30}],
+            }
+            for i in range(start, start + count)
+        ]
+
+    def test_json_import_creates_and_updates_doctors(self):
+        rows = self._roster(2) + [{
+            "first_name": "Asha",
+            "last_name": "Rao-Menon",
+            "phone_number": self.doctor.phone_number,
+            "category_percentages": [{"category": "ultrasound", "percentage": 45}],
+        }]
+
+        response = self.client.post(self.URL, {"doctors": rows}, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data, {"created": 2, "updated": 1, "errors": []})
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.last_name, "Rao-Menon")
+        self.assertEqual(
+            dict(self.doctor.category_percentages.values_list("category_id", "percentage")),
+            {self.ultrasound.id: 45, self.franchise_lab.id: 10},
+        )
+        self.assertEqual(
+            DoctorCategoryPercentage.objects.filter(doctor__last_name="Import", percentage=30).count(), 2,
+        )
+
+    def test_query_count_does_not_grow_with_roster(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.URL, self._roster(2), format="json")
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.URL, self._roster(50, start=200), format="json")
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Doctor.objects.filter(center_detail=self.center).count(), 53)
+
+    def test_csv_import_reads_category_columns(self):
+        csv_file = SimpleUploadedFile(
+            "doctors.csv",
+            b"first_name,last_name,phone_number,Ultrasound,Franchise Lab\n"
+            b"Meera,Iyer,9200000001,35,\n"
+            b"Kabir,Shah,9200000002,20,5\n",
+            content_type="text/csv",
+        )
+
+        response = self.client.post(self.URL, {"file": csv_file}, format="multipart")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["created"], 2)
+        kabir = Doctor.objects.get(phone_number="9200000002")
+        self.assertEqual(
+            dict(kabir.category_percentages.values_list("category_id", "percentage")),
+            {self.ultrasound.id: 20, self.franchise_lab.id: 5},
+        )
+
+    def test_invalid_rows_are_reported_and_valid_rows_saved(self):
+        rows = self._roster(1) + [
+            {"last_name": "NoFirstName", "phone_number": "9300000001"},
+            {"first_name": "Twin", "last_name": "Import", "phone_number": "9100000100"},
+            {"first_name": "Bad", "last_name": "Category", "category_percentages": [{"category": "MRI", "percentage": 5}]},
+            {"first_name": "Too", "last_name": "High", "category_percentages": [{"category": "ultrasound", "percentage": 120}]},
+        ]
+
+        response = self.client.post(self.URL, rows, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual([error["row"] for error in response.data["errors"]], [2, 3, 4, 5])
+        self.assertIn("first_name", response.data["errors"][0]["errors"])
+        self.assertIn("phone_number", response.data["errors"][1]["errors"])
+        self.assertFalse(Doctor.objects.filter(first_name__in=["Twin", "Bad", "Too"]).exists())
+
+    def test_rows_without_phone_number_are_never_imported(self):
+        rows = [
+            {"first_name": "No", "last_name": "Phone"},
+            {"first_name": "Blank", "last_name": "Phone", "phone_number": "  "},
+        ]
+
+        for _ in range(2):
+            response = self.client.post(self.URL, rows, format="json")
+
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(response.data["created"], 0)
+            self.assertEqual([error["row"] for error in response.data["errors"]], [1, 2])
+            self.assertIn("phone_number", response.data["errors"][0]["errors"])
+        self.assertFalse(Doctor.objects.filter(last_name="Phone").exists())
+
+    def test_import_requires_admin(self):
+        self.user.is_admin = False
+        self.user.save()
+
+        response = self.client.post(self.URL, self._roster(1), format="json")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_doctor_update_replaces_percentages(self):
+        payload = {
+            "first_name": "Asha",
+            "last_name": "Rao",
+            "phone_number": self.doctor.phone_number,
+            "category_percentages": [{"category": self.franchise_lab.id, "percentage": 15}],
+        }
+
+        response = self.client.put(f"/diagnosis/doctor/{self.doctor.id}/", payload, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            dict(self.doctor.category_percentages.values_list("category_id", "percentage")),
+            {self.franchise_lab.id: 15},
+        )
+
+
+class PriceRevisionTests(DiagnosisAPITestCase):
+    URL = "/diagnosis/diagnosis-type/revise-prices/"
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_admin = True
+        self.user.save()
+
+    def test_percentage_revision_of_one_category_is_one_update(self):
+        payload = {"mode": "percentage", "value": "10", "category": self.ultrasound.id}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.URL, payload, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data, {"revised": 3})
+        updates = [q for q in queries.captured_queries if q["sql"].startswith('UPDATE "diagnosis_diagnosistype"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            sorted(DiagnosisType.objects.filter(category=self.ultrasound).values_list("price", flat=True)),
+            [550, 660, 770],
+        )
+        self.lab_test.refresh_from_db()
+        self.assertEqual(self.lab_test.price, 300)
+        self.assertEqual(self.types[0].price_history.first().price, 550)
+
+    def test_absolute_revision_never_goes_below_zero(self):
+        response = self.client.post(self.URL, {"mode": "absolute", "value": "-550"}, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data, {"revised": 4})
+        self.assertEqual(
+            sorted(DiagnosisType.objects.values_list("price", flat=True)), [0, 0, 50, 150],
+        )
+
+    def test_invalid_revisions_are_rejected(self):
+        for payload in ({"mode": "percentage", "value": "-100"}, {"mode": "absolute", "value": "2.5"}):
+            response = self.client.post(self.URL, payload, format="json")
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_revision_requires_admin(self):
+        self.user.is_admin = False
+        self.user.save()
+
+        response = self.client.post(self.URL, {"mode": "absolute", "value": "10"}, format="json")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_price_change_is_recorded_in_history(self):
+        scan = DiagnosisType.objects.get(pk=self.types[0].pk)
+        scan.price = 650
+        scan.save()
+        scan.name = "Scan zero"
+        scan.save()
+
+        self.assertEqual(list(scan.price_history.values_list("price", flat=True)), [650, 500])
+
+    def test_backdated_bill_uses_price_in_force_on_its_date(self):
+        scan = self.types[0]
+        scan.price_history.update(effective_from=timezone.now() - timedelta(days=5))
+        DiagnosisTypePrice.objects.create(
+            diagnosis_type=scan, price=400, effective_from=timezone.now() - timedelta(days=30),
+        )
+
+        backdated = self._create_bill(
+            [scan], date_of_bill=(timezone.now() - timedelta(days=10)).isoformat(), paid_amount=300,
+        )
+        current = self._create_bill([scan])
+
+        self.assertEqual(backdated.bill_diagnosis_types.get().price_at_time, 400)
+        self.assertEqual(backdated.total_amount, 400)
+        self.assertEqual(current.bill_diagnosis_types.get().price_at_time, 500)
+
+
+class PatientRegistryTests(DiagnosisAPITestCase):
+    def test_bills_share_one_patient_per_phone_number(self):
+        first = self._create_bill(self.types[:1])
+        second = self._create_bill(self.types[:1], patient_name="Ravi Kumar", patient_age=41)
+        unknown = self._create_bill(self.types[:1], patient_phone_number=9999999999)
+
+        patient = Patient.objects.get()
+        self.assertEqual((patient.name, patient.age), ("Ravi Kumar", 41))
+        self.assertEqual({first.patient_id, second.patient_id}, {patient.pk})
+        self.assertIsNone(unknown.patient_id)
+
+    def test_editing_a_bill_refreshes_the_patient_only_from_their_latest_bill(self):
+        self.user.is_admin = True
+        self.user.save()
+        older = self._create_bill(self.types[:1], date_of_bill="2026-01-05T10:00:00Z")
+        self._create_bill(self.types[:1], date_of_bill="2026-03-05T10:00:00Z", patient_age=41)
+
+        def edit(bill, **changes):
+            payload = self._payload(self.types[:1], date_of_bill=bill.date_of_bill.isoformat(), **changes)
+            response = self.client.put(f"/diagnosis/bill/{bill.pk}/", payload, format="json")
+            self.assertEqual(response.status_code, 200, response.data)
+            return Bill.objects.get(pk=bill.pk)
+
+        older = edit(older, patient_name="Ravi K", patient_age=40)
+        patient = Patient.objects.get()
+        self.assertEqual((patient.name, patient.age), ("Ravi", 41))
+        self.assertEqual(older.patient_id, patient.pk)
+
+        newer = edit(Bill.objects.latest("date_of_bill"), patient_name="Ravi Kumar", patient_age=41)
+        patient.refresh_from_db()
+        self.assertEqual((patient.name, patient.age), ("Ravi Kumar", 41))
+
+        older = edit(older, patient_name="Ravi K", patient_phone_number=9123456789)
+        self.assertEqual(older.patient.phone_number, 9123456789)
+        self.assertEqual(older.patient.name, "Ravi K")
+        self.assertEqual(newer.patient_id, patient.pk)
+
+    def test_autocomplete_matches_phone_prefix_within_center(self):
+        other_center = CenterDetail.objects.create(
+            center_name="Other", address="2 Main Street", owner_name="Other", owner_phone="9000000009",
+        )
+        for center, phone in [
+            (self.center, 9876543210),
+            (self.center, 9876500000),
+            (self.center, 987650000012),
+            (self.center, 9123456789),
+            (other_center, 9876511111),
+        ]:
+            Patient.objects.create(center_detail=center, phone_number=phone, name="P", age=30, sex="Male")
+
+        response = self.client.get("/diagnosis/patient/autocomplete/", {"phone": "98765"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [patient["phone_number"] for patient in response.data],
+            [9876500000, 9876543210, 987650000012],
+        )
+        self.assertEqual(self.client.get("/diagnosis/patient/autocomplete/", {"phone": "98"}).data, [])
+        self.assertEqual(self.client.get("/diagnosis/patient/autocomplete/", {"phone": "98a65"}).data, [])
+
+    def test_visit_history_lists_patient_bills_newest_first(self):
+        older = self._create_bill(self.types[:1], date_of_bill="2026-01-05T10:00:00Z")
+        newer = self._create_bill(self.types[:1], date_of_bill="2026-03-05T10:00:00Z")
+        self._create_bill(self.types[:1], patient_phone_number=9123456789)
+
+        response = self.client.get(f"/diagnosis/patient/{newer.patient_id}/visits/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([bill["id"] for bill in response.data["results"]], [newer.id, older.id])
+
+    def test_backfill_links_existing_bills(self):
+        bills = [
+            self._create_bill(self.types[:1]),
+            self._create_bill(self.types[:1], patient_name="Ravi K"),
+            self._create_bill(self.types[:1], patient_phone_number=9123456789),
+            self._create_bill(self.types[:1], patient_phone_number=9999999999),
+        ]
+        Bill.objects.update(patient=None)
+        Patient.objects.all().delete()
+
+        call_command("backfill_patients", batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Patient.objects.count(), 2)
+        self.assertEqual(Patient.objects.get(phone_number=9876543210).name, "Ravi K")
+        linked = dict(Bill.objects.values_list("pk", "patient__phone_number"))
+        self.assertEqual(
+            [linked[bill.pk] for bill in bills], [9876543210, 9876543210, 9123456789, None],
+        )
+
+
+class SargableDateFilterTests(DiagnosisAPITestCase):
+    def _seed_planner_statistics(self):
+        # Give the planner five years of bills to estimate from and rule out
+        # the sequential scan a tiny table would otherwise get.
+        start = timezone.now() - timedelta(days=5 * 365)
+        Bill.objects.bulk_create(
+            Bill(
+                bill_number=f"LLPLAN{i}", patient_name="P", patient_age=30, patient_sex="Male",
+                date_of_bill=start + timedelta(days=5 * i), date_of_test=start + timedelta(days=5 * i),
+                total_amount=0, center_detail=self.center,
+            )
+            for i in range(365)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE diagnosis_bill")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name, column):
+        # The date bound must be an index condition, not a filter applied
+        # to rows after the scan.
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertRegex(plan, rf"Index Cond: .*{column}")
+
+    def _filtered(self, params):
+        return BillFilter(params, queryset=Bill.objects.filter(center_detail=self.center)).qs
+
+    def test_bill_date_filters_use_center_recent_index(self):
+        self._seed_planner_statistics()
+        for params in (
+            {"date_of_bill": "2026-03-01"},
+            {"bill_start_date": "2026-01-01", "bill_end_date": "2026-01-31"},
+            {"bill_year": "2026", "bill_month": "2"},
+        ):
+            with self.subTest(params=params):
+                self.assertUsesIndex(self._filtered(params), "bill_center_recent_idx", "date_of_bill")
+
+    def test_test_date_filters_use_center_test_date_index(self):
+        self._seed_planner_statistics()
+        for params in (
+            {"date_of_test": "2026-03-01"},
+            {"test_year": "2026"},
+            {"this_month": "true"},
+            {"last_7_days": "true"},
+        ):
+            with self.subTest(params=params):
+                self.assertUsesIndex(self._filtered(params), "bill_center_test_date_idx", "date_of_test")
+
+    def test_calendar_day_follows_local_time_zone(self):
+        # 00:30 on 1 March in Asia/Kolkata is still 28 February in UTC.
+        bill = self._create_bill(self.types[:1], date_of_bill="2026-02-28T19:00:00Z")
+        self._create_bill(self.types[:1], date_of_bill="2026-02-28T18:00:00Z")
+
+        response = self.client.get("/diagnosis/bill/", {"date_of_bill": "2026-03-01"})
+
+        self.assertEqual([row["id"] for row in response.data["results"]], [bill.id])
+        self.assertEqual(self._filtered({"bill_year": "2026", "bill_month": "3"}).get(), bill)
+        self.assertEqual(self._filtered({"bill_month": "3"}).get(), bill)
+
+    def test_growth_stats_count_bills_in_local_periods(self):
+        self._create_bill(self.types[:1])
+        self._create_bill(self.types[:1], date_of_bill="2020-01-01T00:00:00Z")
+
+        response = self.client.get("/diagnosis/bills/growth-stats/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["current_month"]["total_bills"], 1)
+        self.assertEqual(response.data["current_year"]["total_bills"], 1)
+
+
+class QueryPlanRegressionTests(DiagnosisAPITestCase):
+    """
+    Calls each read endpoint against a seeded two-center dataset, EXPLAINs
+    every query it sends and fails when one of them can only be answered by
+    a sequential scan of a large table. Sequential scans are disabled while
+    explaining, so one only shows up when no index fits the query.
+    """
+    LARGE_TABLES = [
+        "diagnosis_bill",
+        "diagnosis_billdiagnosistype",
+        "diagnosis_patient",
+        "diagnosis_patientreport",
+    ]
+    BILLS_PER_CENTER = 300
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_admin = True
+        self.user.save()
+        self._seed()
+
+    def _seed(self):
+        other_center = CenterDetail.objects.create(
+            center_name="Other Center", address="2 Main Street", owner_name="Other", owner_phone="9000000009",
+        )
+        other_doctor = Doctor.objects.create(center_detail=other_center, first_name="Vikram", last_name="Das")
+        other_type = DiagnosisType.objects.create(
+            center_detail=other_center, name="X-Ray", category=self.ultrasound, price=400,
+        )
+        second_doctor = Doctor.objects.create(center_detail=self.center, first_name="Neha", last_name="Sen")
+
+        statuses = ["Fully Paid", "Fully Paid", "Partially Paid", "Unpaid"]
+        start = timezone.now() - timedelta(days=3 * 365)
+        bills, line_types = [], []
+        for center, doctors, types in (
+            (self.center, [self.doctor, second_doctor], self.types),
+            (other_center, [other_doctor], [other_type]),
+        ):
+            patients = Patient.objects.bulk_create(
+                Patient(center_detail=center, phone_number=9876500000 + i, name="P", age=30, sex="Male")
+                for i in range(50)
+            )
+            for i in range(self.BILLS_PER_CENTER):
+                bills.append(Bill(
+                    bill_number=f"LLSEED{center.pk}-{i}", patient_name="P", patient_age=30,
+                    patient_sex="Male", patient_phone_number=patients[i % 50].phone_number,
+                    patient=patients[i % 50], referred_by_doctor=doctors[i % len(doctors)],
+                    date_of_bill=start + timedelta(days=3 * i + 1), date_of_test=start + timedelta(days=3 * i),
+                    bill_status=statuses[i % len(statuses)], total_amount=500, center_detail=center,
+                ))
+                line_types.append(types[i % len(types)])
+        Bill.objects.bulk_create(bills)
+        BillDiagnosisType.objects.bulk_create(
+            BillDiagnosisType(
+                bill=bill, diagnosis_type=diagnosis_type, price_at_time=diagnosis_type.price,
+                category=diagnosis_type.category, is_franchise_lab=diagnosis_type.category.is_franchise_lab,
+            )
+            for bill, diagnosis_type in zip(bills, line_types)
+        )
+        self.bill = bills[0]
+        self.patient = self.bill.patient
+
+        with connection.cursor() as cursor:
+            for table in self.LARGE_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+
+    def _endpoints(self):
+        today = timezone.localdate()
+        return [
+            ("/diagnosis/bill/", {}),
+            ("/diagnosis/bill/", {"bill_start_date": str(today - timedelta(days=30)), "bill_end_date": str(today)}),
+            ("/diagnosis/bill/", {"referred_by_doctor": self.doctor.id}),
+            ("/diagnosis/bill/", {"unpaid_or_partial": "true"}),
+            (f"/diagnosis/bill/{self.bill.id}/", {}),
+            ("/diagnosis/pending-reports/", {}),
+            ("/diagnosis/referral-stat/", {}),
+            ("/diagnosis/bill-chart-stat/", {}),
+            ("/diagnosis/bills/growth-stats/", {}),
+            (f"/diagnosis/doctors/{self.doctor.id}/growth-stats/", {}),
+            (f"/diagnosis/doctors/{self.doctor.id}/incentives/", {}),
+            ("/diagnosis/incentives/", {}),
+            ("/diagnosis/patient/autocomplete/", {"phone": "98765"}),
+            (f"/diagnosis/patient/{self.patient.id}/visits/", {}),
+        ]
+
+    def _sequential_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {sql}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        return [table for table in self.LARGE_TABLES if f"Seq Scan on {table} " in plan], plan
+
+    def test_endpoints_do_not_scan_large_tables(self):
+        for url, params in self._endpoints():
+            with self.subTest(url=url, params=params):
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+
+                for query in captured.captured_queries:
+                    sql = query["sql"]
+                    if not sql.startswith("SELECT") or not any(t in sql for t in self.LARGE_TABLES):
+                        continue
+                    scanned, plan = self._sequential_scans(sql)
+                    self.assertEqual(scanned, [], f"{sql}\n\n{plan}")
+
+
+class GenerateLoadDataTests(TestCase):
+    OPTIONS = {"centers": 2, "bills_per_center": 30, "chunk_size": 20, "workers": 1, "seed": 7, "days": 60}
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def _generate(self):
+        call_command("generate_load_data", stdout=StringIO(), **self.OPTIONS)
+        return {
+            bill.bill_number: (
+                bill.date_of_bill, bill.patient_phone_number, bill.bill_status, bill.total_amount,
+                bill.incentive_amount, bill.paid_amount, bill.disc_by_doctor,
+                sorted(line.diagnosis_type.name for line in bill.bill_diagnosis_types.all()),
+            )
+            for bill in Bill.objects.prefetch_related("bill_diagnosis_types__diagnosis_type")
+        }
+
+    def test_generates_consistent_centers_and_bills(self):
+        self._generate()
+
+        self.assertEqual(CenterDetail.objects.count(), 2)
+        self.assertEqual(StaffAccount.objects.filter(is_admin=True).count(), 2)
+        self.assertEqual(Bill.objects.count(), 60)
+        self.assertFalse(Bill.objects.filter(patient__isnull=True).exists())
+        self.assertTrue(PatientReport.objects.exists())
+        self.assertEqual(Bill.objects.filter(has_report=True).count(), PatientReport.objects.count())
+        for bill in Bill.objects.prefetch_related("bill_diagnosis_types"):
+            self.assertEqual(bill.total_amount, sum(line.price_at_time for line in bill.bill_diagnosis_types.all()))
+        prices = DiagnosisTypePrice.prices_in_force(DiagnosisType.objects.values("id"), timezone.now())
+        self.assertEqual(prices, dict(DiagnosisType.objects.values_list("id", "price")))
+
+    def test_same_seed_generates_the_same_data(self):
+        with transaction.atomic():
+            first = self._generate()
+            transaction.set_rollback(True)
+
+        self.assertEqual(self._generate(), first)
+
+    def test_seed_can_only_be_generated_once(self):
+        self._generate()
+        with self.assertRaises(CommandError):
+            self._generate()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReplayTrafficTests(LiveServerTestCase):
+    LOG = (
+        '1.2.3.4 - - [07/Oct/2025:07:40:22 +0530] "GET /diagnosis/bill/?search=Ravi HTTP/1.1" 200 21 "-" "app"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:23 +0530] "GET /diagnosis/bill/ HTTP/1.1" 200 21 "-" "app"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:24 +0530] "GET /diagnosis/bill/812/ HTTP/1.1" 200 21 "-" "app"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:25 +0530] "GET /diagnosis/doctors/77/incentives/ HTTP/1.1" 200 21 "-" "app"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:26 +0530] "POST /api/token/ HTTP/1.1" 200 21 "-" "app"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:27 +0530] "GET /.env HTTP/1.1" 404 21 "-" "scanner"\n'
+        '1.2.3.4 - - [07/Oct/2025:07:40:28 +0530] "GET /predator/ HTTP/1.1" 200 21 "-" "browser"\n'
+        'not a log line\n'
+    )
+
+    def setUp(self):
+        center = CenterDetail.objects.create(
+            center_name="Replay Center", address="1 Main Street", owner_name="Owner", owner_phone="9000000001",
+        )
+        StaffAccount.objects.create_user(
+            username="replayadmin", email="replay@example.com", password="pass12345", first_name="Re",
+            last_name="Play", address="Desk", phone_number="9000000002", center_detail=center, is_admin=True,
+        )
+        category = DiagnosisCategory.objects.create(name="Ultrasound")
+        doctor = Doctor.objects.create(center_detail=center, first_name="Asha", last_name="Rao")
+        scan = DiagnosisType.objects.create(center_detail=center, name="Scan", category=category, price=500)
+        bill = Bill.objects.create(
+            patient_name="Ravi", patient_age=40, patient_sex="Male", referred_by_doctor=doctor,
+            total_amount=500, paid_amount=500, center_detail=center,
+        )
+        BillDiagnosisType.objects.create(bill=bill, diagnosis_type=scan, price_at_time=500)
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.log_path = os.path.join(workdir, "access.log")
+        self.output_path = os.path.join(workdir, "report.json")
+        with open(self.log_path, "w") as log:
+            log.write(self.LOG)
+
+    def _replay(self, *args):
+        stdout = StringIO()
+        call_command(
+            "replay_traffic", "--log", self.log_path, "--base-url", self.live_server_url, *args, stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_dry_run_weights_successful_reads_by_route(self):
+        output = self._replay("--dry-run")
+
+        self.assertIn("50.00%  /diagnosis/bill/$", output)
+        self.assertIn("25.00%  /diagnosis/bill/(?P<pk>[^/.]+)/$", output)
+        self.assertIn("25.00%  /diagnosis/doctors/<int:doctor_id>/incentives/", output)
+        for reason in ("1 writes", "1 failed requests", "1 admin site", "1 unparsed lines"):
+            self.assertIn(f"skipped {reason}", output)
+
+    def test_replay_reports_latency_percentiles_per_route(self):
+        self._replay("--requests", "40", "--concurrency", "4", "--output", self.output_path)
+
+        with open(self.output_path) as output:
+            report = json.load(output)
+        self.assertEqual(report["requests"], 40)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(sum(route["requests"] for route in report["routes"].values()), 40)
+        for stats in report["routes"].values():
+            self.assertLessEqual(stats["p50_ms"], stats["p95_ms"])
+            self.assertLessEqual(stats["p95_ms"], stats["p99_ms"])
+
+
+class SlowQueryReportTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.log_path = os.path.join(workdir, "slow-queries.jsonl")
+        entries = [
+            ("aaaa", "diagnosis/bill/$", 120.0, ["Seq Scan on diagnosis_bill"]),
+            ("aaaa", "diagnosis/bill/$", 80.0, None),
+            ("bbbb", "diagnosis/bill/$", 30.0, None),
+            ("bbbb", "diagnosis/referral-stats/$", 300.0, None),
+        ]
+        # Each worker process writes a file of its own.
+        with open(f"{self.log_path}.1234", "w") as log:
+            for fingerprint, route, duration_ms, plan in entries:
+                log.write(json.dumps({
+                    "fingerprint": fingerprint, "route": route, "duration_ms": duration_ms,
+                    "sql": f"SELECT {fingerprint}", "plan": plan,
+                }) + "\n")
+        # Rotated files are read along with the current ones.
+        with open(f"{self.log_path}.5678.1", "w") as log:
+            log.write("not json\n")
+
+    def test_statements_are_ranked_by_total_time_overall_and_per_route(self):
+        stdout = StringIO()
+        call_command("slow_query_report", "--log", self.log_path, "--plans", stdout=stdout)
+        output = stdout.getvalue()
+
+        overall, bills, referrals = (
+            output.index("Slowest statements overall (2 fingerprints)"),
+            output.index("/diagnosis/bill/$ (230.0 ms"),
+            output.index("/diagnosis/referral-stats/$ (300.0 ms"),
+        )
+        self.assertLess(overall, referrals)
+        self.assertLess(referrals, bills)
+        self.assertLess(output.index("bbbb      2 runs       330.0 ms total"), output.index("aaaa      2 runs"))
+        self.assertIn("Seq Scan on diagnosis_bill", output)
+        self.assertIn("Skipped 1 unparsed lines.", output)
+
+    def test_missing_log_is_an_error(self):
+        with self.assertRaises(CommandError):
+            call_command("slow_query_report", "--log", f"{self.log_path}.missing", stdout=StringIO())
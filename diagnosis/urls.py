@@ -3,6 +3,7 @@ from .views import (
                     BillChartStatsViewSet,
                     BillGrowthStatsView,
                     CenterAuditLogListView,
+                    DashboardView,
                     DiagnosisCategoryViewSet,
                     DiagnosisTypeViewSet,
                     DoctorBillGrowthStatsView,
@@ -11,6 +12,7 @@ from .views import (
                     FlexibleIncentiveReportView,
                     FranchiseNameViewSet,
                     PatientReportViewset,
+                    PatientViewSet,
                     PendingReportViewSet,
                     ReferralStatsViewSet,
                     ReportQuotaSummaryView,
@@ -25,6 +27,7 @@ from all_urls import (
     DIAG_BILL_ROUTER,
     DIAG_BILLS_GROWTH_STATS,
     DIAG_CATEGORIES_ROUTER,
+    DIAG_DASHBOARD,
     DIAG_DIAGNOSIS_TYPE_ROUTER,
     DIAG_BILL_MESSAGE_REPORT,
     DIAG_DOCTOR_GROWTH_STATS,
@@ -34,6 +37,7 @@ from all_urls import (
     DIAG_INCENTIVES,
     DIAG_REPORT_QUOTA_SUMMARY,
     DIAG_PATIENT_REPORT_ROUTER,
+    DIAG_PATIENT_ROUTER,
     DIAG_PENDING_REPORTS_ROUTER,
     DIAG_REFERRAL_STAT_ROUTER,
     DIAG_SAMPLE_TEST_REPORT_ROUTER,
@@ -51,6 +55,7 @@ router.register(DIAG_REFERRAL_STAT_ROUTER, ReferralStatsViewSet, basename='refer
 router.register(DIAG_BILL_CHART_STAT_ROUTER, BillChartStatsViewSet, basename='bill-chart-stats')
 router.register(DIAG_PENDING_REPORTS_ROUTER, PendingReportViewSet, basename='pending-report')
 router.register(DIAG_CATEGORIES_ROUTER, DiagnosisCategoryViewSet, basename='category')
+router.register(DIAG_PATIENT_ROUTER, PatientViewSet, basename='patient')
 
 
 urlpatterns = [
@@ -62,4 +67,5 @@ urlpatterns = [
     path(DIAG_DOCTOR_GROWTH_STATS, DoctorBillGrowthStatsView.as_view(), name='doctor-growth-stats'),
     path(DIAG_BILLS_GROWTH_STATS, BillGrowthStatsView.as_view(), name='bill-growth-stats'),
     path(DIAG_INCENTIVES, FlexibleIncentiveReportView.as_view(), name='flexible-incentive-report'),
+    path(DIAG_DASHBOARD, DashboardView.as_view(), name='dashboard'),
 ]
\ No newline at end of file
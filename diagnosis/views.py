@@ -1,10 +1,11 @@
-from datetime import datetime, timedelta, date
-from calendar import monthrange
+import hashlib
+from datetime import date
+from functools import wraps
 from itertools import groupby
-from django.db.models import Count, Q, Sum, Value
-from django.db.models.functions import Concat, TruncDate
+from django.conf import settings
+from django.db.models import Count, Prefetch, Q, Sum
 from django.http import FileResponse, HttpResponseGone
-from django.utils.timezone import now, make_aware, get_default_timezone
+from django.utils.timezone import now, localdate, get_default_timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, permissions, status, generics
 from rest_framework.decorators import action
@@ -14,18 +15,25 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django.urls import reverse
+from authentication.serializers import verified_user_data
 from center_detail.models import get_free_plan
 from center_detail.permissions import IsSubscriptionActive, IsUserNotLocked
 from .models import (
     AuditLog,
     Bill,
+    BillDiagnosisType,
     DiagnosisCategory,
     DiagnosisType,
     Doctor,
     FranchiseName,
+    Patient,
     PatientReport,
+    PendingDeletion,
+    PendingReportCount,
     SampleTestReport,
+    revise_prices,
 )
 from .serializers import (
     AuditLogSerializer,
@@ -38,18 +46,49 @@ from .serializers import (
     IncentiveDoctorSerializer,
     MinimalBillSerializerForPendingReports,
     PatientReportSerializer,
+    PatientSerializer,
+    PatientVisitSerializer,
+    PriceRevisionSerializer,
     SampleTestReportSerializer,
+    doctor_rows_from_csv,
+    import_doctors,
 )
 from .filters import (
                        BillFilter,
                        DiagnosisTypeFilter,
                        DoctorFilter,
                        PatientReportFilter,
+                       PendingReportFilter,
                        SampleTestReportFilter,
                        )
-from .pagination import StandardResultsSetPagination
+from .date_ranges import calendar_periods, growth_periods, in_date_range
+from .pagination import PendingReportPagination, StandardResultsSetPagination
+from .stats import (
+    CHART_GRANULARITIES,
+    CHART_MAX_BUCKETS,
+    PENDING_REPORTS_LIMIT,
+    bill_chart_stats,
+    calendar_buckets,
+    bill_growth_stats,
+    category_counts,
+    category_incentives,
+    pending_report_bills,
+    referral_stats,
+)
+from .reference_data import (
+    data_version,
+    get_category_list,
+    get_reference_data,
+    invalidate_center,
+)
+from .tasks import run_concurrently, run_in_background
+from LabLedger.metrics import record_audit_log_failure, time_quota_check
 from all_urls import DIAG_BILL_SEND_MESSAGE
+from all_urls import DIAG_DOCTOR_BULK_IMPORT
+from all_urls import DIAG_DIAGNOSIS_TYPE_REVISE_PRICES
 from all_urls import DIAG_PATIENT_REPORT_DOWNLOAD
+from all_urls import DIAG_PATIENT_AUTOCOMPLETE
+from all_urls import DIAG_PATIENT_VISITS
 
 MB_BYTES = 1024 * 1024
 
@@ -208,7 +247,16 @@ def _safe_audit_log(user, action, model_name, object_id='', details='', request=
             request=request,
         )
     except Exception:
-        pass
+        record_audit_log_failure(model_name, action)
+
+
+def _is_large_cascade(bill_lines):
+    """
+    True when a smart cascade delete would touch more bill lines than
+    SMART_DELETE_BACKGROUND_THRESHOLD. The count is bounded by the threshold.
+    """
+    threshold = getattr(settings, 'SMART_DELETE_BACKGROUND_THRESHOLD', 5000)
+    return bill_lines[:threshold + 1].count() > threshold
 
 
 class CenterDetailFilterMixin:
@@ -216,16 +264,62 @@ class CenterDetailFilterMixin:
     A mixin that filters querysets based on the request.user.center_detail.
     """
     def get_queryset(self):
-        model = self.queryset.model
+        # Filter the view's queryset, keeping its select/prefetch_related.
         user = self.request.user
         if not hasattr(user, 'center_detail') or user.center_detail is None:
-            return model.objects.none()
-        return model.objects.filter(center_detail=user.center_detail)
+            return self.queryset.none()
+        return self.queryset.filter(center_detail=user.center_detail)
 
     @property
     def request_detail(self):
         return self.request.user.center_detail
 
+
+def conditional_get(*parts, daily=False):
+    """
+    Give a GET handler's responses a weak ETag made from the versions of the
+    center data they are built from (see reference_data.data_version), and
+    answer a request whose If-None-Match still matches with a 304 before the
+    handler runs any query. `daily` responses also change with the date.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            center_id = getattr(request.user, 'center_detail_id', None)
+            version = data_version(center_id, parts) if center_id is not None else None
+            if version is None:
+                return handler(view, request, *args, **kwargs)
+            if daily:
+                version = f'{version}:{localdate().isoformat()}'
+            # The same data renders differently as JSON and as the browsable API.
+            version = f'{version}:{request.accepted_media_type}'
+            etag = f'W/"{hashlib.sha1(version.encode()).hexdigest()[:20]}"'
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+class ReferenceDataListMixin:
+    """
+    Serve the unfiltered list from the center's cached reference data (see
+    reference_data.py); filtered and searched lists are queried as usual.
+    Either carries an ETag.
+    """
+    reference_list = None
+
+    @conditional_get('reference', 'categories')
+    def list(self, request, *args, **kwargs):
+        center_id = getattr(request.user, 'center_detail_id', None)
+        if request.query_params or center_id is None:
+            return super().list(request, *args, **kwargs)
+        return Response(getattr(get_reference_data(center_id), self.reference_list))
+
 class IsAdminUser(permissions.BasePermission):
     """
     Custom permission to only allow admin users.
@@ -234,9 +328,10 @@ class IsAdminUser(permissions.BasePermission):
         return request.user.is_authenticated and request.user.is_admin
 
 # --- Model ViewSets ---
-class DoctorViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
+class DoctorViewSet(ReferenceDataListMixin, CenterDetailFilterMixin, viewsets.ModelViewSet):
     queryset = Doctor.objects.prefetch_related('category_percentages__category').all()
     serializer_class = DoctorSerializer
+    reference_list = 'doctor_list'
     authentication_classes = [JWTAuthentication]
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_class = DoctorFilter
@@ -247,14 +342,52 @@ class DoctorViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
         return super().get_queryset().order_by(Lower('first_name'))
 
     def get_permissions(self):
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'bulk_import']:
             permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive, IsAdminUser]
         else:
             permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
         return [perm() for perm in permission_classes]
 
+    @action(detail=False, methods=["post"], url_path=DIAG_DOCTOR_BULK_IMPORT)
+    def bulk_import(self, request):
+        """
+        Upsert a roster of doctors from a CSV upload (`file`) or a JSON list
+        (optionally wrapped as {"doctors": [...]}). Valid rows are saved,
+        invalid ones come back as per-row errors.
+        """
+        upload = request.FILES.get("file")
+        if upload is not None:
+            rows = doctor_rows_from_csv(upload)
+        elif isinstance(request.data, list):
+            rows = request.data
+        else:
+            rows = request.data.get("doctors")
+
+        if not isinstance(rows, list) or not rows:
+            raise DRFValidationError({"doctors": "Provide a CSV file or a non-empty list of doctors."})
+        if len(rows) > settings.DOCTOR_IMPORT_MAX_ROWS:
+            raise DRFValidationError({
+                "doctors": f"A single import can contain at most {settings.DOCTOR_IMPORT_MAX_ROWS} doctors."
+            })
+
+        result = import_doctors(request.user.center_detail, rows)
+        invalidate_center(request.user.center_detail_id)
+        _safe_audit_log(
+            user=request.user,
+            action='CREATE',
+            model_name='Doctor',
+            details=(
+                f"Imported doctors: {result['created']} created, {result['updated']} updated, "
+                f"{len(result['errors'])} rejected"
+            ),
+            request=request,
+        )
+        return Response(result)
+
     def perform_create(self, serializer):
         instance = serializer.save(center_detail=self.request.user.center_detail)
+        # The percentages are written after the doctor, and in bulk.
+        invalidate_center(instance.center_detail_id)
         _safe_audit_log(
             user=self.request.user,
             action='CREATE',
@@ -276,6 +409,7 @@ class DoctorViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
         if serializer.instance.center_detail != self.request.user.center_detail:
             raise PermissionDenied("You do not have permission to edit this doctor.")
         instance = serializer.save()
+        invalidate_center(instance.center_detail_id)
         _safe_audit_log(
             user=self.request.user,
             action='UPDATE',
@@ -298,9 +432,10 @@ class DoctorViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
             request=self.request,
         )
 
-class DiagnosisTypeViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
+class DiagnosisTypeViewSet(ReferenceDataListMixin, CenterDetailFilterMixin, viewsets.ModelViewSet):
     queryset = DiagnosisType.objects.all()
     serializer_class = DiagnosisTypeSerializer
+    reference_list = 'diagnosis_type_list'
     authentication_classes = [JWTAuthentication]
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_class = DiagnosisTypeFilter
@@ -310,7 +445,7 @@ class DiagnosisTypeViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
         return super().get_queryset().order_by('name')
 
     def get_permissions(self):
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'revise_prices']:
             permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive, IsAdminUser]
         else:
             permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
@@ -328,6 +463,30 @@ class DiagnosisTypeViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
             request=self.request,
         )
 
+    @action(detail=False, methods=["post"], url_path=DIAG_DIAGNOSIS_TYPE_REVISE_PRICES)
+    def revise_prices(self, request):
+        """
+        Raise or lower the prices of the center's diagnosis types, optionally
+        only one category, by a percentage or an absolute amount.
+        """
+        serializer = PriceRevisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        mode = serializer.validated_data["mode"]
+        value = serializer.validated_data["value"]
+        category = serializer.validated_data.get("category")
+
+        revised = revise_prices(self.request_detail, mode, value, category=category)
+        invalidate_center(request.user.center_detail_id)
+        scope = f"category {category.name}" if category else "all categories"
+        _safe_audit_log(
+            user=request.user,
+            action='UPDATE',
+            model_name='DiagnosisType',
+            details=f"Revised {revised} diagnosis type prices ({mode} {value}) in {scope}",
+            request=request,
+        )
+        return Response({"revised": revised})
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
@@ -346,6 +505,26 @@ class DiagnosisTypeViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
             request=self.request,
         )
 
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not _is_large_cascade(instance.bill_references.all()):
+            self.perform_destroy(instance)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        run_in_background(PendingDeletion.objects.create(diagnosis_type=instance).run)
+        _safe_audit_log(
+            user=request.user,
+            action='DELETE',
+            model_name='DiagnosisType',
+            object_id=instance.pk,
+            details=f"Scheduled background deletion of diagnosis type {instance.name}",
+            request=request,
+        )
+        return Response(
+            {"detail": "Deletion of this diagnosis type and its bills is running in the background."},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
     def perform_destroy(self, instance):
         diagnosis_name = instance.name
         diagnosis_type_id = instance.pk
@@ -359,9 +538,10 @@ class DiagnosisTypeViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
             request=self.request,
         )
 
-class FranchiseNameViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
+class FranchiseNameViewSet(ReferenceDataListMixin, CenterDetailFilterMixin, viewsets.ModelViewSet):
     queryset = FranchiseName.objects.all()
     serializer_class = FranchiseNameSerializer
+    reference_list = 'franchise_list'
     authentication_classes = [JWTAuthentication]
     filter_backends = [DjangoFilterBackend, SearchFilter]
     search_fields = ['franchise_name', 'address', 'phone_number']
@@ -421,7 +601,7 @@ class FranchiseNameViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
 class BillViewset(CenterDetailFilterMixin, viewsets.ModelViewSet):
     queryset = Bill.objects.select_related(
         'referred_by_doctor', 'franchise_name', 'test_done_by', 'center_detail'
-    ).prefetch_related('bill_diagnosis_types__diagnosis_type__category').all()
+    ).all()
     serializer_class = BillSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
@@ -444,7 +624,7 @@ class BillViewset(CenterDetailFilterMixin, viewsets.ModelViewSet):
         "bill_number",
         "patient_name",
         "bill_diagnosis_types__diagnosis_type__name",
-        "bill_diagnosis_types__diagnosis_type__category__name",
+        "bill_diagnosis_types__category__name",
         "referred_by_doctor__first_name",
         "referred_by_doctor__last_name",
         "franchise_name__franchise_name", # ✅ Updated for ForeignKey relationship
@@ -452,7 +632,14 @@ class BillViewset(CenterDetailFilterMixin, viewsets.ModelViewSet):
     ]
 
     def get_queryset(self):
-        return super().get_queryset().order_by("-date_of_bill", "-id")
+        queryset = super().get_queryset().order_by("-date_of_bill", "-id")
+        if self.action in ("list", "retrieve"):
+            # The lines shown, with their type and category, in one query.
+            queryset = queryset.prefetch_related(Prefetch(
+                'bill_diagnosis_types',
+                queryset=BillDiagnosisType.objects.select_related('diagnosis_type__category'),
+            ))
+        return queryset
 
     @action(detail=False, methods=["get"], url_path="franchise-names")
     def franchise_names(self, request):
@@ -594,13 +781,14 @@ class PatientReportViewset(CenterDetailFilterMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Assigns the center_detail automatically during creation."""
         center_detail = self.request.user.center_detail
-        projected_usage = _patient_report_projected_usage_bytes(center_detail, serializer)
-        plan = _get_plan_for_center(center_detail)
-        _enforce_quota(
-            plan.patient_report_storage_quota_mb,
-            projected_usage,
-            "patient_report_storage_quota_mb",
-        )
+        with time_quota_check("patient_report_storage_quota_mb"):
+            projected_usage = _patient_report_projected_usage_bytes(center_detail, serializer)
+            plan = _get_plan_for_center(center_detail)
+            _enforce_quota(
+                plan.patient_report_storage_quota_mb,
+                projected_usage,
+                "patient_report_storage_quota_mb",
+            )
         instance = serializer.save(center_detail=self.request.user.center_detail)
         _safe_audit_log(
             user=self.request.user,
@@ -621,13 +809,14 @@ class PatientReportViewset(CenterDetailFilterMixin, viewsets.ModelViewSet):
     def perform_update(self, serializer):
         """Assigns the center_detail automatically during an update."""
         center_detail = self.request.user.center_detail
-        projected_usage = _patient_report_projected_usage_bytes(center_detail, serializer)
-        plan = _get_plan_for_center(center_detail)
-        _enforce_quota(
-            plan.patient_report_storage_quota_mb,
-            projected_usage,
-            "patient_report_storage_quota_mb",
-        )
+        with time_quota_check("patient_report_storage_quota_mb"):
+            projected_usage = _patient_report_projected_usage_bytes(center_detail, serializer)
+            plan = _get_plan_for_center(center_detail)
+            _enforce_quota(
+                plan.patient_report_storage_quota_mb,
+                projected_usage,
+                "patient_report_storage_quota_mb",
+            )
         instance = serializer.save(center_detail=self.request.user.center_detail)
         _safe_audit_log(
             user=self.request.user,
@@ -674,13 +863,14 @@ class SampleTestReportViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         center_detail = self.request_detail
-        projected_usage = _sample_report_projected_usage_bytes(center_detail, serializer)
-        plan = _get_plan_for_center(center_detail)
-        _enforce_quota(
-            plan.server_report_storage_quota_mb,
-            projected_usage,
-            "server_report_storage_quota_mb",
-        )
+        with time_quota_check("server_report_storage_quota_mb"):
+            projected_usage = _sample_report_projected_usage_bytes(center_detail, serializer)
+            plan = _get_plan_for_center(center_detail)
+            _enforce_quota(
+                plan.server_report_storage_quota_mb,
+                projected_usage,
+                "server_report_storage_quota_mb",
+            )
         instance = serializer.save(center_detail=self.request_detail)
         _safe_audit_log(
             user=self.request.user,
@@ -700,13 +890,14 @@ class SampleTestReportViewSet(CenterDetailFilterMixin, viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         center_detail = self.request_detail
-        projected_usage = _sample_report_projected_usage_bytes(center_detail, serializer)
-        plan = _get_plan_for_center(center_detail)
-        _enforce_quota(
-            plan.server_report_storage_quota_mb,
-            projected_usage,
-            "server_report_storage_quota_mb",
-        )
+        with time_quota_check("server_report_storage_quota_mb"):
+            projected_usage = _sample_report_projected_usage_bytes(center_detail, serializer)
+            plan = _get_plan_for_center(center_detail)
+            _enforce_quota(
+                plan.server_report_storage_quota_mb,
+                projected_usage,
+                "server_report_storage_quota_mb",
+            )
         instance = serializer.save(center_detail=self.request_detail)
         _safe_audit_log(
             user=self.request.user,
@@ -733,171 +924,80 @@ class ReferralStatsViewSet(viewsets.ViewSet):
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
 
+    @conditional_get('reference', 'categories', 'bills', daily=True)
     def list(self, request):
         tz = get_default_timezone()
-        today = now().astimezone(tz).date()
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        start_of_month = today.replace(day=1)
-        _, end_of_month_day = monthrange(today.year, today.month)
-        end_of_month = today.replace(day=end_of_month_day)
-        start_of_year = today.replace(month=1, day=1)
-        end_of_year = today.replace(month=12, day=31)
+        periods = calendar_periods(now().astimezone(tz).date())
         doctor_id = request.query_params.get("referred_by_doctor")
-
-        def bills_in_range(start_date, end_date):
-            start_dt = make_aware(datetime.combine(start_date, datetime.min.time()), timezone=tz)
-            end_dt = make_aware(datetime.combine(end_date, datetime.max.time()), timezone=tz)
-            qs = Bill.objects.filter(center_detail=request.user.center_detail, date_of_bill__range=(start_dt, end_dt))
-            if doctor_id:
-                qs = qs.filter(referred_by_doctor_id=doctor_id)
-            return qs
-
-        def get_referral_stats(qs):
-            grouped = list(
-                qs.values("referred_by_doctor")
-                .annotate(
-                    doctor_full_name=Concat("referred_by_doctor__first_name", Value(" "), "referred_by_doctor__last_name"),
-                    total=Count("id", distinct=True),
-                    ultrasound=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="Ultrasound"), distinct=True),
-                    ecg=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="ECG"), distinct=True),
-                    xray=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="X-Ray"), distinct=True),
-                    pathology=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="Pathology"), distinct=True),
-                    franchise_lab=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__is_franchise_lab=True), distinct=True),
-                )
-                .values("referred_by_doctor__id", "doctor_full_name", "total", "ultrasound", "ecg", "xray", "pathology", "franchise_lab")
-                .order_by("-total")
-            )
-
-            incentive_map = {
-                row["referred_by_doctor"]: row["total_incentive"] or 0
-                for row in qs.values("referred_by_doctor").annotate(total_incentive=Sum("incentive_amount"))
-            }
-
-            for row in grouped:
-                row["incentive_amount"] = incentive_map.get(row["referred_by_doctor__id"], 0)
-
-            return grouped
-
-        all_time_qs = Bill.objects.filter(center_detail=request.user.center_detail)
-        if doctor_id:
-            all_time_qs = all_time_qs.filter(referred_by_doctor_id=doctor_id)
-
-        data = {
-            "this_week": get_referral_stats(bills_in_range(start_of_week, end_of_week)),
-            "this_month": get_referral_stats(bills_in_range(start_of_month, end_of_month)),
-            "this_year": get_referral_stats(bills_in_range(start_of_year, end_of_year)),
-            "all_time": get_referral_stats(all_time_qs),
-        }
-        return Response(data)
+        return Response(referral_stats(request.user.center_detail_id, periods, tz, doctor_id))
 
 class BillChartStatsViewSet(viewsets.ViewSet):
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
 
+    @conditional_get('reference', 'categories', 'bills', daily=True)
     def list(self, request):
+        """
+        Bills per `granularity` (day, week or month) for this week, month
+        and year, or for the `start`..`end` range (YYYY-MM-DD) when given.
+        """
         tz = get_default_timezone()
-        today = now().astimezone(tz).date()
-        doctor_id = request.query_params.get("referred_by_doctor")
-
-        def get_chart_stats(start_date, end_date):
-            start_dt = make_aware(datetime.combine(start_date, datetime.min.time()), tz)
-            end_dt = make_aware(datetime.combine(end_date, datetime.max.time()), tz)
-            qs = Bill.objects.filter(center_detail=request.user.center_detail, date_of_bill__range=(start_dt, end_dt))
-            if doctor_id:
-                qs = qs.filter(referred_by_doctor_id=doctor_id)
-            return (
-                qs.annotate(day=TruncDate("date_of_bill"))
-                .values("day")
-                .annotate(
-                    total=Count("id", distinct=True),
-                    ultrasound=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="Ultrasound"), distinct=True),
-                    ecg=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="ECG"), distinct=True),
-                    xray=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="X-Ray"), distinct=True),
-                    pathology=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__name="Pathology"), distinct=True),
-                    franchise_lab=Count("id", filter=Q(bill_diagnosis_types__diagnosis_type__category__is_franchise_lab=True), distinct=True),
-                )
-                .order_by("day")
-            )
-
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        start_of_month = today.replace(day=1)
-        _, end_of_month_day = monthrange(today.year, today.month)
-        end_of_month = today.replace(day=end_of_month_day)
-        start_of_year = today.replace(month=1, day=1)
-        end_of_year = today.replace(month=12, day=31)
-
-        data = {
-            "this_week": get_chart_stats(start_of_week, end_of_week),
-            "this_month": get_chart_stats(start_of_month, end_of_month),
-            "this_year": get_chart_stats(start_of_year, end_of_year),
-        }
-        return Response(data)
+        params = request.query_params
+        granularity = params.get("granularity", "day")
+        if granularity not in CHART_GRANULARITIES:
+            raise DRFValidationError({"granularity": f"Use one of: {', '.join(CHART_GRANULARITIES)}."})
+        if "start" in params or "end" in params:
+            periods = {"range": self._range(params, granularity)}
+        else:
+            periods = calendar_periods(now().astimezone(tz).date())
+        doctor_id = params.get("referred_by_doctor")
+        return Response(bill_chart_stats(request.user.center_detail_id, periods, tz, doctor_id, granularity))
+
+    @staticmethod
+    def _range(params, granularity):
+        try:
+            start_date = date.fromisoformat(params.get("start", ""))
+            end_date = date.fromisoformat(params.get("end", ""))
+        except ValueError:
+            raise DRFValidationError({"detail": "Give both start and end as YYYY-MM-DD."})
+        if start_date > end_date:
+            raise DRFValidationError({"end": "The end must not be before the start."})
+        if len(calendar_buckets(start_date, end_date, granularity)) > CHART_MAX_BUCKETS:
+            raise DRFValidationError({
+                "granularity": f"The range has more than {CHART_MAX_BUCKETS} {granularity}s; use a coarser granularity.",
+            })
+        return start_date, end_date
 class DoctorBillGrowthStatsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
 
-    def get_quarter_range(self, year, quarter):
-        if quarter == 1:
-            return date(year, 1, 1), date(year, 3, 31)
-        elif quarter == 2:
-            return date(year, 4, 1), date(year, 6, 30)
-        elif quarter == 3:
-            return date(year, 7, 1), date(year, 9, 30)
-        else:
-            return date(year, 10, 1), date(year, 12, 31)
-
-    def get_month_range(self, year, month):
-        first_day = date(year, month, 1)
-        _, last_day_num = monthrange(year, month)
-        last_day = date(year, month, last_day_num)
-        return first_day, last_day
-
     def aggregate(self, qs):
         # This is the updated method
         aggregates = qs.aggregate(
             total_bills=Count('id'),
             total_incentive=Sum('incentive_amount')
         )
-        diagnosis_counts = qs.values('bill_diagnosis_types__diagnosis_type__category__name').annotate(count=Count('id', distinct=True))
 
         return {
             "total_bills": aggregates['total_bills'] or 0,
             "total_incentive": aggregates['total_incentive'] or 0,
             # This line was added to include the breakdown in the response
-            "diagnosis_counts": {
-                item['bill_diagnosis_types__diagnosis_type__category__name']: item['count']
-                for item in diagnosis_counts if item['bill_diagnosis_types__diagnosis_type__category__name']
-            }
+            "diagnosis_counts": category_counts(qs),
         }
 
     def get_filtered_queryset(self, start_date, end_date, base_qs):
-        return base_qs.filter(date_of_bill__date__range=(start_date, end_date))
+        return base_qs.filter(in_date_range('date_of_bill', start_date, end_date))
 
+    @conditional_get('reference', 'categories', 'bills', daily=True)
     def get(self, request, doctor_id, format=None):
-        today = now().date()
+        today = localdate()
         base_qs = Bill.objects.filter(
             center_detail=request.user.center_detail,
             referred_by_doctor_id=doctor_id
         )
-        first_curr_month, last_curr_month = self.get_month_range(today.year, today.month)
-        prev_month_date = first_curr_month - timedelta(days=1)
-        first_prev_month, last_prev_month = self.get_month_range(prev_month_date.year, prev_month_date.month)
-        first_curr_year, last_curr_year = date(today.year, 1, 1), date(today.year, 12, 31)
-        first_prev_year, last_prev_year = date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
-        current_quarter = (today.month - 1) // 3 + 1
-        first_curr_quarter, last_curr_quarter = self.get_quarter_range(today.year, current_quarter)
-        prev_quarter_year, prev_quarter = (today.year - 1, 4) if current_quarter == 1 else (today.year, current_quarter - 1)
-        first_prev_quarter, last_prev_quarter = self.get_quarter_range(prev_quarter_year, prev_quarter)
-
         data = {
-            "current_month": self.aggregate(self.get_filtered_queryset(first_curr_month, last_curr_month, base_qs)),
-            "previous_month": self.aggregate(self.get_filtered_queryset(first_prev_month, last_prev_month, base_qs)),
-            "current_year": self.aggregate(self.get_filtered_queryset(first_curr_year, last_curr_year, base_qs)),
-            "previous_year": self.aggregate(self.get_filtered_queryset(first_prev_year, last_prev_year, base_qs)),
-            "current_quarter": self.aggregate(self.get_filtered_queryset(first_curr_quarter, last_curr_quarter, base_qs)),
-            "previous_quarter": self.aggregate(self.get_filtered_queryset(first_prev_quarter, last_prev_quarter, base_qs)),
+            period: self.aggregate(self.get_filtered_queryset(start_date, end_date, base_qs))
+            for period, (start_date, end_date) in growth_periods(today).items()
         }
         return Response(data)
 
@@ -905,57 +1005,41 @@ class BillGrowthStatsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
 
-    def get_quarter_range(self, year, quarter):
-        if quarter == 1:
-            return date(year, 1, 1), date(year, 3, 31)
-        elif quarter == 2:
-            return date(year, 4, 1), date(year, 6, 30)
-        elif quarter == 3:
-            return date(year, 7, 1), date(year, 9, 30)
-        else:
-            return date(year, 10, 1), date(year, 12, 31)
+    @conditional_get('reference', 'categories', 'bills', daily=True)
+    def get(self, request, format=None):
+        return Response(bill_growth_stats(request.user.center_detail_id, localdate()))
 
-    def get_month_range(self, year, month):
-        first_day = date(year, month, 1)
-        _, last_day_num = monthrange(year, month)
-        last_day = date(year, month, last_day_num)
-        return first_day, last_day
 
-    def aggregate(self, qs):
-        total_bills = qs.values('id').distinct().count()
-        diagnosis_counts = qs.values('bill_diagnosis_types__diagnosis_type__category__name').annotate(count=Count('id', distinct=True))
-        return {
-            "total_bills": total_bills,
-            "diagnosis_counts": {
-                item['bill_diagnosis_types__diagnosis_type__category__name']: item['count']
-                for item in diagnosis_counts if item['bill_diagnosis_types__diagnosis_type__category__name']
-            }
-        }
-
-    def get_filtered_queryset(self, start_date, end_date, base_qs):
-        return base_qs.filter(date_of_bill__date__range=(start_date, end_date))
+class DashboardView(APIView):
+    """
+    Every home-screen widget in one response: the verified account, the
+    referral, chart and growth stats and the pending reports. The widgets
+    are independent, so they are computed side by side (see
+    run_concurrently), and `timings_ms` reports what each one took.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
 
     def get(self, request, format=None):
-        today = now().date()
-        base_qs = Bill.objects.filter(center_detail=request.user.center_detail)
-        first_curr_month, last_curr_month = self.get_month_range(today.year, today.month)
-        prev_month_date = first_curr_month - timedelta(days=1)
-        first_prev_month, last_prev_month = self.get_month_range(prev_month_date.year, prev_month_date.month)
-        first_curr_year, last_curr_year = date(today.year, 1, 1), date(today.year, 12, 31)
-        first_prev_year, last_prev_year = date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
-        current_quarter = (today.month - 1) // 3 + 1
-        first_curr_quarter, last_curr_quarter = self.get_quarter_range(today.year, current_quarter)
-        prev_quarter_year, prev_quarter = (today.year - 1, 4) if current_quarter == 1 else (today.year, current_quarter - 1)
-        first_prev_quarter, last_prev_quarter = self.get_quarter_range(prev_quarter_year, prev_quarter)
-
-        data = {
-            "current_month": self.aggregate(self.get_filtered_queryset(first_curr_month, last_curr_month, base_qs)),
-            "previous_month": self.aggregate(self.get_filtered_queryset(first_prev_month, last_prev_month, base_qs)),
-            "current_year": self.aggregate(self.get_filtered_queryset(first_curr_year, last_curr_year, base_qs)),
-            "previous_year": self.aggregate(self.get_filtered_queryset(first_prev_year, last_prev_year, base_qs)),
-            "current_quarter": self.aggregate(self.get_filtered_queryset(first_curr_quarter, last_curr_quarter, base_qs)),
-            "previous_quarter": self.aggregate(self.get_filtered_queryset(first_prev_quarter, last_prev_quarter, base_qs)),
-        }
+        center_id = request.user.center_detail_id
+        doctor_id = request.query_params.get("referred_by_doctor")
+        tz = get_default_timezone()
+        periods = calendar_periods(now().astimezone(tz).date())
+        today = localdate()
+
+        data, seconds = run_concurrently({
+            "referral_stats": lambda: referral_stats(center_id, periods, tz, doctor_id),
+            "bill_chart_stats": lambda: bill_chart_stats(center_id, periods, tz, doctor_id),
+            "bill_growth_stats": lambda: bill_growth_stats(center_id, today),
+            "pending_reports": lambda: {
+                "count": PendingReportCount.current(center_id),
+                "results": MinimalBillSerializerForPendingReports(
+                    pending_report_bills(center_id)[:PENDING_REPORTS_LIMIT], many=True,
+                ).data,
+            },
+        })
+        data["auth"] = verified_user_data(request.user)
+        data["timings_ms"] = {name: round(value * 1000, 2) for name, value in seconds.items()}
         return Response(data)
 
 
@@ -999,58 +1083,18 @@ class DoctorIncentiveStatsView(APIView):
 
     def get_date_ranges(self, today):
         """Helper to calculate all required start and end dates."""
-        # Month Ranges
-        first_curr_month = today.replace(day=1)
-        _, last_day_num = monthrange(today.year, today.month)
-        last_curr_month = today.replace(day=last_day_num)
-
-        last_prev_month = first_curr_month - timedelta(days=1)
-        first_prev_month = last_prev_month.replace(day=1)
-
-        # Quarter Ranges
-        current_quarter = (today.month - 1) // 3 + 1
-        if current_quarter == 1:
-            first_curr_quarter, last_curr_quarter = date(today.year, 1, 1), date(today.year, 3, 31)
-            first_prev_quarter, last_prev_quarter = date(today.year - 1, 10, 1), date(today.year - 1, 12, 31)
-        elif current_quarter == 2:
-            first_curr_quarter, last_curr_quarter = date(today.year, 4, 1), date(today.year, 6, 30)
-            first_prev_quarter, last_prev_quarter = date(today.year, 1, 1), date(today.year, 3, 31)
-        elif current_quarter == 3:
-            first_curr_quarter, last_curr_quarter = date(today.year, 7, 1), date(today.year, 9, 30)
-            first_prev_quarter, last_prev_quarter = date(today.year, 4, 1), date(today.year, 6, 30)
-        else: # Quarter 4
-            first_curr_quarter, last_curr_quarter = date(today.year, 10, 1), date(today.year, 12, 31)
-            first_prev_quarter, last_prev_quarter = date(today.year, 7, 1), date(today.year, 9, 30)
-
-        # Year Ranges
-        first_curr_year, last_curr_year = date(today.year, 1, 1), date(today.year, 12, 31)
-        first_prev_year, last_prev_year = date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
-
-        return {
-            "current_month": (first_curr_month, last_curr_month),
-            "previous_month": (first_prev_month, last_prev_month),
-            "current_quarter": (first_curr_quarter, last_curr_quarter),
-            "previous_quarter": (first_prev_quarter, last_prev_quarter),
-            "current_year": (first_curr_year, last_curr_year),
-            "previous_year": (first_prev_year, last_prev_year),
-        }
+        return growth_periods(today)
 
     def aggregate_incentives(self, qs):
         """Helper to perform the incentive aggregation on a queryset."""
         total_incentive_data = qs.aggregate(total=Sum('incentive_amount', default=0))
         total_bills = qs.values('id').distinct().count()
 
-        breakdown_data = qs.values('bill_diagnosis_types__diagnosis_type__category__name').annotate(
-            category_total=Sum('incentive_amount')
-        ).order_by()
 
         return {
             "total_bills": total_bills,
             "total_incentive": total_incentive_data['total'] or 0,
-            "diagnosis_counts": {
-                item['bill_diagnosis_types__diagnosis_type__category__name']: item['category_total']
-                for item in breakdown_data if item['bill_diagnosis_types__diagnosis_type__category__name']
-            }
+            "diagnosis_counts": category_incentives(qs),
         }
 
     def get(self, request, doctor_id, format=None):
@@ -1076,13 +1120,13 @@ class DoctorIncentiveStatsView(APIView):
             base_qs = base_qs.filter(status_query)
 
         # 3. Get all date ranges and calculate stats for each period
-        today = now().date()
+        today = localdate()
         # ✅ FIXED THE TYPO HERE (get_date_ranges is now plural)
         date_ranges = self.get_date_ranges(today)
 
         response_data = {}
         for period, (start_date, end_date) in date_ranges.items():
-            period_qs = base_qs.filter(date_of_bill__date__range=(start_date, end_date))
+            period_qs = base_qs.filter(in_date_range('date_of_bill', start_date, end_date))
             response_data[period] = self.aggregate_incentives(period_qs)
 
         return Response(response_data)
@@ -1102,14 +1146,14 @@ class FlexibleIncentiveReportView(APIView):
             except ValueError:
                 return Response({"error": "Invalid date format. Please use YYYY-MM-DD."}, status=400)
         else:
-            today = now().date()
+            today = localdate()
             start_date = today.replace(day=1)
             end_date = today
 
         # 2. Build the base queryset with initial filters
         base_qs = Bill.objects.filter(
+            in_date_range('date_of_bill', start_date, end_date),
             center_detail=request.user.center_detail,
-            date_of_bill__date__range=(start_date, end_date)
         )
 
         # 3. Apply all flexible, multi-value filters from query parameters
@@ -1137,6 +1181,8 @@ class FlexibleIncentiveReportView(APIView):
 
         final_bills = base_qs.select_related(
             'referred_by_doctor', 'franchise_name'
+        ).prefetch_related(
+            'referred_by_doctor__category_percentages', 'bill_diagnosis_types__diagnosis_type__category'
         ).order_by(
             'referred_by_doctor__first_name',
             'referred_by_doctor__last_name',
@@ -1184,25 +1230,80 @@ class FlexibleIncentiveReportView(APIView):
         return Response(response_data)
 
 class PendingReportViewSet(CenterDetailFilterMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Bills of the user's center still waiting for a report, newest first, in
+    cursor pages. Filter by `referred_by_doctor` or `category`, among others.
+    """
     serializer_class = MinimalBillSerializerForPendingReports
     queryset = Bill.objects.all()
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
+    pagination_class = PendingReportPagination
     filter_backends = [DjangoFilterBackend, SearchFilter]
-    filterset_class = BillFilter
+    filterset_class = PendingReportFilter
     search_fields = [
         "bill_number",
         "patient_name",
         "bill_diagnosis_types__diagnosis_type__name",
-        "bill_diagnosis_types__diagnosis_type__category__name",
+        "bill_diagnosis_types__category__name",
         "referred_by_doctor__first_name",
         "referred_by_doctor__last_name",
     ]
 
     def get_queryset(self):
-        base_queryset = super().get_queryset()
+        return super().get_queryset().filter(has_report=False).order_by("-date_of_bill", "-id")
+
+    def pending_count(self, queryset):
+        """The maintained count of the whole queue; a filtered queue is counted."""
+        if set(self.request.query_params) - {"cursor", "page_size"}:
+            return queryset.count()
+        return PendingReportCount.current(self.request.user.center_detail_id)
+
+# ========================
+# PATIENT VIEWSET
+# ========================
+
+class PatientViewSet(CenterDetailFilterMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Patients of the user's center, with phone-number autocomplete for the
+    reception desk and each patient's visit history.
+    """
+    queryset = Patient.objects.all()
+    serializer_class = PatientSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated, IsUserNotLocked, IsSubscriptionActive]
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        return super().get_queryset().order_by("phone_number")
+
+    @action(detail=False, methods=["get"], url_path=DIAG_PATIENT_AUTOCOMPLETE)
+    def autocomplete(self, request):
+        """Patients whose phone number starts with the digits typed so far (`phone`)."""
+        prefix = request.query_params.get("phone", "").strip()
+        if (
+            not prefix.isdigit()
+            or prefix.startswith("0")
+            or len(prefix) < settings.PATIENT_AUTOCOMPLETE_MIN_DIGITS
+        ):
+            return Response([])
+
+        patients = self.get_queryset().filter(Patient.phone_prefix_filter(prefix))
+        limit = settings.PATIENT_AUTOCOMPLETE_LIMIT
+        return Response(PatientSerializer(patients[:limit], many=True).data)
+
+    @action(detail=True, methods=["get"], url_path=DIAG_PATIENT_VISITS)
+    def visits(self, request, pk=None):
+        """The patient's bills, newest first."""
+        patient = self.get_object()
+        bills = patient.bills.order_by("-date_of_bill")
+        page = self.paginate_queryset(bills)
+        if page is not None:
+            return self.get_paginated_response(PatientVisitSerializer(page, many=True).data)
+        return Response(PatientVisitSerializer(bills, many=True).data)
+
 
-        return base_queryset.filter(report__isnull=True).order_by("-date_of_bill", "-id")[:40]# ========================
+# ========================
 # CATEGORY VIEWSET
 # ========================
 
@@ -1228,6 +1329,13 @@ class DiagnosisCategoryViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated(), IsUserNotLocked(), IsSubscriptionActive(), IsAdminUser()]
         return [permissions.IsAuthenticated(), IsUserNotLocked(), IsSubscriptionActive()]
 
+    @conditional_get('categories')
+    def list(self, request, *args, **kwargs):
+        # The unfiltered list comes from the reference-data cache.
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        return Response(get_category_list())
+
     def perform_create(self, serializer):
         instance = serializer.save()
         _safe_audit_log(
@@ -1250,6 +1358,27 @@ class DiagnosisCategoryViewSet(viewsets.ModelViewSet):
             request=self.request,
         )
 
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        bill_lines = BillDiagnosisType.objects.filter(diagnosis_type__category=instance)
+        if not _is_large_cascade(bill_lines):
+            self.perform_destroy(instance)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        run_in_background(PendingDeletion.objects.create(category=instance).run)
+        _safe_audit_log(
+            user=request.user,
+            action='DELETE',
+            model_name='DiagnosisCategory',
+            object_id=instance.pk,
+            details=f"Scheduled background deletion of diagnosis category {instance.name}",
+            request=request,
+        )
+        return Response(
+            {"detail": "Deletion of this category and its bills is running in the background."},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
     def perform_destroy(self, instance):
         category_name = instance.name
         category_id = instance.pk
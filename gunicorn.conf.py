@@ -0,0 +1,24 @@
+"""
+Gunicorn settings, read from the working directory at startup.
+
+With PROMETHEUS_MULTIPROC_DIR set, the workers share their metrics through
+files in that directory: it is emptied when the server starts, and workers
+that exit are marked dead so their samples stop counting as live.
+"""
+import glob
+import os
+
+
+def on_starting(server):
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)